@@ -0,0 +1,338 @@
+import asyncio
+import logging
+
+import config
+import consts
+from charset import encode_auto
+from codec import HEADER, PDUView
+from command import get_command_id
+from framing import FrameReader
+from inflight import InFlightTable
+from keepalive import Keepalive
+from latency import SUBMIT_TO_RECEIPT, latency
+from metrics import INFLIGHT, PDUS_RECEIVED, RECEIPTS_PENDING, REQUEST_TIMEOUTS, count_receipt, count_sent, \
+    metrics, new_session_id
+from receipt import SubmitIndex, parse_receipt
+from ratelimit import TokenBucket
+from sequence import SequenceAllocator
+from writer import PRIORITY_HIGH, get_priority, set_nodelay
+from template import get_template
+from utils import get_pdu
+
+DELIVER_SM = get_command_id("deliver_sm")
+SUBMIT_SM_RESP = get_command_id("submit_sm_resp")
+ENQUIRE_LINK = get_command_id("enquire_link")
+UNBIND = get_command_id("unbind")
+
+
+class AsyncSMPPClient(asyncio.BufferedProtocol):
+    """
+    基于asyncio的SMPP客户端,最多window个请求同时在途,每个请求对应一个按sequence_number匹配响应的future
+    """
+
+    def __init__(self, host=None, window=config.WINDOW_SIZE, timeout=config.RESPONSE_TIMEOUT, limiter=None,
+                 submitted=None):
+        """
+        :param host: 客户端绑定的本地地址,为None时由系统选择
+        :param window: 在途请求数上限
+        :param timeout: 默认的响应超时时间(秒)
+        :param limiter: 发送限速的令牌桶,为None时按config.RATE_LIMIT_TPS创建
+        :param submitted: 等待状态报告的SubmitIndex,多个绑定可以共用,为None时单独创建
+        """
+        self.host = host
+        self.window = asyncio.Semaphore(window)
+        self.transport = None
+        # 本轮事件循环中待发送的数据,按优先级分两条队列,在循环末尾合并成一次写入
+        self.outbox = ([], [])
+        self.flush_handle = None
+        self.reader = FrameReader(None)
+        self.sequence = SequenceAllocator()
+        self.client_state = consts.CLIENT_STATE_CLOSED
+        # 在途请求,context为等待响应的future,时间轮由事件循环按tick推进
+        self.inflight = InFlightTable(timeout, on_timeout=self.expire)
+        self.limiter = limiter or TokenBucket()
+        # 等待状态报告的submit_sm,按message_id匹配
+        self.submitted = SubmitIndex() if submitted is None else submitted
+        # 指标中的session标签
+        self.session_id = new_session_id()
+        INFLIGHT.track(self.inflight, len, self.session_id)
+        RECEIPTS_PENDING.track(self.submitted, len)
+        latency.start()
+        metrics.start()
+        self.ticker = None
+        self.closed = None
+        # 链路空闲时才发送enquire_link,和在途请求共用时间轮
+        self.keepalive = Keepalive(self.inflight.wheel, self.probe, self.handle_link_dead)
+        # 收到deliver_sm时的回调,参数为只在回调期间有效的PDUView
+        self.on_deliver_sm = None
+        # 收到状态报告时的回调,参数为(Receipt, 对应的Submission或None)
+        self.on_receipt = None
+        self.logger = logging.getLogger(__name__)
+
+    async def connect(self, host=config.SMPP_SERVER_HOST, port=config.SMPP_SERVER_PORT):
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        local_addr = (self.host, 0) if self.host else None
+        await loop.create_connection(lambda: self, host, port, local_addr=local_addr)
+        self.logger.info(f"{self.transport.get_extra_info('sockname')}连接到{host}:{port}")
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client_state = consts.CLIENT_STATE_OPEN
+        # 重连时丢弃上一个连接残留的半包
+        self.reader = FrameReader(None)
+        set_nodelay(transport.get_extra_info("socket"))
+        self.ticker = asyncio.get_running_loop().call_later(self.inflight.wheel.tick, self.tick)
+
+    def tick(self):
+        self.inflight.wheel.advance()
+        if self.transport is not None:
+            self.ticker = asyncio.get_running_loop().call_later(self.inflight.wheel.tick, self.tick)
+
+    def connection_lost(self, exc):
+        self.logger.warning(f"与SMSC的连接已断开{f',{exc}' if exc else ''}")
+        self.transport = None
+        self.client_state = consts.CLIENT_STATE_CLOSED
+        self.keepalive.stop()
+        if self.ticker:
+            self.ticker.cancel()
+        for request in self.inflight.clear():
+            if not request.context.done():
+                request.context.set_exception(ConnectionError("连接已断开"))
+        if self.closed and not self.closed.done():
+            self.closed.set_result(None)
+
+    def get_buffer(self, sizehint):
+        return self.reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        reader = self.reader
+        reader.end += nbytes
+        try:
+            for offset in reader.frames():
+                self.dispatch(reader.buf, offset)
+        except ValueError as e:
+            self.logger.error(f"{e},断开连接")
+            self.transport.abort()
+
+    def dispatch(self, buf, offset):
+        self.keepalive.touch()
+        command_length, command_id, command_status, sequence_number = HEADER.unpack_from(buf, offset)
+        PDUS_RECEIVED.inc(command_id, command_status, self.session_id)
+        if command_id & consts.COMMAND_RESP_BIT:
+            # 响应(包括generic_nack)按序列号交给等待的请求,接收缓冲区会被复用,所以拷贝出来
+            request = self.inflight.pop(sequence_number, command_status)
+            if request is None:
+                self.logger.warning(f"收到未知请求的响应,command_id={command_id:#010x},"
+                                    f"sequence_number={sequence_number}")
+                return
+            self.limiter.feedback(command_status)
+            latency.record_since(request.command_name, request.timestamp)
+            resp = PDUView(bytes(buf[offset:offset + command_length]))
+            if command_id == SUBMIT_SM_RESP and command_status == consts.ESME_ROK:
+                self.submitted.add(resp.message_id, sequence_number, request.timestamp)
+            if not request.context.done():
+                request.context.set_result(resp)
+        elif command_id == DELIVER_SM:
+            pdu = PDUView(buf, offset)
+            receipt = parse_receipt(pdu)
+            if receipt is not None:
+                submission = self.submitted.match(receipt.message_id)
+                count_receipt(receipt, submission)
+                if submission is not None:
+                    latency.record_since(SUBMIT_TO_RECEIPT, submission.timestamp)
+                if self.on_receipt:
+                    self.on_receipt(receipt, submission)
+            if self.on_deliver_sm:
+                self.on_deliver_sm(pdu)
+            self.respond("deliver_sm_resp", sequence_number)
+        elif command_id == ENQUIRE_LINK:
+            self.respond("enquire_link_resp", sequence_number)
+        elif command_id == UNBIND:
+            self.respond("unbind_resp", sequence_number)
+            self.client_state = consts.CLIENT_STATE_OPEN
+            self.flush()
+            self.transport.close()
+        else:
+            self.logger.info(f"收到未处理的请求:{PDUView(buf, offset)}")
+
+    def respond(self, command_name, sequence_number, command_status=consts.ESME_ROK):
+        pdu = get_pdu(command_name)(command_id=get_command_id(command_name), command_status=command_status,
+                                    sequence_number=sequence_number)
+        self.write(pdu.pack(), PRIORITY_HIGH)
+
+    def write(self, data, priority=None):
+        """
+        放入发送队列,同一轮事件循环中的全部PDU在flush中一次写入,响应和enquire_link/unbind排在前面
+        :param priority: 为None时按PDU头判断
+        """
+        if priority is None:
+            priority = get_priority(data)
+        self.outbox[priority].append(data)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        high, normal = self.outbox
+        if self.transport is not None and (high or normal):
+            pending = high + normal
+            self.transport.writelines(pending)
+            count_sent(pending, self.session_id)
+        high.clear()
+        normal.clear()
+
+    def expire(self, request):
+        REQUEST_TIMEOUTS.inc(request.command_name, self.session_id)
+        if not request.context.done():
+            request.context.set_exception(asyncio.TimeoutError(
+                f"{request.command_name}(sequence_number={request.sequence_number})等待响应超时"))
+
+    async def send(self, command_name, encode, timeout=None):
+        """
+        等待窗口空出后发送一个请求,不等待响应
+        :param command_name: 请求的命令名,记录在在途请求中
+        :param encode: 按sequence_number生成请求报文的函数
+        :param timeout: 响应超时时间(秒),为None时使用创建客户端时指定的超时
+        :return: 收到响应时完成的future,结果为响应的PDUView
+        """
+        await self.window.acquire()
+        await self.limiter.acquire_async()
+        if self.transport is None:
+            self.window.release()
+            raise ConnectionError("未连接到SMSC")
+        sequence_number = next(self.sequence)
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda _: self.window.release())
+        self.inflight.add(sequence_number, command_name, future, timeout)
+        self.write(encode(sequence_number))
+        return future
+
+    async def request(self, command_name, timeout=None, **kwargs):
+        """
+        发送请求并等待响应
+        :return: 响应的PDUView
+        """
+        command_id = get_command_id(command_name)
+        pdu_cls = get_pdu(command_name)
+
+        def encode(sequence_number):
+            return pdu_cls(command_id=command_id, command_status=0, sequence_number=sequence_number,
+                           **kwargs).pack()
+
+        return await (await self.send(command_name, encode, timeout))
+
+    @property
+    def connected(self):
+        return self.transport is not None
+
+    @property
+    def can_submit(self):
+        """
+        已连接并以TX或TRX方式绑定
+        """
+        return self.transport is not None and self.client_state in (consts.CLIENT_STATE_BOUND_TX,
+                                                                    consts.CLIENT_STATE_BOUND_TRX)
+
+    @property
+    def outstanding(self):
+        """
+        在途请求数,即窗口占用
+        """
+        return len(self.inflight)
+
+    async def bind(self, command_name="bind_transceiver"):
+        """
+        :param command_name: bind_transmitter,bind_receiver或bind_transceiver
+        """
+        body = {
+            'system_id': config.SYSTEM_ID,
+            'password': config.PASSWORD,
+            'system_type': "sms",
+            'interface_version': consts.VERSION_34,
+            'addr_ton': consts.TON_UNK,
+            'addr_npi': consts.NPI_ISDN,
+            'address_range': consts.NULL_BYTE,
+        }
+        resp = await self.request(command_name, **body)
+        if resp.command_status == consts.ESME_ROK:
+            self.logger.info(f"与SMSC绑定成功,{resp}")
+            self.client_state = consts.STATE_SETTERS[f"{command_name}_resp"]
+            self.keepalive.start()
+        else:
+            self.logger.error(f"绑定失败,{resp}")
+        return resp
+
+    async def bind_transceiver(self):
+        return await self.bind("bind_transceiver")
+
+    async def submit_sm_nowait(self, message, destination_addr=config.DESTINATION_ADDR, timeout=None,
+                               data_coding=None):
+        """
+        按预编码模板发送submit_sm,只等待窗口不等待响应
+        :param data_coding: 为None时str消息自动选择编码,bytes消息按ENCODING_DEFAULT发送
+        :return: 响应的future
+        """
+        if data_coding is None:
+            if type(message) == str:
+                data_coding, message = encode_auto(message)
+            else:
+                data_coding = consts.ENCODING_DEFAULT
+        template = get_template(config.SOURCE_ADDR, destination_addr, data_coding=data_coding, use_payload=True,
+                                tlvs=(('user_message_reference', 100),))
+        return await self.send("submit_sm", lambda sequence_number: template.pack(sequence_number, message), timeout)
+
+    async def submit_sm(self, message, destination_addr=config.DESTINATION_ADDR, timeout=None, data_coding=None):
+        return await (await self.submit_sm_nowait(message, destination_addr, timeout, data_coding))
+
+    async def submit_sm_many(self, messages, destination_addr=config.DESTINATION_ADDR, timeout=None):
+        """
+        流水线发送,窗口满时等待最早的响应
+        :return: 与messages一一对应的响应PDUView或异常
+        """
+        futures = [await self.submit_sm_nowait(message, destination_addr, timeout) for message in messages]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    async def enquire_link(self):
+        return await self.request("enquire_link")
+
+    def probe(self):
+        """
+        由时间轮在事件循环中调用,发送不占用窗口和限速的enquire_link,是否超时由keepalive按收到的数据判断
+        """
+        if self.transport is None:
+            return
+        sequence_number = next(self.sequence)
+        future = asyncio.get_running_loop().create_future()
+        # 结果不需要,取出异常避免未处理的警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.inflight.add(sequence_number, "enquire_link", future)
+        pdu = get_pdu("enquire_link")(command_id=ENQUIRE_LINK, command_status=0, sequence_number=sequence_number)
+        self.write(pdu.pack(), PRIORITY_HIGH)
+
+    def handle_link_dead(self):
+        self.logger.error(f"enquire_link在{self.keepalive.timeout}秒内没有响应,断开连接")
+        if self.transport is not None:
+            self.transport.abort()
+
+    async def unbind(self):
+        resp = await self.request("unbind")
+        if resp.command_status == consts.ESME_ROK:
+            self.logger.info(f"解绑成功,{resp}")
+            self.client_state = consts.STATE_SETTERS["unbind_resp"]
+        return resp
+
+    async def close(self):
+        if self.transport is None:
+            return
+        if self.client_state > consts.CLIENT_STATE_OPEN:
+            try:
+                await self.unbind()
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                self.logger.error(f"解绑失败,{e}")
+        if self.transport is not None:
+            self.flush()
+            self.transport.close()
+        await self.closed
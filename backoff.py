@@ -0,0 +1,15 @@
+import random
+
+import config
+
+
+def backoff_delays(base=config.RECONNECT_DELAY, maximum=config.RECONNECT_MAX_DELAY, jitter=config.RECONNECT_JITTER):
+    """
+    产出每次重连前等待的秒数: 第一次立即重连,之后按指数增长到maximum,
+    并在[delay * (1 - jitter), delay]之间随机,避免大量会话同时重连
+    """
+    yield 0
+    delay = base
+    while True:
+        yield random.uniform(delay * (1 - jitter), delay)
+        delay = min(delay * 2, maximum)
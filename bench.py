@@ -0,0 +1,106 @@
+import argparse
+import struct
+import time
+import tracemalloc
+
+import config
+import consts
+from charset import encode_auto, encode_gsm, encode_messages
+from codec import PDUView, decode_pdu, send_pdu
+from command import get_command_id
+from template import get_template
+from utils import get_pdu
+
+
+def submit_sm_body(message="daihui666"):
+    return {
+        "service_type": b'\x00',
+        "source_addr_ton": consts.TON_INTL,
+        "source_addr_npi": consts.NPI_ISDN,
+        "source_addr": config.SOURCE_ADDR,
+        "dest_addr_ton": consts.TON_INTL,
+        "dest_addr_npi": consts.NPI_ISDN,
+        "destination_addr": config.DESTINATION_ADDR,
+        "esm_class": 0,
+        "protocol_id": consts.PID_DEFAULT,
+        "priority_flag": 0,
+        "schedule_delivery_time": consts.NULL_BYTE,
+        "validity_period": consts.NULL_BYTE,
+        "registered_delivery": consts.SMSC_DELIVERY_RECEIPT_BOTH,
+        "replace_if_present_flag": 0,
+        "data_coding": consts.ENCODING_DEFAULT,
+        "sm_default_msg_id": 0,
+        "short_message": message,
+        'user_message_reference': 100,
+        'message_payload': message,
+    }
+
+
+def submit_sm_pdu(sequence_number=1, message="daihui666"):
+    return get_pdu("submit_sm")(command_id=get_command_id("submit_sm"), command_status=0,
+                                sequence_number=sequence_number, **submit_sm_body(message))
+
+
+class Sink:
+    """
+    丢弃数据的socket替身,只计算编码开销
+    """
+
+    @staticmethod
+    def sendall(data):
+        return len(data)
+
+
+def bench(name, func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    cost = time.perf_counter() - start
+    print(f"{name:<24}{n / cost:>12.0f} ops/s{cost / n * 1e6:>10.2f} us/op")
+
+
+def bench_encode(n):
+    pdu = submit_sm_pdu()
+    bench("submit_sm pack", lambda: Sink.sendall(pdu.pack()), n)
+    bench("submit_sm send_pdu", lambda: send_pdu(Sink, pdu), n)
+    template = get_template(config.SOURCE_ADDR, config.DESTINATION_ADDR, use_payload=True,
+                            tlvs=(('user_message_reference', 100),))
+    bench("submit_sm template", lambda: template.send(Sink, 1, "daihui666"), n)
+    bench("build+send_pdu", lambda: send_pdu(Sink, submit_sm_pdu()), n)
+
+
+def bench_charset(n):
+    messages = [f"daihui666 {i}" for i in range(1000)]
+    bench("encode_gsm", lambda: encode_gsm("daihui666"), n)
+    bench("encode_auto uncached", lambda: encode_auto.__wrapped__("你好daihui666"), n)
+    bench("encode_auto cached", lambda: encode_auto("你好daihui666"), n)
+    bench("encode_messages x1000", lambda: encode_messages(messages), max(n // 1000, 1))
+
+
+def measure(name, factory, n):
+    """
+    用tracemalloc统计n个对象常驻时平均每个占用的内存
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [factory(i) for i in range(n)]
+    cost = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{name:<24}{cost / len(items):>12.0f} bytes/PDU")
+
+
+def bench_memory(n):
+    resp = struct.pack(">4L", 26, get_command_id("submit_sm_resp"), 0, 1) + b"1234567890\x00"
+    measure("submit_sm PDU", lambda i: submit_sm_pdu(i), n)
+    measure("submit_sm record", lambda i: submit_sm_pdu(i).to_record(), n)
+    measure("submit_sm_resp PDU", lambda i: decode_pdu(resp), n)
+    measure("submit_sm_resp record", lambda i: PDUView(resp).to_record(), n)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="编解码性能测试")
+    parser.add_argument("-n", "--number", default=100000, type=int, help="每项执行次数")
+    args = parser.parse_args()
+    bench_encode(args.number)
+    bench_charset(args.number)
+    bench_memory(min(args.number, 10000))
@@ -0,0 +1,127 @@
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+import config
+import consts
+from charset import encode_auto
+from pool import SessionPool
+
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+
+logger = logging.getLogger(__name__)
+
+
+def open_input(path):
+    """
+    :param path: 文件路径,"-"表示标准输入,关闭时不关闭标准输入本身
+    """
+    if path == "-":
+        return open(sys.stdin.fileno(), encoding="utf-8", newline="", closefd=False)
+    return open(path, encoding="utf-8", newline="")
+
+
+def read_rows(f, fmt):
+    """
+    逐行读取,产出(行号, 目的地址, 短消息).CSV的列为destination_addr,message,可以没有表头;
+    JSONL每行为{"destination_addr": ..., "message": ...}.目的地址为空时使用config.DESTINATION_ADDR
+    """
+    if fmt == FORMAT_JSONL:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+                yield line_no, row.get("destination_addr") or config.DESTINATION_ADDR, row["message"]
+            except (ValueError, KeyError, AttributeError) as e:
+                logger.error(f"第{line_no}行格式错误,{e!r}")
+    else:
+        for line_no, row in enumerate(csv.reader(f), 1):
+            if not row or line_no == 1 and row[:2] == ["destination_addr", "message"]:
+                continue
+            if len(row) == 1:
+                yield line_no, config.DESTINATION_ADDR, row[0]
+            else:
+                yield line_no, row[0] or config.DESTINATION_ADDR, row[1]
+
+
+def encode_rows(rows):
+    """
+    编码阶段: 每条消息选择最省的编码
+    :return: (目的地址, 编码后的短消息, data_coding, 行号)
+    """
+    for line_no, destination_addr, message in rows:
+        data_coding, data = encode_auto(message)
+        yield destination_addr, data, data_coding, line_no
+
+
+class ResultWriter:
+    """
+    逐条写出发送结果并累计计数,不保留结果本身
+    """
+
+    def __init__(self, path=None):
+        self.file = open(path, "w", encoding="utf-8", newline="") if path else None
+        self.writer = csv.writer(self.file) if self.file else None
+        if self.writer:
+            self.writer.writerow(["line", "destination_addr", "command_status", "message_id", "error"])
+        self.ok = 0
+        self.failed = 0
+        self.start = time.monotonic()
+
+    def __call__(self, index, item, result):
+        destination_addr, line_no = item[0], item[3]
+        if isinstance(result, Exception):
+            self.failed += 1
+            row = [line_no, destination_addr, "", "", repr(result)]
+        else:
+            if result.command_status == consts.ESME_ROK:
+                self.ok += 1
+            else:
+                self.failed += 1
+            # generic_nack没有message_id
+            message_id = result.get("message_id")
+            message_id = message_id.decode() if message_id else ""
+            row = [line_no, destination_addr, f"{result.command_status:#010x}", message_id, ""]
+        if self.writer:
+            self.writer.writerow(row)
+        done = self.ok + self.failed
+        if done % config.BULK_REPORT_EVERY == 0:
+            logger.info(f"已完成{done}条,{done / (time.monotonic() - self.start):.0f}条/秒")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+async def run_bulk(path, fmt=None, output=None, binds=config.BIND_COUNT, window=config.WINDOW_SIZE,
+                   rate=config.RATE_LIMIT_TPS, host=config.SMPP_SERVER_HOST, port=config.SMPP_SERVER_PORT,
+                   local_host=None):
+    """
+    读取->编码->限速发送->记录结果,各阶段都是按需拉取的生成器,内存占用与文件大小无关
+    :param fmt: csv或jsonl,为None时按扩展名判断,标准输入默认为csv
+    :param output: 结果CSV文件,为None时只统计不写出
+    :param local_host: 客户端绑定的本地地址
+    :return: (成功数, 失败数)
+    """
+    if fmt is None:
+        fmt = FORMAT_JSONL if os.path.splitext(path)[1].lower() in (".jsonl", ".json") else FORMAT_CSV
+    pool = SessionPool(binds, host=local_host, window=window, rate=rate)
+    if not await pool.start(host, port):
+        return 0, 0
+    results = ResultWriter(output)
+    try:
+        with open_input(path) as f:
+            count = await pool.submit_each(encode_rows(read_rows(f, fmt)), results)
+    finally:
+        results.close()
+        await pool.close()
+    cost = time.monotonic() - results.start
+    logger.info(f"批量发送完成: 共{count}条,成功{results.ok},失败{results.failed},"
+                f"耗时{cost:.1f}秒,{count / cost if cost else 0:.0f}条/秒")
+    return results.ok, results.failed
@@ -0,0 +1,96 @@
+from functools import lru_cache
+
+import config
+import consts
+
+# GSM 03.38默认字母表,下标即编码,0x1B为扩展表转义符
+GSM_BASIC = "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?" \
+            "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+# GSM 03.38扩展表,编码为0x1B+下标
+GSM_EXTENSION = {
+    '\x0c': 0x0A, '^': 0x14, '{': 0x28, '}': 0x29, '\\': 0x2F,
+    '[': 0x3C, '~': 0x3D, ']': 0x3E, '|': 0x40, '€': 0x65,
+}
+GSM_ESCAPE = 0x1B
+
+# 预先算好的str.translate表,翻译后每个字符都小于0x80,可以直接按latin-1转成字节
+gsm_table = {ord(c): chr(i) for i, c in enumerate(GSM_BASIC) if i != GSM_ESCAPE}
+gsm_table.update({ord(c): chr(GSM_ESCAPE) + chr(i) for c, i in GSM_EXTENSION.items()})
+gsm_chars = frozenset(chr(k) for k in gsm_table)
+
+codecs = {
+    consts.ENCODING_IA5: "ascii",
+    consts.ENCODING_ISO88591: "latin-1",
+    consts.ENCODING_ISO88595: "iso8859-5",
+    consts.ENCODING_ISO88598: "iso8859-8",
+    consts.ENCODING_ISO10646: "utf-16be",
+}
+
+
+def encode_gsm(msg):
+    """
+    按GSM 03.38编码成未压缩的septet,每个字符一个字节,扩展表字符两个字节
+    """
+    if not gsm_chars.issuperset(msg):
+        pos = next(i for i, c in enumerate(msg) if c not in gsm_chars)
+        raise UnicodeEncodeError("gsm03.38", msg, pos, pos + 1, "GSM 03.38字母表中没有该字符")
+    return msg.translate(gsm_table).encode("latin-1")
+
+
+@lru_cache(maxsize=config.ENCODE_CACHE_SIZE)
+def encode_message(msg, data_coding):
+    """
+    按data_coding把短消息编码成字节,bytes按原样返回
+    """
+    if type(msg) != str:
+        return msg
+    if data_coding == consts.ENCODING_DEFAULT:
+        return encode_gsm(msg)
+    try:
+        return msg.encode(codecs[data_coding])
+    except KeyError:
+        raise ValueError(f"不支持的data_coding:{data_coding:#04x}")
+
+
+@lru_cache(maxsize=config.ENCODE_CACHE_SIZE)
+def encode_auto(msg):
+    """
+    选出能表示该消息且占用比特最少的编码: GSM 03.38(7位),Latin-1(8位),UCS-2(16位)
+    :return: (data_coding, 编码后的字节)
+    """
+    gsm = None
+    if gsm_chars.issuperset(msg):
+        gsm = msg.translate(gsm_table).encode("latin-1")
+        if len(gsm) * 7 <= len(msg) * 8:
+            return consts.ENCODING_DEFAULT, gsm
+    if msg.isascii() or max(msg) <= '\xff':
+        return consts.ENCODING_ISO88591, msg.encode("latin-1")
+    if gsm is not None:
+        return consts.ENCODING_DEFAULT, gsm
+    return consts.ENCODING_ISO10646, msg.encode("utf-16be")
+
+
+def get_data_coding(msg):
+    return encode_auto(msg)[0]
+
+
+def encode_messages(messages, data_coding=None):
+    """
+    批量编码
+    :param data_coding: 为None时每条消息单独选择编码
+    :return: [(data_coding, 编码后的字节)]
+    """
+    if data_coding is None:
+        return list(map(encode_auto, messages))
+    return [(data_coding, encode_message(msg, data_coding)) for msg in messages]
+
+
+def encode_cache_info():
+    """
+    :return: 编码缓存的命中/未命中统计
+    """
+    result = {}
+    for name, func in (("encode_message", encode_message), ("encode_auto", encode_auto)):
+        info = func.cache_info()
+        result[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+    return result
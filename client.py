@@ -1,109 +1,255 @@
 import logging
 import socket
-import struct
 import threading
 import time
 import os
 
 import config
 import consts
-from command import get_command_id, get_command_name
+from backoff import backoff_delays
+from charset import encode_auto, get_data_coding
+from codec import LONG, PDUView, send_pdu
+from command import get_command_id
+from framing import FrameReader
 from fuzz import fuzzer
-from utils import get_pdu, contains_chinese, create_dir
+from inflight import InFlightTable
+from keepalive import Keepalive
+from latency import SUBMIT_TO_RECEIPT, latency
+from log import category, setup_logging
+from metrics import INFLIGHT, PDUS_RECEIVED, RECEIPTS_PENDING, RECONNECTS, REQUEST_TIMEOUTS, count_receipt, \
+    metrics, new_session_id
+from receipt import SubmitIndex, parse_receipt
+from ratelimit import TokenBucket
+from registry import commands
+from sequence import SequenceAllocator
+from template import get_template
+from utils import get_pdu, create_dir
+from writer import SocketWriter, set_nodelay
+
+# 会话管理类的请求,断线后不重发
+SESSION_COMMANDS = {"bind_transmitter", "bind_receiver", "bind_transceiver", "unbind", "enquire_link"}
+# 高频日志的类别,可以在config.LOG_SAMPLING中按类别采样
+SUBMIT_LOG = category("submit_sm_resp")
+DATA_SM_LOG = category("data_sm_resp")
+DELIVER_LOG = category("deliver_sm")
+RECEIPT_LOG = category("receipt")
+FUZZ_LOG = category("fuzz")
 
 
 class SMPPClient:
-    def __init__(self, host):
+    def __init__(self, host, wheel=None):
+        """
+        :param wheel: 在途请求超时使用的时间轮,为None时单独创建,由connect启动的线程推进
+        """
         self.host = host
         self.client = None
-        self.sequence_number = 0
+        # 全部线程的发送都经过写线程,不直接写socket
+        self.writer = None
+        # 主线程,读线程,时间轮线程和fuzz共用的sequence_number
+        self.sequence = SequenceAllocator()
         self.client_state = consts.CLIENT_STATE_CLOSED
         self.data_coding = consts.ENCODING_DEFAULT
         self.last_message_id = None
         self.fuzz_num = 0
-
-        # Set up logger
+        # 已发送未收到响应的请求,超时由时间轮线程处理
+        self.inflight = InFlightTable(wheel=wheel, on_timeout=self.handle_timeout)
+        self.timer_thread = None
+        # 链路空闲时才发送enquire_link,和在途请求共用时间轮
+        self.keepalive = Keepalive(self.inflight.wheel, self.enquire_link, self.handle_link_dead)
+        self.peer = None
+        self.reader_thread = None
+        # 收到bind响应时set,bind据此等待绑定结果
+        self.bind_event = threading.Event()
+        # 连接断开后自动重连,同一时间只有一个线程在重连
+        self.auto_reconnect = config.AUTO_RECONNECT
+        self.reconnect_lock = threading.Lock()
+        # 断线时未收到响应,等重新绑定后重发的请求
+        self.replay = config.REPLAY_INFLIGHT
+        self.unacked = []
+        # 发送限速,根据响应中的节流状态自动调整
+        self.limiter = TokenBucket()
+        # 等待状态报告的submit_sm,按message_id匹配
+        self.submitted = SubmitIndex()
+        # 指标中的session标签
+        self.session_id = new_session_id()
+        INFLIGHT.track(self.inflight, len, self.session_id)
+        RECEIPTS_PENDING.track(self.submitted, len)
+
+        # 日志由根logger上的队列handler统一输出,已经配置过时不重复安装
+        setup_logging()
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-
-        self.command_mapping = {
-            "bind_transceiver_resp": self.parse_bind_transceiver_resp,
-            "submit_sm_resp": self.parse_submit_sm_resp,
-            "parse_submit_multi_resp": self.parse_submit_multi_resp,
-            "deliver_sm": self.parse_deliver_sm,
-            "data_sm_resp": self.parse_data_sm_resp,
-            "query_sm_resp": self.parse_query_sm_resp,
-            "enquire_link_resp": self.parse_enquire_link_resp,
-            "cancel_sm_resp": self.parse_cancel_sm_resp,
-            "replace_sm_resp": self.parse_replace_sm_resp,
-            "unbind_resp": self.parse_unbind_resp,
-            "generic_nack": self.parse_generic_nack,
-            "alert_notification": self.parse_alert_notification
-        }
+        latency.start()
+        metrics.start()
+
+        # command_id -> (处理方法, 命令信息),收到的PDU按整数command_id直接分发
+        self.command_mapping = {}
+        # 需要等待响应的请求
+        self.request_ids = {info.command_id for info in commands.values() if info.resp_id is not None}
+        for info in commands.values():
+            handler = getattr(self, info.handler, None)
+            if handler:
+                self.command_mapping[info.command_id] = (handler, info)
 
     def connect(self, host=config.SMPP_SERVER_HOST, port=config.SMPP_SERVER_PORT):
-        self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # 客户端绑定到self.host,0表示让系统自动选择一个可用的空闲端口
-        self.client.bind((self.host, 0))
+        """
+        :return: 是否连接成功
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.client.connect((host, port))
+            # 客户端绑定到self.host,0表示让系统自动选择一个可用的空闲端口
+            sock.bind((self.host, 0))
+            sock.connect((host, port))
         except Exception as e:
             self.logger.error(f"连接到{host}:{port}失败,{e}")
-        else:
-            self.logger.info(f"{self.client.getsockname()}连接到{host}:{port}")
-            self.client_state = consts.CLIENT_STATE_OPEN
-            t1 = threading.Thread(target=self.handle, daemon=True)
-            t1.start()
-
-    def bind(self):
+            sock.close()
+            return False
+        self.client = sock
+        self.logger.info(f"{self.client.getsockname()}连接到{host}:{port}")
+        self.client_state = consts.CLIENT_STATE_OPEN
+        self.peer = (host, port)
+        set_nodelay(sock)
+        self.writer = SocketWriter(sock, on_error=lambda e: self.handle_write_error(sock, e),
+                                   session=self.session_id).start()
+        self.reader_thread = threading.Thread(target=self.handle, daemon=True)
+        self.reader_thread.start()
+        if self.timer_thread is None or not self.timer_thread.is_alive():
+            self.timer_thread = threading.Thread(target=self.inflight.wheel.run,
+                                                 args=(lambda: self.client is not None,), daemon=True)
+            self.timer_thread.start()
+        return True
+
+    def bind(self, timeout=config.RESPONSE_TIMEOUT):
+        """
+        发送bind_transceiver并等待响应
+        :return: 是否已绑定
+        """
         if self.client_state > 1:
-            return
+            return True
+        self.bind_event.clear()
         self.bind_transceiver()
-        time.sleep(0.1)
+        self.bind_event.wait(timeout)
+        return self.client_state > 1
 
     def disconnect(self):
         if self.client:
             self.logger.warning(f"ESME{self.client.getsockname()}断开连接")
-            self.client.close()
+            sock, writer = self.client, self.writer
+            self.keepalive.stop()
             self.client_state = consts.CLIENT_STATE_CLOSED
             self.client = None
+            self.writer = None
+            writer.close()
+            try:
+                # 唤醒阻塞在recv_into/sendmsg中的读写线程
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+            self.drop_inflight()
+            # 等读写线程退出,重连时不会残留旧连接的线程
+            for thread in (self.reader_thread, writer.thread):
+                if thread is not None and thread is not threading.current_thread():
+                    thread.join(1)
+
+    def drop_inflight(self):
+        """
+        连接已断开,在途请求不会再有响应;开启重发时保留到重新绑定后
+        """
+        requests = self.inflight.clear()
+        if self.replay:
+            self.unacked.extend(request for request in requests if request.payload is not None)
+        elif requests:
+            self.logger.warning(f"连接断开,{len(requests)}个请求没有收到响应")
+
+    def handle_connection_lost(self):
+        self.disconnect()
+        if self.auto_reconnect:
+            self.start_reconnect()
+
+    def handle_write_error(self, sock, e):
+        if self.client is sock:
+            self.logger.error(f"发送数据失败,{e}")
+            self.handle_connection_lost()
+
+    def handle_link_dead(self):
+        self.logger.error(f"enquire_link在{self.keepalive.timeout}秒内没有响应,断开连接")
+        self.handle_connection_lost()
+
+    def start_reconnect(self):
+        """
+        在后台线程中重连,已经在重连时不重复启动
+        """
+        if not self.reconnect_lock.locked():
+            threading.Thread(target=self.reconnect, daemon=True).start()
+
+    def reconnect(self):
+        """
+        按指数退避加随机抖动重连并重新绑定,成功后重发断线时未确认的请求.
+        其他线程正在重连时等待它的结果
+        :return: 是否已重新绑定
+        """
+        with self.reconnect_lock:
+            if self.client_state > 1:
+                return True
+            peer = self.peer or (config.SMPP_SERVER_HOST, config.SMPP_SERVER_PORT)
+            self.disconnect()
+            for attempt, delay in enumerate(backoff_delays(), 1):
+                if config.RECONNECT_ATTEMPTS and attempt > config.RECONNECT_ATTEMPTS:
+                    self.logger.error(f"重连{config.RECONNECT_ATTEMPTS}次都失败,放弃重连")
+                    return False
+                time.sleep(delay)
+                if self.connect(*peer) and self.bind():
+                    self.logger.info(f"第{attempt}次重连成功")
+                    RECONNECTS.inc(self.session_id)
+                    self.replay_unacked()
+                    return True
+                self.disconnect()
+
+    def replay_unacked(self):
+        """
+        用新的sequence_number重发断线时未确认的请求
+        """
+        requests, self.unacked = self.unacked, []
+        for request in requests:
+            data = bytearray(request.payload)
+            sequence_number = next(self.sequence)
+            LONG.pack_into(data, 12, sequence_number)
+            self.inflight.add(sequence_number, request.command_name, request.context, payload=data)
+            self.writer.sendall(data)
+        if requests:
+            self.logger.info(f"重发了{len(requests)}个断线时未确认的请求")
 
     def run(self, count, loop, interval):
         """
         :param count: 发送数量
         :param loop: 循环次数
-        :param interval: 发送间隔
+        :param interval: 发送间隔,换算成限速速率
         """
+        self.limiter.set_rate(1 / interval if interval else 0)
         self.bind()
-        t2 = threading.Thread(target=self.enquire)
-        t2.start()
         if 2 <= self.client_state <= 4:
             for i in range(loop):
                 option = input("请输入你要执行的操作编号(0.测试,1.发送消息):")
                 # option = "0"
                 if option == "0":
+                    self.limiter.acquire()
                     self.query_sm(self.last_message_id)
-                    time.sleep(interval)
+                    self.limiter.acquire()
                     self.cancel_sm(self.last_message_id)
-                    time.sleep(interval)
+                    self.limiter.acquire()
                     self.replace_sm(self.last_message_id, "daihui666")
                     # self.outbind()
                 elif option == "1":
                     for i in range(count):
                         msg = input(">>>")
                         # msg = "daihui666"
-                        if contains_chinese(msg):
-                            self.data_coding = consts.SMPP_ENCODING_ISO10646
                         if msg.strip().upper() == "Q":
                             break
+                        self.data_coding = get_data_coding(msg)
+                        self.limiter.acquire()
                         self.submit_sm(msg)
                         # self.submit_multi(msg)
                         # self.data_sm(msg)
-                        time.sleep(interval)
                 elif option == "q":
                     self.unbind()
                     break
@@ -113,57 +259,84 @@ class SMPPClient:
             self.logger.error("绑定失败!")
 
     def handle(self):
-        while True:
-            if not self.client:
+        sock = self.client
+        reader = FrameReader(sock)
+        while self.client is sock:
+            try:
+                n = reader.fill()
+            except OSError as e:
+                if self.client is sock:
+                    self.logger.error(f"接收数据失败,{e}")
+                    self.handle_connection_lost()
                 break
-            length = self.client.recv(4)
-            if len(length) == 0:
-                continue
-            command_length = struct.unpack(">L", length)[0]
-            resp = length + self.client.recv(command_length - 4)
-            command_id = struct.unpack(">L", resp[4:8])[0]
-            command_name = get_command_name(command_id)
-            if command_name in self.command_mapping:
-                # noinspection PyArgumentList
-                self.command_mapping.get(command_name)(resp, command_name)
-            else:
-                self.logger.error("异常数据")
-                dir_str = "data/err_resp_data"
-                create_dir(dir_str)
-                with open(os.path.join(dir_str, f'{self.fuzz_num}'), "wb") as f:
-                    f.write(resp)
-
-    def enquire(self):
-        while True:
-            if self.client is None:
+            if n == 0:
+                if self.client is sock:
+                    if reader.pending:
+                        self.logger.error(f"连接关闭时有{reader.pending}字节的不完整PDU")
+                    self.logger.warning("SMSC关闭了连接")
+                    self.handle_connection_lost()
                 break
             try:
-                time.sleep(10)
-                self.enquire_link()
-            except AttributeError as e:
-                self.logger.error(e)
-
-    @staticmethod
-    def parse_base_resp(resp, command_name):
-        header = {
-            "command_length": None,
-            "command_id": None,
-            "command_status": None,
-            "sequence_number": None
-        }
-        pdu = get_pdu(command_name)(**header)
-        resp_data = pdu.unpack(resp)
-        pdu.command_length, pdu.command_id, pdu.command_status, pdu.sequence_number = resp_data
-        return pdu
+                for offset in reader.frames():
+                    if self.client is not sock:
+                        break
+                    # 处理方法中的异常只影响这一个PDU,不当作分帧错误断开连接
+                    try:
+                        self.dispatch(reader.buf, offset)
+                    except Exception:
+                        self.logger.exception("处理PDU时出错")
+            except ValueError as e:
+                self.logger.error(f"{e},断开连接")
+                self.handle_connection_lost()
+                break
 
-    def base_send_sm(self, command_name, **kwargs):
+    def dispatch(self, buf, offset=0):
+        self.keepalive.touch()
+        command_id = LONG.unpack_from(buf, offset + 4)[0]
+        entry = self.command_mapping.get(command_id)
+        if entry:
+            PDUS_RECEIVED.inc(command_id, LONG.unpack_from(buf, offset + 8)[0], self.session_id)
+            handler, info = entry
+            pdu = PDUView(buf, offset, info.pdu)
+            request = None
+            if command_id & consts.COMMAND_RESP_BIT:
+                # 响应(包括generic_nack)按sequence_number找回对应的请求
+                request = self.inflight.pop(pdu.sequence_number, pdu.command_status)
+                if request is None:
+                    self.logger.warning(f"收到未知请求的{info.name},{pdu}")
+                    return
+                self.limiter.feedback(pdu.command_status)
+                latency.record_since(request.command_name, request.timestamp)
+            handler(pdu, info.name, request)
+        else:
+            PDUS_RECEIVED.inc(None, None, self.session_id)
+            self.logger.error("异常数据")
+            dir_str = "data/err_resp_data"
+            create_dir(dir_str)
+            command_length = LONG.unpack_from(buf, offset)[0]
+            with open(os.path.join(dir_str, f'{self.fuzz_num}'), "wb") as f:
+                f.write(buf[offset:offset + command_length])
+
+    def handle_timeout(self, request):
+        REQUEST_TIMEOUTS.inc(request.command_name, self.session_id)
+        self.logger.warning(f"{request.command_name}(sequence_number={request.sequence_number})等待响应超时")
+
+    def base_send_sm(self, command_name, context=None, **kwargs):
+        """
+        :param context: 记录在在途请求中,收到响应或超时时带回
+        """
         command_id = get_command_id(command_name)
-        self.sequence_number += 1
-        pdu = get_pdu(command_name)(command_id=command_id, command_status=0, sequence_number=self.sequence_number,
+        sequence_number = next(self.sequence)
+        pdu = get_pdu(command_name)(command_id=command_id, command_status=0, sequence_number=sequence_number,
                                     **kwargs)
-        data = pdu.pack()
-        self.client.sendall(data)
-        return data
+        payload = pdu.pack() if self.replay and command_name not in SESSION_COMMANDS else None
+        if command_id in self.request_ids:
+            self.inflight.add(sequence_number, command_name, context, payload=payload)
+        if payload is None:
+            send_pdu(self.writer, pdu)
+        else:
+            self.writer.sendall(payload)
+        return pdu
 
     def bind_transceiver(self):
         body = {
@@ -177,14 +350,14 @@ class SMPPClient:
         }
         self.base_send_sm("bind_transceiver", **body)
 
-    def parse_bind_transceiver_resp(self, resp, command_name):
-        system_id = resp[16:-1]
-        pdu = get_pdu(command_name)(system_id=system_id)
-        resp_data = pdu.unpack(resp)
-        pdu.command_length, pdu.command_id, pdu.command_status, pdu.sequence_number, pdu.system_id = resp_data[:-1]
-        if pdu.sequence_number == self.sequence_number and pdu.command_status == consts.ESME_ROK:
+    def parse_bind_transceiver_resp(self, pdu, command_name, request):
+        if pdu.command_status == consts.ESME_ROK:
             self.logger.info(f"与SMSC绑定成功,{pdu}")
             self.client_state = consts.STATE_SETTERS[command_name]
+            self.keepalive.start()
+        else:
+            self.logger.error(f"绑定失败,{pdu}")
+        self.bind_event.set()
 
     def submit_sm(self, message):
         body = {
@@ -238,14 +411,49 @@ class SMPPClient:
         }
         self.base_send_sm("submit_sm", **body)
 
-    def parse_submit_sm_resp(self, resp, command_name):
-        message_id = resp[16:-1]
-        pdu = get_pdu(command_name)(message_id=message_id)
-        resp_data = pdu.unpack(resp)
-        pdu.command_length, pdu.command_id, pdu.command_status, pdu.sequence_number, pdu.message_id = resp_data[:-1]
-        if pdu.sequence_number == self.sequence_number and pdu.command_status == consts.ESME_ROK:
-            self.logger.info(f"发送消息成功,{pdu}")
+    def submit_sm_template(self, destination_addr=config.DESTINATION_ADDR, data_coding=None):
+        """
+        与submit_sm参数相同的预编码模板
+        """
+        if data_coding is None:
+            data_coding = self.data_coding
+        return get_template(config.SOURCE_ADDR, destination_addr, data_coding=data_coding, use_payload=True,
+                            tlvs=(('user_message_reference', 100),))
+
+    def submit_sm_bulk(self, messages, destination_addr=config.DESTINATION_ADDR):
+        """
+        批量发送,每条消息只修补序列号和短消息.str消息逐条选择最省的编码,每种编码复用一个模板
+        :param messages: 短消息(str或已按self.data_coding编码的bytes)
+        :param destination_addr: 为None时messages中每项为(目的地址, 短消息)
+        """
+        templates = {}
+        for message in messages:
+            dest = None
+            if destination_addr is None:
+                dest, message = message
+            data_coding = self.data_coding
+            if type(message) == str:
+                data_coding, message = encode_auto(message)
+            template = templates.get(data_coding)
+            if template is None:
+                template = templates[data_coding] = self.submit_sm_template(destination_addr, data_coding)
+            sequence_number = next(self.sequence)
+            if self.replay:
+                data = template.pack(sequence_number, message, dest)
+                self.inflight.add(sequence_number, "submit_sm", message, payload=data)
+                self.writer.sendall(data)
+            else:
+                self.inflight.add(sequence_number, "submit_sm", message)
+                template.send(self.writer, sequence_number, message, dest)
+
+    def parse_submit_sm_resp(self, pdu, command_name, request):
+        if pdu.command_status == consts.ESME_ROK:
             self.last_message_id = pdu.message_id.decode()
+            self.logger.info("发送消息成功,耗时%.1fms,sequence_number=%d,message_id=%s", request.elapsed * 1000,
+                             pdu.sequence_number, self.last_message_id, extra=SUBMIT_LOG)
+            self.submitted.add(pdu.message_id, request.sequence_number, request.timestamp, request.context)
+        else:
+            self.logger.error("发送消息失败,%s", pdu, extra=SUBMIT_LOG)
 
     def submit_multi(self, message):
         body = {
@@ -268,9 +476,12 @@ class SMPPClient:
         }
         self.base_send_sm("submit_multi", **body)
 
-    def parse_submit_multi_resp(self, resp, command_name):
-        if self.sequence_number:
-            print(command_name, resp)
+    def parse_submit_multi_resp(self, pdu, command_name, request):
+        if pdu.command_status == consts.ESME_ROK:
+            self.logger.info(f"群发消息成功,{pdu}")
+            self.last_message_id = pdu.message_id.decode()
+            for sme in pdu.unsuccess_smes or ():
+                self.logger.warning(f"递送失败:{sme}")
 
     def data_sm(self, message):
         body = {
@@ -288,38 +499,25 @@ class SMPPClient:
         }
         self.base_send_sm("data_sm", **body)
 
-    def parse_data_sm_resp(self, resp, command_name):
-        message_id = resp[16:-1]
-        pdu = get_pdu(command_name)(message_id=message_id)
-        resp_data = pdu.unpack(resp)
-        pdu.command_length, pdu.command_id, pdu.command_status, pdu.sequence_number, pdu.message_id = resp_data[:-1]
-        if pdu.sequence_number == self.sequence_number and pdu.command_status == consts.ESME_ROK:
-            self.logger.info(f"发送消息成功,{pdu}")
-
-    def parse_deliver_sm(self, resp, command_name):
-        sm_length = resp[56]
-        # short_message = resp[57:57 + sm_length]
-        optional_params = resp[57 + sm_length:]
-        # print(sm_length)
-        # print(short_message)
-        # print(optional_params)
-        pdu = get_pdu(command_name)(source_addr=config.SOURCE_ADDR, destination_addr=config.DESTINATION_ADDR,
-                                    sm_length=sm_length, optional_params=optional_params)
-        resp_data = pdu.unpack(resp)
-        pdu.command_length, pdu.command_id, pdu.command_status, pdu.sequence_number = resp_data[:4]
-        pdu.optional_params = resp_data[-1]
-        if sm_length != 0:
-            pdu.short_message = resp_data[-2]
+    def parse_data_sm_resp(self, pdu, command_name, request):
+        if pdu.command_status == consts.ESME_ROK:
+            self.logger.info("发送消息成功,sequence_number=%d,message_id=%s", pdu.sequence_number, pdu.message_id,
+                             extra=DATA_SM_LOG)
+
+    def parse_deliver_sm(self, pdu, command_name, request):
+        receipt = parse_receipt(pdu)
+        if receipt is None:
+            self.logger.info("收到短消息,sequence_number=%d,source_addr=%s", pdu.sequence_number, pdu.source_addr,
+                             extra=DELIVER_LOG)
         else:
-            pdu.optional_params = resp_data[-1]
-            # optional_param_type = struct.unpack(">H", pdu.optional_params[:2])[0]
-            # optional_param_name = get_optional_param_name(optional_param_type)
-            # print(optional_param_name)
-            optional_param_length = struct.unpack(">H", pdu.optional_params[2:4])[0]
-            # print(optional_param_length)
-            payload = pdu.optional_params[4:4 + optional_param_length]
-            data = payload[94:-9]
-            print(data.decode())
+            submission = self.submitted.match(receipt.message_id)
+            count_receipt(receipt, submission)
+            if submission is None:
+                self.logger.warning("收到未知消息的状态报告,%s", receipt, extra=RECEIPT_LOG)
+            else:
+                latency.record_since(SUBMIT_TO_RECEIPT, submission.timestamp)
+                self.logger.info("状态报告,message_id=%s,stat=%s,err=%s", receipt.message_id, receipt.stat, receipt.err,
+                                 extra=RECEIPT_LOG)
         if pdu.command_status == consts.ESME_ROK:
             self.deliver_sm_resp(pdu.sequence_number)
 
@@ -327,8 +525,7 @@ class SMPPClient:
         command_name = "deliver_sm_resp"
         command_id = get_command_id(command_name)
         pdu = get_pdu(command_name)(command_id=command_id, command_status=0, sequence_number=sequence_number)
-        data = pdu.pack()
-        self.client.sendall(data)
+        send_pdu(self.writer, pdu)
 
     def query_sm(self, message_id):
         body = {
@@ -339,14 +536,8 @@ class SMPPClient:
         }
         self.base_send_sm("query_sm", **body)
 
-    def parse_query_sm_resp(self, resp, command_name):
-        message_id = resp[16:-3]
-        pdu = get_pdu(command_name)(message_id=message_id)
-        resp_data = pdu.unpack(resp)
-        pdu.command_length, pdu.command_id, pdu.command_status, pdu.sequence_number, pdu.message_id, pdu.final_date, \
-            pdu.message_state, pdu.error_code = resp_data
-        if pdu.sequence_number == self.sequence_number:
-            self.logger.info(f"消息状态:{pdu}")
+    def parse_query_sm_resp(self, pdu, command_name, request):
+        self.logger.info(f"消息状态:{pdu}")
 
     def cancel_sm(self, message_id):
         body = {
@@ -361,10 +552,8 @@ class SMPPClient:
         }
         self.base_send_sm("cancel_sm", **body)
 
-    def parse_cancel_sm_resp(self, resp, command_name):
-        pdu = self.parse_base_resp(resp, command_name)
-        if pdu.sequence_number == self.sequence_number:
-            self.logger.info(f"{command_name}:{pdu}")
+    def parse_cancel_sm_resp(self, pdu, command_name, request):
+        self.logger.info(f"{command_name}:{pdu}")
 
     def replace_sm(self, message_id, new_message):
         body = {
@@ -381,10 +570,8 @@ class SMPPClient:
         }
         self.base_send_sm("replace_sm", **body)
 
-    def parse_replace_sm_resp(self, resp, command_name):
-        pdu = self.parse_base_resp(resp, command_name)
-        if pdu.sequence_number == self.sequence_number:
-            self.logger.info(f"{command_name}:{pdu}")
+    def parse_replace_sm_resp(self, pdu, command_name, request):
+        self.logger.info(f"{command_name}:{pdu}")
 
     # def outbind(self):
     #     body = {
@@ -396,9 +583,8 @@ class SMPPClient:
     def unbind(self):
         self.base_send_sm("unbind")
 
-    def parse_unbind_resp(self, resp, command_name):
-        pdu = self.parse_base_resp(resp, command_name)
-        if pdu.sequence_number == self.sequence_number and pdu.command_status == consts.SMPP_ESME_ROK:
+    def parse_unbind_resp(self, pdu, command_name, request):
+        if pdu.command_status == consts.ESME_ROK:
             self.logger.info(f"解绑成功,{pdu}")
             self.client_state = consts.STATE_SETTERS[command_name]
             self.disconnect()
@@ -406,67 +592,60 @@ class SMPPClient:
     def enquire_link(self):
         self.base_send_sm("enquire_link")
 
-    def parse_enquire_link_resp(self, resp, command_name):
-        pdu = self.parse_base_resp(resp, command_name)
-        if pdu.sequence_number == self.sequence_number:
-            if pdu.command_status != consts.ESME_ROK:
-                self.client_state = consts.CLIENT_STATE_OPEN
-
-    def parse_generic_nack(self, resp, command_name):
-        pdu = self.parse_base_resp(resp, command_name)
-        if pdu.sequence_number == self.sequence_number:
-            print(command_name, pdu)
-
-    def parse_alert_notification(self, resp, command_name):
-        sm_length = resp[56]
-        # short_message = resp[57:57 + sm_length]
-        optional_params = resp[57 + sm_length:]
-        body = {
-            "source_addr": config.SOURCE_ADDR,
-            "esme_addr": config.ESME_ADDR,
-            "sm_length": sm_length,
-            "optional_params": optional_params
-        }
-        pdu = get_pdu(command_name)(**body)
-        resp_data = pdu.unpack(resp)
-        pdu.command_length, pdu.command_id, pdu.command_status, pdu.sequence_number = resp_data[:4]
-        pdu.optional_params = resp_data[-1]
-        if sm_length != 0:
-            pdu.short_message = resp_data[-2]
-        else:
-            pdu.optional_params = resp_data[-1]
-            # optional_param_type = struct.unpack(">H", pdu.optional_params[:2])[0]
-            # optional_param_name = get_optional_param_name(optional_param_type)
-            # print(optional_param_name)
-            optional_param_length = struct.unpack(">H", pdu.optional_params[2:4])[0]
-            # print(optional_param_length)
-            payload = pdu.optional_params[4:4 + optional_param_length]
-            data = payload[94:-9]
-            print(data.decode())
-        if pdu.command_status == consts.ESME_ROK:
-            self.deliver_sm_resp(pdu.sequence_number)
+    def parse_enquire_link_resp(self, pdu, command_name, request):
+        if pdu.command_status != consts.ESME_ROK:
+            self.client_state = consts.CLIENT_STATE_OPEN
+
+    def parse_generic_nack(self, pdu, command_name, request):
+        self.logger.error(f"{request.command_name}(sequence_number={request.sequence_number})被拒绝,{pdu}")
+
+    def parse_alert_notification(self, pdu, command_name, request):
+        # alert_notification没有响应PDU
+        self.logger.info(f"{command_name}:{pdu}")
+
+    def send_raw(self, data):
+        """
+        发送任意数据并等待发出,发送失败时能对应到这条数据
+        """
+        writer = self.writer
+        if writer is None:
+            raise ConnectionError("未连接到SMSC")
+        writer.sendall(data)
+        writer.flush()
 
     def fuzz(self, count, loop, interval):
+        self.limiter.set_rate(1 / interval if interval else 0)
         for command_name in config.FUZZ_COMMAND:
             if command_name[:4] != "bind" and self.client_state == 1:
                 self.bind()
             for i in range(loop):
                 for _ in range(count):
-                    data = fuzzer.fuzz_data(command_name)
-                    self.logger.info(f"Starting Fuzz {self.fuzz_num}")
+                    data = fuzzer.fuzz_data(command_name, self.sequence)
+                    # 登记为在途请求,SMSC的响应(包括generic_nack)按sequence_number对应到这条用例
+                    sequence_number = LONG.unpack_from(data, 12)[0]
+                    self.logger.info("Starting Fuzz %d", self.fuzz_num, extra=FUZZ_LOG)
+                    self.limiter.acquire()
                     try:
-                        self.client.sendall(data)
-                        self.logger.info(f"Fuzz {self.fuzz_num} send successfully")
-                    except BrokenPipeError as e:
-                        self.logger.error(f"Fuzz {self.fuzz_num} BrokenPipeError: {e}")
+                        self.inflight.add(sequence_number, command_name, self.fuzz_num)
+                        self.send_raw(data)
+                        self.logger.info("Fuzz %d send successfully", self.fuzz_num, extra=FUZZ_LOG)
+                    except ConnectionError as e:
+                        # 没有发出去,不会有响应,重发前先去掉这一项
+                        self.inflight.pop(sequence_number)
+                        self.logger.error(f"Fuzz {self.fuzz_num} {type(e).__name__}: {e}")
                         dir_str = "data/err_send_data"
                         create_dir(dir_str)
                         with open(os.path.join(dir_str, f'{self.fuzz_num}'), "wb") as f:
                             f.write(data)
-                        self.connect()
-                        self.bind()
-                        self.client.sendall(data)
+                        if self.reconnect():
+                            try:
+                                self.inflight.add(sequence_number, command_name, self.fuzz_num)
+                                self.send_raw(data)
+                            except ConnectionError as e:
+                                self.inflight.pop(sequence_number)
+                                self.logger.error(f"Fuzz {self.fuzz_num}重连后发送失败,{e}")
                     except Exception as e:
+                        self.inflight.pop(sequence_number)
                         self.logger.error(f"Fuzz {self.fuzz_num} failed with error: {e}")
                         dir_str = "data/err_send_data"
                         create_dir(dir_str)
@@ -474,4 +653,3 @@ class SMPPClient:
                             f.write(data)
                     finally:
                         self.fuzz_num += 1
-                        time.sleep(interval)
@@ -0,0 +1,303 @@
+from collections import deque
+
+import config
+import consts
+from pdu import TLV, get_record_type, get_struct
+from registry import commands, get_command
+from tlv import decode_tlvs, find_tlv, iter_tlvs
+
+HEADER = get_struct(">4L")
+LONG = get_struct(">L")
+HEADER_SIZE = HEADER.size
+
+FIELD_BYTE = 0
+FIELD_INT = 1
+FIELD_CSTRING = 2
+FIELD_OCTETS = 3
+FIELD_LIST = 4
+
+_plans = {}
+
+
+def get_plan(cls):
+    """
+    把类上声明的body编译成必选字段的解码计划,每个类只编译一次.可选参数统一按tag查表解码
+    :return: [(字段名, 类型, 参数)]
+    """
+    fields = _plans.get(cls)
+    if fields is not None:
+        return fields
+    fields = []
+    for k, v in (getattr(cls, 'body', None) or {}).items():
+        if type(v.type) == TLV:
+            continue
+        elif v.type == int and v.size == 1:
+            fields.append((k, FIELD_BYTE, None))
+        elif v.type == int:
+            fields.append((k, FIELD_INT, get_struct(">" + consts.INT_PACK_FORMATS[v.size])))
+        elif getattr(v.type, 'body', None):
+            fields.append((k, FIELD_LIST, (v.type, v.len_field)))
+        elif v.len_field:
+            fields.append((k, FIELD_OCTETS, v.len_field))
+        else:
+            fields.append((k, FIELD_CSTRING, None))
+    _plans[cls] = fields
+    return fields
+
+
+def decode_fields(cls, data, view, pos, end, values, start=0, stop=None):
+    """
+    按顺序解码必选字段,遇到截断的报文体时停止
+    :param start: 从第几个必选字段开始
+    :param stop: 解码到该字段为止
+    :return: (解码结束的位置, 下一个待解码字段的序号)
+    """
+    fields = get_plan(cls)
+    for i in range(start, len(fields)):
+        if pos >= end:
+            return end, len(fields)
+        name, kind, arg = fields[i]
+        if kind == FIELD_BYTE:
+            values[name] = data[pos]
+            pos += 1
+        elif kind == FIELD_CSTRING:
+            nul = data.find(b'\x00', pos, end)
+            if nul < 0:
+                nul = end
+            values[name] = view[pos:nul].tobytes()
+            pos = nul + 1
+        elif kind == FIELD_INT:
+            if pos + arg.size > end:
+                return end, len(fields)
+            values[name] = arg.unpack_from(data, pos)[0]
+            pos += arg.size
+        elif kind == FIELD_OCTETS:
+            n = values.get(arg) or 0
+            values[name] = view[pos:pos + n].tobytes()
+            pos += n
+        else:
+            sub, len_field = arg
+            items = []
+            for _ in range(values.get(len_field) or 0):
+                item = {}
+                pos = decode_fields(sub, data, view, pos, end, item)[0]
+                items.append(item)
+            values[name] = items
+        if name == stop:
+            return pos, i + 1
+    return pos, len(fields)
+
+
+def decode_body(cls, data, offset=0, end=None):
+    """
+    单次遍历解码报文体
+    :param cls: PDU类
+    :param data: 接收缓冲区(bytes/bytearray)
+    :param offset: 报文体起始位置
+    :param end: 报文体结束位置
+    :return: {字段名: 值}
+    """
+    if end is None:
+        end = len(data)
+    values = {}
+    with memoryview(data) as view:
+        pos = decode_fields(cls, data, view, offset, end, values)[0]
+    decode_tlvs(data, pos, end, values)
+    return values
+
+
+def decode_pdu(data, offset=0):
+    """
+    根据command_id找到PDU类,按其body声明解码整个PDU
+    :param data: 接收缓冲区(bytes/bytearray)
+    :param offset: PDU在缓冲区中的起始位置
+    """
+    command_length, command_id, command_status, sequence_number = HEADER.unpack_from(data, offset)
+    cls = get_command(command_id).pdu
+    end = min(offset + command_length, len(data))
+    values = decode_body(cls, data, offset + HEADER_SIZE, end)
+    values["command_length"] = command_length
+    values["command_id"] = command_id
+    values["command_status"] = command_status
+    values["sequence_number"] = sequence_number
+    return cls.from_fields(values)
+
+
+class PDUView:
+    """
+    接收缓冲区上的只读PDU视图,不拷贝报文,字段在第一次访问时才解码并缓存.
+    视图只在分发期间有效,缓冲区被复用前需要保留的内容用to_pdu()取出
+    """
+    __slots__ = ("_data", "_offset", "_end", "_cls", "_values", "_pos", "_index", "_tlvs_done")
+
+    def __init__(self, data, offset=0, cls=None):
+        self._data = data
+        self._offset = offset
+        self._end = min(offset + LONG.unpack_from(data, offset)[0], len(data))
+        self._cls = cls or get_command(self.command_id).pdu
+        self._values = {}
+        self._pos = offset + HEADER_SIZE
+        self._index = 0
+        self._tlvs_done = False
+
+    @property
+    def command_length(self):
+        return LONG.unpack_from(self._data, self._offset)[0]
+
+    @property
+    def command_id(self):
+        return LONG.unpack_from(self._data, self._offset + 4)[0]
+
+    @property
+    def command_status(self):
+        return LONG.unpack_from(self._data, self._offset + 8)[0]
+
+    @property
+    def sequence_number(self):
+        return LONG.unpack_from(self._data, self._offset + 12)[0]
+
+    @property
+    def command_name(self):
+        info = commands.get(self.command_id)
+        return info.name if info else None
+
+    def _decode_fields(self, stop=None):
+        """
+        从上次停下的位置继续解码必选字段,stop为None时解码全部必选字段,之后self._pos停在TLV链的起始位置
+        """
+        if self._index < len(get_plan(self._cls)):
+            with memoryview(self._data) as view:
+                self._pos, self._index = decode_fields(self._cls, self._data, view, self._pos, self._end,
+                                                       self._values, self._index, stop)
+
+    def _decode(self):
+        """
+        解码全部必选字段和TLV
+        """
+        self._decode_fields()
+        if not self._tlvs_done:
+            decode_tlvs(self._data, self._pos, self._end, self._values)
+            self._tlvs_done = True
+
+    def _find_tlv(self, name):
+        """
+        只查找一个可选参数,跳过其余TLV不解码,结果(包括不存在时的None)缓存下来
+        """
+        self._decode_fields()
+        if name not in self._values and not self._tlvs_done:
+            self._values[name] = find_tlv(self._data, self._pos, self._end, consts.OPTIONAL_PARAMS[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        values = self._values
+        if name not in values:
+            if name in consts.OPTIONAL_PARAMS:
+                self._find_tlv(name)
+            else:
+                self._decode_fields(name)
+            if name not in values:
+                if name not in (getattr(self._cls, 'body', None) or ()) and name not in consts.OPTIONAL_PARAMS:
+                    raise AttributeError(name)
+                return None
+        return values[name]
+
+    def iter_tlvs(self):
+        """
+        惰性遍历报文体尾部的TLV链
+        :return: (tag, 名称, 值)
+        """
+        self._decode_fields()
+        return iter_tlvs(self._data, self._pos, self._end)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def to_pdu(self):
+        """
+        解码全部字段,生成独立于接收缓冲区的PDU对象
+        """
+        self._decode()
+        values = dict(self._values)
+        values["command_length"] = self.command_length
+        values["command_id"] = self.command_id
+        values["command_status"] = self.command_status
+        values["sequence_number"] = self.sequence_number
+        return self._cls.from_fields(values)
+
+    def to_record(self):
+        """
+        解码全部字段,生成带__slots__的紧凑记录
+        """
+        self._decode()
+        values = dict(self._values)
+        values["command_length"] = self.command_length
+        values["command_id"] = self.command_id
+        values["command_status"] = self.command_status
+        values["sequence_number"] = self.sequence_number
+        return get_record_type(self._cls).from_fields(values)
+
+    def __str__(self):
+        return str(self.to_pdu())
+
+
+class BufferPool:
+    """
+    发送缓冲区池,编码时复用bytearray而不是每个PDU分配新的bytes
+    """
+
+    def __init__(self, size=config.SEND_BUFFER_SIZE, count=config.SEND_BUFFER_POOL_SIZE):
+        self.size = size
+        self.count = count
+        self._free = deque()
+
+    def acquire(self, n=0):
+        try:
+            buf = self._free.pop()
+        except IndexError:
+            buf = bytearray(self.size)
+        if len(buf) < n:
+            buf = bytearray(n)
+        return buf
+
+    def release(self, buf):
+        """
+        SocketWriter在写线程中归还,deque的append/pop是原子的,不加锁
+        """
+        if len(self._free) < self.count:
+            self._free.append(buf)
+
+
+buffer_pool = BufferPool()
+
+
+def send_buffer(sock, buf, n, pool=buffer_pool):
+    """
+    发送从pool取出的缓冲区的前n字节并归还缓冲区.
+    sock为使用同一个池的SocketWriter时不拷贝,交给写线程,发出后由写线程归还;否则sendall返回后立即归还
+    """
+    if getattr(sock, "pool", None) is pool:
+        try:
+            sock.sendall(memoryview(buf)[:n], owned=True)
+        except BaseException:
+            pool.release(buf)
+            raise
+        return
+    try:
+        sock.sendall(memoryview(buf)[:n])
+    finally:
+        pool.release(buf)
+
+
+def send_pdu(sock, pdu, pool=buffer_pool):
+    """
+    编码到池中的缓冲区后发送,发送路径上不为每个PDU分配新的bytes
+    """
+    buf = pool.acquire(pdu.command_length)
+    try:
+        n = pdu.pack_into(buf)
+    except BaseException:
+        pool.release(buf)
+        raise
+    send_buffer(sock, buf, n, pool)
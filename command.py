@@ -29,14 +29,15 @@ command_ids = {
 }
 
 
+command_names = {v: k for k, v in command_ids.items()}
+
+
 def get_command_id(command_name):
     return command_ids.get(command_name)
 
 
 def get_command_name(command_id):
-    for name, _id in command_ids.items():
-        if _id == command_id:
-            return name
+    return command_names.get(command_id)
 
 
 
@@ -8,5 +8,118 @@ SYSTEM_ID = "dh"
 PASSWORD = "123"
 FUZZ_COMMAND = ["bind_transceiver","submit_sm","deliver_sm_resp","unbind","enquire_link"]
 ADD_NULL_PARAMS = ["system_id","password","system_type","source_addr","destination_addr","message_id"]
+# 编译好的Struct布局缓存的最大条目数
+STRUCT_CACHE_SIZE = 512
+# 发送缓冲区池: 单个缓冲区的初始大小和池中最多保留的缓冲区数
+SEND_BUFFER_SIZE = 1024
+SEND_BUFFER_POOL_SIZE = 64
+# submit_sm预编码模板缓存的最大条目数
+TEMPLATE_CACHE_SIZE = 128
+# 接收缓冲区初始大小,超过MAX_COMMAND_LENGTH的PDU视为非法
+RECV_BUFFER_SIZE = 64 * 1024
+MAX_COMMAND_LENGTH = 128 * 1024
 
+# 短消息编码结果的缓存条数
+ENCODE_CACHE_SIZE = 4096
 
+# 异步客户端允许同时在途(已发送未收到响应)的请求数
+WINDOW_SIZE = 10
+# 等待响应的超时时间(秒)
+RESPONSE_TIMEOUT = 10
+# 链路空闲多少秒后发送enquire_link,0表示不发送
+ENQUIRE_LINK_INTERVAL = 10
+# 等待enquire_link响应的秒数,超时认为链路已断
+ENQUIRE_LINK_TIMEOUT = 5
+
+# 时间轮每个槽的时间(秒)和槽数
+TIMER_TICK = 0.1
+TIMER_SLOTS = 512
+
+# 会话池的绑定数,绑定方式和分配策略(least_outstanding或round_robin)
+BIND_COUNT = 4
+BIND_MODE = "bind_transceiver"
+POOL_POLICY = "least_outstanding"
+
+# 限速: 目标速率(条/秒,0表示不限速)和突发条数
+RATE_LIMIT_TPS = 0
+RATE_LIMIT_BURST = 10
+# 收到ESME_RTHROTTLED/ESME_RMSGQFUL时速率乘以RATE_DECREASE,RATE_BACKOFF_HOLD秒内只降一次,不低于RATE_MIN_TPS
+RATE_DECREASE = 0.5
+RATE_BACKOFF_HOLD = 1.0
+RATE_MIN_TPS = 1
+# 成功响应时每秒回升的速率(条/秒)
+RATE_INCREASE = 10
+# 不限速时按RATE_MEASURE_WINDOW秒统计发送速率,第一次收到节流状态时以测得的速率为起点开始降速;
+# 尚未测得时用RATE_CEILING_TPS.RATE_CEILING_TPS同时是不限速时回升的上限,0表示不设上限
+RATE_MEASURE_WINDOW = 1.0
+RATE_CEILING_TPS = 0
+
+# 批量发送时每完成多少条打印一次进度
+BULK_REPORT_EVERY = 100000
+
+# 延迟统计的打印间隔(秒),0表示只在退出时打印
+LATENCY_REPORT_INTERVAL = 60
+
+# 等待状态报告的提交记录最多保留的条数
+RECEIPT_INDEX_SIZE = 1000000
+
+# 等待状态报告的最长时间(秒),超过后提交记录被淘汰
+RECEIPT_INDEX_TTL = 172800
+
+# 是否关闭Nagle算法,发送端已经自己合并小包
+TCP_NODELAY = True
+
+# 写线程一次sendmsg最多合并的PDU数
+WRITER_BATCH = 64
+
+# 写线程普通队列的长度上限,队列满时发送方阻塞
+WRITER_QUEUE_SIZE = 1024
+
+# 单线程引擎中每个会话的初始接收缓冲区大小,大量会话时减少内存占用
+ENGINE_RECV_BUFFER_SIZE = 4096
+
+# 连接断开后是否自动重连并重新绑定
+AUTO_RECONNECT = True
+
+# 重连的初始等待时间(秒),之后每次翻倍
+RECONNECT_DELAY = 0.05
+
+# 重连等待时间的上限(秒)
+RECONNECT_MAX_DELAY = 30
+
+# 重连等待时间的随机抖动比例
+RECONNECT_JITTER = 0.5
+
+# 每次断线最多重连的次数,0表示不限
+RECONNECT_ATTEMPTS = 0
+
+# 重新绑定后是否重发断线时未收到响应的请求,SMSC可能已经处理过,会产生重复消息
+REPLAY_INFLIGHT = False
+
+# 日志级别
+LOG_LEVEL = "INFO"
+
+# 日志格式,text或ndjson(每行一个JSON)
+LOG_FORMAT = "text"
+
+# 日志文件,为None时写到标准错误
+LOG_FILE = None
+
+# 日志队列长度,写日志线程跟不上时丢弃新的日志
+LOG_QUEUE_SIZE = 100000
+
+# 按类别采样的保留比例,如{"submit_sm_resp": 0.01, "fuzz": 0.01},WARNING及以上不采样
+LOG_SAMPLING = {}
+
+# Prometheus文本格式指标的监听地址和端口,端口为0时不监听
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+
+# 定期写出的指标快照文件(Prometheus文本格式),为None时不写
+METRICS_SNAPSHOT_FILE = None
+
+# 写快照的间隔(秒),0表示只在退出时写
+METRICS_SNAPSHOT_INTERVAL = 10
+
+# 指标是否按会话区分,会话很多时关闭以减少序列数
+METRICS_SESSION_LABEL = True
@@ -2,6 +2,17 @@ EMPTY_STRING = b''
 NULL_STRING = b'\0'
 NULL_BYTE = b'\x00'
 
+# command_id的最高位表示响应PDU
+# SMPP 3.4, 5.1.2.1
+COMMAND_RESP_BIT = 0x80000000
+
+# sequence_number的取值范围为0x00000001~0x7FFFFFFF
+# SMPP 3.4, 5.1.2.4
+SEQUENCE_NUMBER_MAX = 0x7FFFFFFF
+
+# 客户端本地的请求超时状态,不是SMSC返回的command_status
+STATUS_TIMEOUT = -1
+
 
 # Message part lengths in different encodings.
 # SMPP 3.4, 2.2.1.2
@@ -190,6 +201,8 @@ MSGMODE_STOREFORWARD = 0x03  # Explicit Store and Forward mode
 
 
 MSGTYPE_DEFAULT = 0x00  # Default message type (i.e. normal message)
+MSGTYPE_SMSC_DELIVERY_RECEIPT = 0x04  # Message contains SMSC Delivery Receipt (deliver_sm)
+MSGTYPE_BITMASK = 0x3C  # Message type bits 5-2
 MSGTYPE_DELIVERYACK = 0x08  # Message containts ESME Delivery acknowledgement
 MSGTYPE_USERACK = 0x10  # Message containts ESME Manual/User acknowledgement
 
@@ -269,6 +282,18 @@ MESSAGE_STATE_ACCEPTED = 6 # 消息已接收(如已被客服代表用户手工
 MESSAGE_STATE_UNKNOWN = 7 # 消息状态无效
 MESSAGE_STATE_REJECTED = 8 # 消息被拒绝
 
+# 状态报告文本中stat字段对应的名称
+MESSAGE_STATE_NAMES = {
+    MESSAGE_STATE_ENROUTE: "ENROUTE",
+    MESSAGE_STATE_DELIVERED: "DELIVRD",
+    MESSAGE_STATE_EXPIRED: "EXPIRED",
+    MESSAGE_STATE_DELETED: "DELETED",
+    MESSAGE_STATE_UNDELIVERABLE: "UNDELIV",
+    MESSAGE_STATE_ACCEPTED: "ACCEPTD",
+    MESSAGE_STATE_UNKNOWN: "UNKNOWN",
+    MESSAGE_STATE_REJECTED: "REJECTD",
+}
+
 
 COMMAND_STATES = {
     'bind_transmitter': (CLIENT_STATE_OPEN,),
@@ -385,6 +410,57 @@ OPTIONAL_PARAMS = {
 }
 
 
+# Optional parameter value types and lengths, SMPP 3.4 5.3.2.
+# int: 定长整数; str: C-Octet String; bytes: Octet String; bool: 没有值,出现即为True.
+# 长度为None表示变长
+OPTIONAL_PARAM_TYPES = {
+    "dest_addr_subunit": (int, 1),
+    "dest_network_type": (int, 1),
+    "dest_bearer_type": (int, 1),
+    "dest_telematics_id": (int, 2),
+    "source_addr_subunit": (int, 1),
+    "source_network_type": (int, 1),
+    "source_bearer_type": (int, 1),
+    "source_telematics_id": (int, 1),
+    "qos_time_to_live": (int, 4),
+    "payload_type": (int, 1),
+    "additional_status_info_text": (str, None),
+    "receipted_message_id": (str, None),
+    "ms_msg_wait_facilities": (int, 1),
+    "privacy_indicator": (int, 1),
+    "source_subaddress": (bytes, None),
+    "dest_subaddress": (bytes, None),
+    "user_message_reference": (int, 2),
+    "user_response_code": (int, 1),
+    "source_port": (int, 2),
+    "destination_port": (int, 2),
+    "sar_msg_ref_num": (int, 2),
+    "language_indicator": (int, 1),
+    "sar_total_segments": (int, 1),
+    "sar_segment_seqnum": (int, 1),
+    "sc_interface_version": (int, 1),
+    "callback_num_pres_ind": (int, 1),
+    "callback_num_atag": (bytes, None),
+    "number_of_messages": (int, 1),
+    "callback_num": (bytes, None),
+    "dpf_result": (int, 1),
+    "set_dpf": (int, 1),
+    "ms_availability_status": (int, 1),
+    "network_error_code": (bytes, 3),
+    "message_payload": (bytes, None),
+    "delivery_failure_reason": (int, 1),
+    "more_messages_to_send": (int, 1),
+    "message_state": (int, 1),
+    "ussd_service_op": (bytes, 1),
+    "display_time": (int, 1),
+    "sms_signal": (int, 2),
+    "ms_validity": (int, 1),
+    "alert_on_message_delivery": (bool, 0),
+    "its_reply_type": (int, 1),
+    "its_session_info": (bytes, 2),
+}
+
+
 # Integer value struct formats for different sizes.
 INT_PACK_FORMATS = {
     1: 'B',
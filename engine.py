@@ -0,0 +1,450 @@
+import argparse
+import errno
+import logging
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+import config
+import consts
+from backoff import backoff_delays
+from client import SMPPClient
+from framing import FrameReader
+from inflight import TimerWheel
+from log import setup_logging
+from metrics import RECEIPTS_PENDING, RECONNECTS, count_sent
+from receipt import SubmitIndex
+from writer import consume, get_priority, set_nodelay
+
+
+class Session(SMPPClient):
+    """
+    由Engine驱动的非阻塞会话,发送(base_send_sm,submit_sm...)和parse_*接口与SMPPClient相同,但不创建任何线程.
+    除Engine.call_soon外,会话的方法只能在引擎线程中调用
+    """
+
+    def __init__(self, engine, host=None, bind_mode=config.BIND_MODE):
+        """
+        :param host: 客户端绑定的本地地址,为None时由系统选择
+        :param bind_mode: 连接建立后发送的bind命令,为None时不自动绑定
+        """
+        super().__init__(host, engine.wheel)
+        self.engine = engine
+        self.bind_mode = bind_mode
+        self.submitted = engine.submitted
+        self.reader = None
+        self.peer = None
+        self.connecting = False
+        # 待发送的数据按优先级分两条队列,正在发送的一批放在sending中
+        self.lanes = ([], [])
+        self.sending = []
+        # 重连中时为退避时间的生成器
+        self.backoff = None
+        self.attempts = 0
+        self.reconnect_timer = None
+
+    def connect(self, host=config.SMPP_SERVER_HOST, port=config.SMPP_SERVER_PORT):
+        """
+        开始非阻塞连接,连接结果在on_connected中处理
+        :return: 是否已开始连接
+        """
+        self.peer = (host, port)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            if self.host:
+                sock.bind((self.host, 0))
+            set_nodelay(sock)
+            err = sock.connect_ex((host, port))
+        except OSError as e:
+            err = e.errno
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.logger.error(f"连接到{host}:{port}失败,{errno.errorcode.get(err, err)}")
+            sock.close()
+            return False
+        self.client = sock
+        self.writer = self
+        self.reader = FrameReader(sock, config.ENGINE_RECV_BUFFER_SIZE)
+        self.connecting = True
+        self.engine.register(self, selectors.EVENT_WRITE)
+        return True
+
+    def on_connected(self):
+        self.connecting = False
+        err = self.client.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self.logger.error(f"连接到{self.peer[0]}:{self.peer[1]}失败,{errno.errorcode.get(err, err)}")
+            self.disconnect()
+            if self.backoff is not None:
+                self.start_reconnect()
+            return
+        self.logger.info(f"{self.client.getsockname()}连接到{self.peer[0]}:{self.peer[1]}")
+        self.client_state = consts.CLIENT_STATE_OPEN
+        self.engine.update(self)
+        if self.bind_mode:
+            self.bind()
+
+    def bind(self):
+        # 连接中的会话在连接建立后按bind_mode绑定
+        if self.connecting or self.client_state > 1:
+            return
+        body = {
+            'system_id': config.SYSTEM_ID,
+            'password': config.PASSWORD,
+            'system_type': "sms",
+            'interface_version': consts.VERSION_34,
+            'addr_ton': consts.TON_UNK,
+            'addr_npi': consts.NPI_ISDN,
+            'address_range': consts.NULL_BYTE,
+        }
+        self.base_send_sm(self.bind_mode or "bind_transceiver", **body)
+
+    def parse_bind_transceiver_resp(self, pdu, command_name, request):
+        super().parse_bind_transceiver_resp(pdu, command_name, request)
+        if self.backoff is None:
+            return
+        if self.bound:
+            self.logger.info(f"第{self.attempts}次重连成功")
+            RECONNECTS.inc(self.session_id)
+            self.backoff = None
+            self.replay_unacked()
+        else:
+            self.disconnect()
+            self.start_reconnect()
+
+    parse_bind_transmitter_resp = parse_bind_transceiver_resp
+    parse_bind_receiver_resp = parse_bind_transceiver_resp
+
+    def handle_timeout(self, request):
+        super().handle_timeout(request)
+        if request.command_name.startswith("bind") and self.backoff is not None:
+            self.disconnect()
+            self.start_reconnect()
+
+    def start_reconnect(self):
+        """
+        不阻塞引擎线程,按退避时间在时间轮上安排下一次连接
+        """
+        if self.peer is None or self.reconnect_timer is not None:
+            return
+        if self.backoff is None:
+            self.backoff = backoff_delays()
+            self.attempts = 0
+        self.attempts += 1
+        if config.RECONNECT_ATTEMPTS and self.attempts > config.RECONNECT_ATTEMPTS:
+            self.logger.error(f"重连{config.RECONNECT_ATTEMPTS}次都失败,放弃重连")
+            self.backoff = None
+            return
+        self.reconnect_timer = self.engine.wheel.schedule(next(self.backoff), self.attempt_reconnect)
+
+    def attempt_reconnect(self):
+        self.reconnect_timer = None
+        if self.client is None and not self.connect(*self.peer):
+            self.start_reconnect()
+
+    @property
+    def bound(self):
+        return self.client is not None and consts.CLIENT_STATE_BOUND_TX <= self.client_state <= \
+            consts.CLIENT_STATE_BOUND_TRX
+
+    @property
+    def outstanding(self):
+        return len(self.inflight)
+
+    def sendall(self, data, priority=None):
+        """
+        代替SocketWriter,放入发送队列,由引擎在本轮循环末尾合并发送
+        """
+        if self.client is None:
+            raise ConnectionError("未连接到SMSC")
+        if priority is None:
+            priority = get_priority(data)
+        self.lanes[priority].append(bytes(data))
+        self.engine.dirty.add(self)
+
+    @property
+    def want_write(self):
+        return bool(self.sending or self.lanes[0] or self.lanes[1])
+
+    def flush(self):
+        """
+        用sendmsg发出队列中的数据,发不完的部分等socket可写时继续
+        """
+        if self.client is None or self.connecting:
+            return
+        if not self.sending:
+            self.take()
+        while self.sending:
+            try:
+                n = self.client.sendmsg(self.sending[:config.WRITER_BATCH])
+            except BlockingIOError:
+                break
+            except OSError as e:
+                self.logger.error(f"发送数据失败,{e}")
+                self.handle_connection_lost()
+                return
+            consume(self.sending, n)
+            if not self.sending:
+                self.take()
+        self.engine.update(self)
+
+    def take(self):
+        """
+        把两条队列中的数据按优先级顺序移到待发送列表
+        """
+        high, normal = self.lanes
+        if high or normal:
+            pending = high + normal
+            high.clear()
+            normal.clear()
+            count_sent(pending, self.session_id)
+            self.sending = [memoryview(data) for data in pending]
+
+    def on_event(self, mask):
+        if mask & selectors.EVENT_WRITE:
+            if self.connecting:
+                self.on_connected()
+            else:
+                self.flush()
+        if mask & selectors.EVENT_READ and self.client is not None:
+            self.on_readable()
+
+    def on_readable(self):
+        try:
+            n = self.reader.fill()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.logger.error(f"接收数据失败,{e}")
+            self.handle_connection_lost()
+            return
+        if n == 0:
+            if self.reader.pending:
+                self.logger.error(f"连接关闭时有{self.reader.pending}字节的不完整PDU")
+            self.logger.warning("SMSC关闭了连接")
+            self.handle_connection_lost()
+            return
+        try:
+            for offset in self.reader.frames():
+                if self.client is None:
+                    break
+                # 处理方法中的异常只影响这一个PDU
+                try:
+                    self.dispatch(self.reader.buf, offset)
+                except Exception:
+                    self.logger.exception("处理PDU时出错")
+        except ValueError as e:
+            self.logger.error(f"{e},断开连接")
+            self.handle_connection_lost()
+
+    def disconnect(self):
+        if self.client is None:
+            return
+        if not self.connecting:
+            self.logger.warning(f"ESME{self.client.getsockname()}断开连接")
+        self.engine.unregister(self)
+        self.keepalive.stop()
+        self.client.close()
+        self.client = None
+        self.writer = None
+        self.connecting = False
+        self.client_state = consts.CLIENT_STATE_CLOSED
+        self.lanes[0].clear()
+        self.lanes[1].clear()
+        self.sending = []
+        self.drop_inflight()
+
+
+class Engine:
+    """
+    单线程事件引擎: 用selectors(Linux上为epoll)在一个线程中处理全部会话的连接,收发,分帧和分发,
+    在途请求超时和空闲链路的enquire_link探测共用一个时间轮
+    """
+
+    def __init__(self, tick=config.TIMER_TICK):
+        self.selector = selectors.DefaultSelector()
+        self.wheel = TimerWheel(tick)
+        # 各会话共用的状态报告索引
+        self.submitted = SubmitIndex()
+        # 会话替换掉自己创建的索引后,等待状态报告的数量按共用的索引统计
+        RECEIPTS_PENDING.track(self.submitted, len)
+        self.sessions = []
+        # 本轮循环中有数据待发送的会话
+        self.dirty = set()
+        # 其他线程通过call_soon提交的调用,用socketpair唤醒select
+        self.calls = deque()
+        self.waker, self.wakeup_sock = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakeup_sock.setblocking(False)
+        self.selector.register(self.waker, selectors.EVENT_READ, self.on_wakeup)
+        self.running = False
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def session(self, host=None, bind_mode=config.BIND_MODE):
+        session = Session(self, host, bind_mode)
+        self.sessions.append(session)
+        return session
+
+    def open(self, count, host=config.SMPP_SERVER_HOST, port=config.SMPP_SERVER_PORT, local_host=None,
+             bind_mode=config.BIND_MODE):
+        """
+        创建count个会话并开始连接,连接和绑定在run中完成
+        :return: 新建的会话
+        """
+        sessions = [self.session(local_host, bind_mode) for _ in range(count)]
+        for session in sessions:
+            session.connect(host, port)
+        return sessions
+
+    def register(self, session, events):
+        self.selector.register(session.client, events, session.on_event)
+
+    def update(self, session):
+        events = selectors.EVENT_READ
+        if session.connecting or session.want_write:
+            events |= selectors.EVENT_WRITE
+        if self.selector.get_key(session.client).events != events:
+            self.selector.modify(session.client, events, session.on_event)
+
+    def unregister(self, session):
+        self.dirty.discard(session)
+        try:
+            self.selector.unregister(session.client)
+        except (KeyError, ValueError):
+            pass
+
+    def call_soon(self, callback, *args):
+        """
+        在引擎线程中调用callback(*args),可以从任意线程调用
+        """
+        self.calls.append((callback, args))
+        try:
+            self.wakeup_sock.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def on_wakeup(self, mask):
+        try:
+            while self.waker.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def run_once(self, timeout=None):
+        """
+        处理一轮: 等待IO事件,执行其他线程提交的调用,推进时间轮,发送本轮产生的数据
+        """
+        if timeout is None:
+            timeout = self.wheel.tick
+        for key, mask in self.selector.select(0 if self.calls or self.dirty else timeout):
+            try:
+                key.data(mask)
+            except Exception:
+                self.logger.exception("处理socket事件时出错")
+                session = getattr(key.data, "__self__", None)
+                if isinstance(session, Session):
+                    session.handle_connection_lost()
+        while self.calls:
+            callback, args = self.calls.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                self.logger.exception(f"回调{callback}出错")
+        # 定时器回调的异常由时间轮自己处理
+        self.wheel.advance()
+        while self.dirty:
+            session = self.dirty.pop()
+            try:
+                session.flush()
+            except Exception:
+                self.logger.exception("发送数据时出错")
+                session.handle_connection_lost()
+
+    def run(self, running=None):
+        """
+        在当前线程中循环处理,直到stop被调用或running()返回False
+        """
+        self.running = True
+        while self.running and (running is None or running()):
+            self.run_once()
+
+    def start(self):
+        """
+        在后台线程中运行
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.call_soon(lambda: None)
+
+    def close(self):
+        for session in self.sessions:
+            session.auto_reconnect = False
+            if session.reconnect_timer is not None:
+                self.wheel.cancel(session.reconnect_timer)
+                session.reconnect_timer = None
+            session.backoff = None
+            session.disconnect()
+        self.sessions = []
+
+    def status(self):
+        """
+        :return: 各状态的会话数
+        """
+        connecting = sum(1 for session in self.sessions if session.connecting)
+        bound = sum(1 for session in self.sessions if session.bound)
+        connected = sum(1 for session in self.sessions if session.client is not None) - connecting
+        return {"sessions": len(self.sessions), "connecting": connecting, "connected": connected, "bound": bound,
+                "outstanding": sum(session.outstanding for session in self.sessions)}
+
+
+def raise_nofile_limit(count):
+    """
+    每个会话占用一个文件描述符,需要时把软限制提高到硬限制
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    need = count + 64
+    if hard != resource.RLIM_INFINITY:
+        need = min(need, hard)
+    if soft < need:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (need, hard))
+
+
+def parse_terminal_params():
+    parser = argparse.ArgumentParser(description="单线程建立大量绑定,测试SMSC的连接数上限")
+    parser.add_argument("-n", "--sessions", default=1000, type=int, help="会话数")
+    parser.add_argument("-d", "--duration", default=60, type=float, help="保持时间(秒)")
+    parser.add_argument("--bind-mode", default=config.BIND_MODE, type=str,
+                        help="bind_transmitter,bind_receiver或bind_transceiver")
+    parser.add_argument("--report", default=1.0, type=float, help="统计打印间隔(秒)")
+    parser.add_argument("--host", default=config.SMPP_SERVER_HOST, type=str, help="SMSC地址")
+    parser.add_argument("--port", default=config.SMPP_SERVER_PORT, type=int, help="SMSC端口")
+    parser.add_argument("--local-host", default=None, type=str, help="客户端绑定的本地地址")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_terminal_params()
+    setup_logging(level=logging.WARNING)
+    raise_nofile_limit(args.sessions)
+    engine = Engine()
+    engine.open(args.sessions, args.host, args.port, args.local_host, args.bind_mode)
+    logging.getLogger("client").setLevel(logging.WARNING)
+    start = last = time.monotonic()
+    while time.monotonic() - start < args.duration:
+        engine.run_once()
+        now = time.monotonic()
+        if now - last >= args.report:
+            print(f"[{now - start:6.1f}s] {engine.status()}")
+            last = now
+    engine.close()
@@ -0,0 +1,71 @@
+import config
+from codec import HEADER_SIZE, LONG
+
+
+class FrameReader:
+    """
+    流式分帧: 用recv_into填充可增长的接收缓冲区,一次读取可以切出多个PDU,跨读取的半包留到下次拼接
+    """
+
+    def __init__(self, sock, size=config.RECV_BUFFER_SIZE, max_length=config.MAX_COMMAND_LENGTH):
+        self.sock = sock
+        self.buf = bytearray(size)
+        self.max_length = max_length
+        # buf[start:end]为已接收未分帧的数据
+        self.start = 0
+        self.end = 0
+        # 缓冲区头部半包声明的command_length
+        self.need = 0
+
+    @property
+    def pending(self):
+        return self.end - self.start
+
+    def compact(self):
+        n = self.end - self.start
+        if n and self.start:
+            self.buf[:n] = self.buf[self.start:self.end]
+        self.start = 0
+        self.end = n
+
+    def get_buffer(self):
+        """
+        整理缓冲区并返回尾部可写入的空间,写入n字节后self.end += n.
+        返回的memoryview需要在下一次调用前释放,否则缓冲区无法扩容
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf) or self.start + self.need > len(self.buf):
+            self.compact()
+        if self.need > len(self.buf):
+            self.buf.extend(bytes(self.need - len(self.buf)))
+        return memoryview(self.buf)[self.end:]
+
+    def fill(self):
+        """
+        读一次socket
+        :return: 读到的字节数,0表示对端已关闭(或半关闭)写方向
+        """
+        with self.get_buffer() as view:
+            n = self.sock.recv_into(view)
+        self.end += n
+        return n
+
+    def frames(self):
+        """
+        依次产出缓冲区中每个完整PDU的起始位置,PDU数据留在self.buf中不做拷贝,
+        产出的位置只在处理下一帧/下一次fill之前有效
+        """
+        buf = self.buf
+        while self.end - self.start >= 4:
+            length = LONG.unpack_from(buf, self.start)[0]
+            if length < HEADER_SIZE or length > self.max_length:
+                raise ValueError(f"非法的command_length:{length}")
+            if self.end - self.start < length:
+                self.need = length
+                return
+            offset = self.start
+            self.start += length
+            self.need = 0
+            yield offset
+        self.need = 0
@@ -4,7 +4,10 @@ import struct
 import command
 import consts
 from utils import get_pdu
-from pdu import TLV
+from pdu import TLV, get_struct
+from sequence import SequenceAllocator
+
+HEADER = get_struct(">4L")
 
 fake = Faker()
 ascii_chars = ''.join(chr(i) for i in range(128))
@@ -12,7 +15,8 @@ ascii_chars = ''.join(chr(i) for i in range(128))
 
 class SMPPFuzz:
     def __init__(self):
-        self.sequence_number = 0
+        # 没有指定会话的分配器时使用
+        self.sequence = SequenceAllocator()
 
     @property
     def random_char(self):
@@ -70,22 +74,26 @@ class SMPPFuzz:
             body += param
         return body
 
-    def gen_data(self, command_name, body=None):
+    def gen_data(self, command_name, body=None, sequence=None):
+        """
+        :param sequence: 会话的sequence_number分配器,与客户端共用才不会和正常请求冲突
+        """
         command_id = command.get_command_id(command_name)
         command_status = 0
-        self.sequence_number += 1
+        sequence_number = next(sequence or self.sequence)
         if body is None:
-            header = struct.pack(">4L", 16, command_id, command_status, self.sequence_number)
+            header = HEADER.pack(16, command_id, command_status, sequence_number)
             return header
         else:
             command_length = 16 + len(body)
-            header = struct.pack(">4L", command_length, command_id, command_status, self.sequence_number)
-            data = header + body
+            data = bytearray(command_length)
+            HEADER.pack_into(data, 0, command_length, command_id, command_status, sequence_number)
+            data[16:] = body
             return data
 
-    def fuzz_data(self, command_name):
+    def fuzz_data(self, command_name, sequence=None):
         body = self.gen_body(command_name)
-        data = self.gen_data(command_name, body)
+        data = self.gen_data(command_name, body, sequence)
         return data
 
 
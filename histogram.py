@@ -0,0 +1,108 @@
+import math
+
+# 每个2的幂区间分成2**SUB_BITS个桶,相对误差约为1/2**SUB_BITS
+SUB_BITS = 4
+SUB_HALF = 1 << SUB_BITS
+SUB_COUNT = SUB_HALF << 1
+# 超过MAX_VALUE的值记在最后一个桶
+MAX_VALUE = (1 << 64) - 1
+
+
+def bucket_index(value):
+    if value < SUB_COUNT:
+        return value if value > 0 else 0
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_HALF + (value >> shift) - SUB_HALF
+
+
+def bucket_range(index):
+    """
+    :return: 桶覆盖的[下界, 上界)
+    """
+    if index < SUB_COUNT:
+        return index, index + 1
+    shift = index // SUB_HALF - 1
+    low = (index - (shift + 1) * SUB_HALF + SUB_HALF) << shift
+    return low, low + (1 << shift)
+
+
+BUCKET_COUNT = bucket_index(MAX_VALUE) + 1
+
+
+class Histogram:
+    """
+    HDR风格的对数分桶直方图,记录整数值(如纳秒),记录是O(1)的,可以跨线程/进程合并
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        self.counts[bucket_index(min(value, MAX_VALUE))] += 1
+        self.total += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        :param other: Histogram或to_dict()的结果
+        """
+        if isinstance(other, Histogram):
+            other = other.to_dict()
+        for index, count in other["counts"].items():
+            self.counts[int(index)] += count
+        self.total += other["total"]
+        self.sum += other.get("sum", 0)
+        if other["min"] is not None and (self.min is None or other["min"] < self.min):
+            self.min = other["min"]
+        self.max = max(self.max, other["max"])
+        return self
+
+    def percentile(self, p):
+        """
+        :param p: 0~100
+        :return: 该分位所在桶的上界(不超过实际最大值),没有数据时返回0
+        """
+        if not self.total:
+            return 0
+        rank = max(math.ceil(self.total * p / 100), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_range(index)[1] - 1, self.max)
+        return self.max
+
+    def mean(self):
+        if not self.total:
+            return 0
+        return self.sum / self.total
+
+    def reset(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def to_dict(self):
+        """
+        只保留非空的桶,便于通过管道发送或写入文件
+        """
+        return {"counts": {i: c for i, c in enumerate(self.counts) if c}, "total": self.total, "sum": self.sum,
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls().merge(data)
+
+    def __len__(self):
+        return self.total
@@ -0,0 +1,189 @@
+import logging
+import math
+import threading
+import time
+
+import config
+import consts
+
+
+class Timer:
+    __slots__ = ("deadline", "callback", "args", "slot")
+
+    def __init__(self, deadline, callback, args, slot):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.slot = slot
+
+
+class TimerWheel:
+    """
+    哈希时间轮: 定时器按到期时间落进固定数量的槽,推进时只检查经过的槽,
+    添加/取消都是O(1),不需要为每个定时器起线程
+    """
+
+    def __init__(self, tick=config.TIMER_TICK, slots=config.TIMER_SLOTS):
+        """
+        :param tick: 每个槽对应的时间(秒)
+        :param slots: 槽数,超过一圈的定时器留在槽中等下一圈
+        """
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.origin = time.monotonic()
+        # 已经处理过的tick
+        self.current = 0
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def schedule(self, delay, callback, *args):
+        """
+        :param delay: 多少秒后调用callback(*args)
+        :return: 可以传给cancel的定时器
+        """
+        deadline = time.monotonic() + delay
+        with self.lock:
+            # 向上取整,保证处理到该槽时已经到期
+            index = max(math.ceil((deadline - self.origin) / self.tick), self.current + 1)
+            slot = self.slots[index % len(self.slots)]
+            timer = Timer(deadline, callback, args, slot)
+            slot.add(timer)
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            timer.slot.discard(timer)
+
+    def advance(self, now=None):
+        """
+        处理到now为止经过的槽,在锁外依次调用到期定时器的回调,一个回调出错不影响其余回调
+        :return: 到期的定时器数量
+        """
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self.origin) / self.tick)
+        expired = []
+        with self.lock:
+            if target <= self.current:
+                return 0
+            # 落后超过一圈时每个槽只需要检查一次
+            for index in range(max(self.current + 1, target - len(self.slots) + 1), target + 1):
+                slot = self.slots[index % len(self.slots)]
+                due = [timer for timer in slot if timer.deadline <= now]
+                slot.difference_update(due)
+                expired.extend(due)
+            self.current = target
+        for timer in expired:
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                self.logger.exception(f"定时器回调{timer.callback}出错")
+        return len(expired)
+
+    def run(self, running):
+        """
+        在当前线程中按tick推进,直到running()返回False
+        """
+        while running():
+            time.sleep(self.tick)
+            self.advance()
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+
+class InFlight:
+    __slots__ = ("sequence_number", "command_name", "timestamp", "context", "timer", "command_status", "payload")
+
+    def __init__(self, sequence_number, command_name, context=None, payload=None):
+        self.sequence_number = sequence_number
+        self.command_name = command_name
+        # 发送时的time.perf_counter_ns()
+        self.timestamp = time.perf_counter_ns()
+        # 调用方附带的上下文,响应或超时时原样带回
+        self.context = context
+        self.timer = None
+        # 收到响应后为响应的command_status,超时为consts.STATUS_TIMEOUT
+        self.command_status = None
+        # 需要断线重发时保存的请求报文
+        self.payload = payload
+
+    @property
+    def elapsed(self):
+        """
+        :return: 发送至今的秒数
+        """
+        return (time.perf_counter_ns() - self.timestamp) / 1e9
+
+    def __str__(self):
+        return f"InFlight(sequence_number:{self.sequence_number},command_name:{self.command_name})"
+
+
+class InFlightTable:
+    """
+    按sequence_number记录已发送未收到响应的请求,响应(包括generic_nack)和超时都能找回原请求
+    """
+
+    def __init__(self, timeout=config.RESPONSE_TIMEOUT, wheel=None, on_timeout=None):
+        """
+        :param timeout: 默认的响应超时时间(秒)
+        :param wheel: 共用的时间轮,为None时单独创建
+        :param on_timeout: 请求超时时的回调,参数为InFlight
+        """
+        self.timeout = timeout
+        # TimerWheel定义了__len__,空的时间轮为假,不能用or
+        self.wheel = TimerWheel() if wheel is None else wheel
+        self.on_timeout = on_timeout
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, sequence_number, command_name, context=None, timeout=None, payload=None):
+        """
+        已有相同sequence_number的请求时替换它,并取消它的定时器,否则旧定时器会让新请求提前超时
+        """
+        entry = InFlight(sequence_number, command_name, context, payload)
+        with self.lock:
+            old = self.entries.get(sequence_number)
+            if old is not None:
+                self.wheel.cancel(old.timer)
+            entry.timer = self.wheel.schedule(self.timeout if timeout is None else timeout, self.expire,
+                                              sequence_number)
+            self.entries[sequence_number] = entry
+        return entry
+
+    def pop(self, sequence_number, command_status=None):
+        """
+        :param command_status: 响应的command_status
+        :return: 对应的请求,没有时返回None
+        """
+        with self.lock:
+            entry = self.entries.pop(sequence_number, None)
+        if entry is not None:
+            self.wheel.cancel(entry.timer)
+            entry.command_status = command_status
+        return entry
+
+    def expire(self, sequence_number):
+        with self.lock:
+            entry = self.entries.pop(sequence_number, None)
+        if entry is not None:
+            entry.command_status = consts.STATUS_TIMEOUT
+            if self.on_timeout:
+                self.on_timeout(entry)
+
+    def clear(self):
+        """
+        丢弃全部在途请求
+        :return: 被丢弃的请求
+        """
+        with self.lock:
+            entries, self.entries = list(self.entries.values()), {}
+        for entry in entries:
+            self.wheel.cancel(entry.timer)
+        return entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, sequence_number):
+        return sequence_number in self.entries
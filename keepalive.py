@@ -0,0 +1,72 @@
+import time
+
+import config
+
+
+class Keepalive:
+    """
+    按链路空闲时间调度enquire_link: 收到任何PDU都说明链路正常,只有空闲超过idle秒才发送探测,
+    探测发出后timeout秒内没有收到任何数据则认为链路已断.定时挂在会话已有的时间轮上,不需要单独的线程
+    """
+
+    def __init__(self, wheel, probe, on_dead, idle=config.ENQUIRE_LINK_INTERVAL, timeout=config.ENQUIRE_LINK_TIMEOUT):
+        """
+        :param wheel: 推进定时的TimerWheel,回调在推进时间轮的线程中执行
+        :param probe: 发送enquire_link的函数
+        :param on_dead: 探测超时时调用
+        :param idle: 空闲多少秒后发送探测,0表示不发送
+        :param timeout: 等待探测响应的秒数
+        """
+        self.wheel = wheel
+        self.probe = probe
+        self.on_dead = on_dead
+        self.idle = idle
+        self.timeout = timeout
+        self.last_received = time.monotonic()
+        # 未确认的探测的发送时间
+        self.probe_sent = None
+        self.timer = None
+        # 发出的探测数和超时数
+        self.probes = 0
+        self.failures = 0
+
+    def touch(self):
+        """
+        收到数据时调用
+        """
+        self.last_received = time.monotonic()
+
+    def start(self):
+        self.stop()
+        if not self.idle:
+            return
+        self.touch()
+        self.probe_sent = None
+        self.timer = self.wheel.schedule(self.idle, self.check)
+
+    def stop(self):
+        if self.timer is not None:
+            self.wheel.cancel(self.timer)
+            self.timer = None
+
+    def check(self):
+        now = time.monotonic()
+        if self.probe_sent is not None:
+            if self.last_received < self.probe_sent:
+                self.timer = None
+                self.failures += 1
+                self.on_dead()
+                return
+            self.probe_sent = None
+        idle_for = now - self.last_received
+        if idle_for >= self.idle:
+            self.probe_sent = now
+            self.probes += 1
+            self.timer = self.wheel.schedule(self.timeout, self.check)
+            try:
+                self.probe()
+            except OSError:
+                # 发送失败同样按探测超时处理
+                pass
+        else:
+            self.timer = self.wheel.schedule(self.idle - idle_for, self.check)
@@ -0,0 +1,81 @@
+import atexit
+import logging
+import threading
+import time
+
+import config
+from metrics import LATENCY, metrics
+
+# 从submit_sm发出到收到对应状态报告
+SUBMIT_TO_RECEIPT = "submit_to_receipt"
+PERCENTILES = (50, 99, 99.9)
+
+
+class LatencyRecorder:
+    """
+    按名称(命令名或submit_to_receipt)分别记录纳秒级延迟的直方图,记录一次只是一次分桶计数.
+    直方图按线程记录在指标smpp_latency_seconds中,记录时不加锁
+    """
+
+    def __init__(self):
+        self.reporter = None
+        self.logger = logging.getLogger(__name__)
+
+    def record(self, name, value):
+        """
+        :param value: 延迟(纳秒)
+        """
+        LATENCY.observe(value, name)
+
+    def record_since(self, name, start):
+        """
+        :param start: time.perf_counter_ns()取得的开始时间
+        """
+        self.record(name, time.perf_counter_ns() - start)
+
+    def snapshot(self):
+        """
+        :return: {名称: 直方图副本}
+        """
+        return {name: histogram for (name,), histogram in metrics.collect().get(LATENCY, {}).items()}
+
+    def table(self, snapshot=None):
+        """
+        :return: 各项的次数和分位延迟(毫秒)组成的表格文本
+        """
+        header = "".join(f"{f'p{p}(ms)':>12}" for p in PERCENTILES)
+        lines = [f"{'name':<22}{'count':>10}{header}{'max(ms)':>12}"]
+        for name, histogram in sorted((snapshot or self.snapshot()).items()):
+            lines.append(f"{name:<22}{histogram.total:>10}" +
+                         "".join(f"{histogram.percentile(p) / 1e6:>12.2f}" for p in PERCENTILES) +
+                         f"{histogram.max / 1e6:>12.2f}")
+        return "\n".join(lines)
+
+    def dump(self):
+        snapshot = self.snapshot()
+        if snapshot:
+            self.logger.info(f"延迟统计:\n{self.table(snapshot)}")
+
+    def start(self, interval=config.LATENCY_REPORT_INTERVAL):
+        """
+        每interval秒以及进程退出时打印一次统计,重复调用只启动一次
+        :param interval: 0表示只在退出时打印
+        """
+        if self.reporter is not None:
+            return
+        atexit.register(self.dump)
+        self.reporter = threading.Thread(target=self.report, args=(interval,), daemon=True)
+        if interval:
+            self.reporter.start()
+
+    def report(self, interval):
+        while True:
+            time.sleep(interval)
+            self.dump()
+
+    def reset(self):
+        LATENCY.reset()
+
+
+# 进程内的全部会话共用
+latency = LatencyRecorder()
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+import config
+import consts
+from histogram import Histogram
+from log import setup_logging
+from metrics import metrics
+from pool import SessionPool
+
+COUNTERS = ("sent", "ok", "failed", "timeout")
+
+
+class WorkerStats:
+    """
+    工作进程内的计数和延迟直方图,按间隔把增量发给父进程后清零
+    """
+
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.latency = Histogram()
+
+    def flush(self, out, worker_id):
+        out.put(("stats", worker_id, self.counters, self.latency.to_dict()))
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.latency.reset()
+
+
+async def run_worker(worker_id, args, out):
+    pool = SessionPool(args.binds, policy=args.policy, window=args.window, rate=args.rate / args.workers)
+    if not await pool.start(args.host, args.port):
+        return
+    stats = WorkerStats()
+    deadline = time.monotonic() + args.duration if args.duration else None
+    next_flush = time.monotonic() + args.report
+    pending = set()
+
+    async def submit(message):
+        start = time.perf_counter_ns()
+        try:
+            resp = await pool.submit_sm(message)
+        except asyncio.TimeoutError:
+            stats.counters["timeout"] += 1
+            return
+        except ConnectionError:
+            stats.counters["failed"] += 1
+            return
+        stats.latency.record(time.perf_counter_ns() - start)
+        stats.counters["ok" if resp.command_status == consts.ESME_ROK else "failed"] += 1
+
+    i = 0
+    while (not args.count or i < args.count) and (deadline is None or time.monotonic() < deadline):
+        if not pool.available:
+            break
+        while pending and len(pending) >= pool.capacity:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        pending.add(asyncio.ensure_future(submit(f"loadgen {worker_id} {i}")))
+        stats.counters["sent"] += 1
+        i += 1
+        if time.monotonic() >= next_flush:
+            stats.flush(out, worker_id)
+            next_flush += args.report
+    if pending:
+        await asyncio.wait(pending)
+    stats.flush(out, worker_id)
+    await pool.close()
+
+
+def worker(worker_id, args, out):
+    # fork出的子进程没有父进程的写日志线程,重新安装
+    setup_logging(level=logging.WARNING, force=True)
+    # 每个进程有自己的指标,依次使用后面的端口和带进程编号的快照文件
+    path = config.METRICS_SNAPSHOT_FILE
+    metrics.start(port=config.METRICS_PORT + worker_id if config.METRICS_PORT else 0,
+                  path=f"{path}.{worker_id}" if path else None)
+    if args.pin:
+        if hasattr(os, "sched_setaffinity"):
+            cores = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, {cores[worker_id % len(cores)]})
+        else:
+            logging.warning("当前系统不支持绑定CPU核")
+    try:
+        asyncio.run(run_worker(worker_id, args, out))
+    finally:
+        out.put(("done", worker_id))
+
+
+def format_latency(histogram):
+    return ",".join(f"p{p}={histogram.percentile(p) / 1e6:.2f}ms" for p in (50, 99, 99.9))
+
+
+def report(out, workers, interval):
+    """
+    汇总各工作进程发来的增量,按间隔打印合计的消息速率和延迟分位
+    """
+    totals = dict.fromkeys(COUNTERS, 0)
+    total_latency = Histogram()
+    window = dict.fromkeys(COUNTERS, 0)
+    window_latency = Histogram()
+    start = last = time.monotonic()
+    running = len(workers)
+    while running:
+        try:
+            message = out.get(timeout=interval)
+        except queue.Empty:
+            message = None
+        if message and message[0] == "done":
+            running -= 1
+        elif message:
+            _, _, counters, latency = message
+            for k, v in counters.items():
+                totals[k] += v
+                window[k] += v
+            total_latency.merge(latency)
+            window_latency.merge(latency)
+        now = time.monotonic()
+        if now - last >= interval:
+            print(f"[{now - start:6.1f}s] {(window['ok'] + window['failed']) / (now - last):10.0f} msgs/s 成功{totals['ok']} "
+                  f"失败{totals['failed']} 超时{totals['timeout']} {format_latency(window_latency)}")
+            window = dict.fromkeys(COUNTERS, 0)
+            window_latency.reset()
+            last = now
+    cost = time.monotonic() - start
+    print(f"合计: 发送{totals['sent']} 成功{totals['ok']} 失败{totals['failed']} 超时{totals['timeout']} "
+          f"平均{(totals['ok'] + totals['failed']) / cost:.0f} msgs/s {format_latency(total_latency)}")
+    return totals, total_latency
+
+
+def parse_terminal_params():
+    parser = argparse.ArgumentParser(description="多进程压测")
+    parser.add_argument("-w", "--workers", default=os.cpu_count(), type=int, help="工作进程数")
+    parser.add_argument("-b", "--binds", default=config.BIND_COUNT, type=int, help="每个进程的绑定数")
+    parser.add_argument("-n", "--count", default=0, type=int, help="每个进程发送数量,0表示不限")
+    parser.add_argument("-d", "--duration", default=0, type=float, help="持续时间(秒),0表示不限")
+    parser.add_argument("--window", default=config.WINDOW_SIZE, type=int, help="每个绑定的在途请求数")
+    parser.add_argument("--policy", default=config.POOL_POLICY, type=str, help="least_outstanding或round_robin")
+    parser.add_argument("-r", "--rate", default=config.RATE_LIMIT_TPS, type=float,
+                        help="全部进程合计的目标速率(条/秒),0表示不限速")
+    parser.add_argument("--pin", action="store_true", help="每个进程绑定到一个CPU核")
+    parser.add_argument("--report", default=1.0, type=float, help="统计打印间隔(秒)")
+    parser.add_argument("--host", default=config.SMPP_SERVER_HOST, type=str, help="SMSC地址")
+    parser.add_argument("--port", default=config.SMPP_SERVER_PORT, type=int, help="SMSC端口")
+    args = parser.parse_args()
+    if not args.count and not args.duration:
+        parser.error("需要指定--count或--duration")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_terminal_params()
+    setup_logging(level=logging.WARNING)
+    out = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker, args=(i, args, out), daemon=True) for i in range(args.workers)]
+    for p in workers:
+        p.start()
+    report(out, workers, args.report)
+    for p in workers:
+        p.join()
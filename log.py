@@ -0,0 +1,141 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+import config
+
+FORMAT_TEXT = "text"
+FORMAT_NDJSON = "ndjson"
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+# 可以留到写日志线程再格式化的参数类型,其他类型(如引用接收缓冲区的PDUView)在调用线程中格式化
+IMMUTABLE_TYPES = (int, float, str, bytes, bool, type(None))
+
+listener = None
+
+
+def category(name):
+    """
+    :return: 作为extra传给日志调用的参数,用于按类别采样和NDJSON输出,应在模块级创建后复用
+    """
+    return {"category": name}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按类别采样,比例为0.01时每100条只保留1条,WARNING及以上和没有类别的日志全部保留
+    """
+
+    def __init__(self, rates):
+        """
+        :param rates: {类别: 保留比例}
+        """
+        super().__init__()
+        self.every = {name: max(round(1 / rate), 1) if rate > 0 else 0 for name, rate in rates.items()}
+        self.counters = {name: itertools.count() for name in rates}
+
+    def filter(self, record):
+        every = self.every.get(getattr(record, "category", None))
+        if every is None or record.levelno >= logging.WARNING:
+            return True
+        if not every:
+            return False
+        return next(self.counters[record.category]) % every == 0
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    调用线程只把日志记录放进队列,消息的格式化和写出都在QueueListener的线程中进行;队列满时丢弃并计数
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args and not all(isinstance(arg, IMMUTABLE_TYPES) for arg in record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出一行JSON,args原样放在args中便于程序处理
+    """
+
+    def format(self, record):
+        event = {"time": record.created, "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        if hasattr(record, "category"):
+            event["category"] = record.category
+        if record.args:
+            event["args"] = [arg.decode(errors="replace") if isinstance(arg, bytes) else arg for arg in record.args]
+        if record.exc_text:
+            event["exc"] = record.exc_text
+        return json.dumps(event, ensure_ascii=False)
+
+
+def setup_logging(level=config.LOG_LEVEL, fmt=config.LOG_FORMAT, path=config.LOG_FILE, sampling=config.LOG_SAMPLING,
+                  force=False):
+    """
+    在根logger上安装队列handler,由后台线程写出,重复调用不会重复安装.
+    根logger已经由其他代码配置过时不做修改,除非force为True
+    :param level: 日志级别
+    :param fmt: text或ndjson
+    :param path: 日志文件,为None时写到标准错误
+    :param sampling: {类别: 保留比例}
+    :return: QueueListener,没有安装时返回None
+    """
+    global listener
+    root = logging.getLogger()
+    if listener is not None and not force:
+        return listener
+    if root.handlers and not force:
+        return None
+    if listener is not None:
+        listener.stop()
+        listener = None
+    else:
+        atexit.register(stop_logging)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    output = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == FORMAT_NDJSON else logging.Formatter(TEXT_FORMAT))
+    handler = LazyQueueHandler(queue.Queue(config.LOG_QUEUE_SIZE))
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_logging():
+    """
+    写出队列中剩余的日志并停止后台线程,之后的日志直接同步写出
+    """
+    global listener
+    if listener is None:
+        return
+    listener.stop()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, LazyQueueHandler):
+            root.removeHandler(handler)
+    for output in listener.handlers:
+        root.addHandler(output)
+    listener = None
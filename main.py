@@ -1,6 +1,11 @@
 import argparse
+import asyncio
+import logging
 
+import config
+from bulk import run_bulk
 from client import SMPPClient
+from log import setup_logging
 from utils import get_interfaces_and_ips
 
 
@@ -10,17 +15,28 @@ def parse_terminal_params():
     parser.add_argument("-c", "--count", default=1, type=int, help="发送数量")
     parser.add_argument("-l", "--loop", default=1, type=int, help="循环次数")
     parser.add_argument("-t", "--interval", default=0.1, type=float, help="间隔时间")
+    parser.add_argument("-f", "--file", default=None, type=str,
+                        help="批量发送模式: 从CSV/JSONL文件读取目的地址和短消息,-表示标准输入")
+    parser.add_argument("--format", default=None, choices=("csv", "jsonl"), help="批量文件格式,默认按扩展名判断")
+    parser.add_argument("-o", "--output", default=None, type=str, help="批量发送结果CSV文件")
+    parser.add_argument("-b", "--binds", default=config.BIND_COUNT, type=int, help="批量发送的绑定数")
+    parser.add_argument("-r", "--rate", default=config.RATE_LIMIT_TPS, type=float,
+                        help="批量发送速率(条/秒),0表示不限速")
 
     args = parser.parse_args()
     print(args)
-    return args.interface, args.count, args.loop, args.interval
+    return args
 
 
 if __name__ == '__main__':
-    interface, count, loop, interval = parse_terminal_params()
+    args = parse_terminal_params()
     interfaces_ips = get_interfaces_and_ips()
-    host = interfaces_ips.get(interface)
-    client = SMPPClient(host)
-    client.connect()
-    client.run(count, loop, interval)
-    # client.fuzz(count, loop, interval)
+    host = interfaces_ips.get(args.interface)
+    if args.file:
+        setup_logging(level=logging.INFO)
+        asyncio.run(run_bulk(args.file, args.format, args.output, args.binds, rate=args.rate, local_host=host))
+    else:
+        client = SMPPClient(host)
+        client.connect()
+        client.run(args.count, args.loop, args.interval)
+        # client.fuzz(args.count, args.loop, args.interval)
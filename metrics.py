@@ -0,0 +1,386 @@
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+import consts
+from codec import LONG
+from command import get_command_name
+from histogram import Histogram
+from registry import commands
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.99, 0.999)
+# command_status -> ESME_R*名称
+STATUS_NAMES = {value: name for name, value in vars(consts).items() if name.startswith("ESME_R")}
+
+session_ids = itertools.count()
+
+
+def new_session_id():
+    """
+    :return: 作为session标签的会话编号,config.METRICS_SESSION_LABEL为False时返回空串(不输出该标签)
+    """
+    return str(next(session_ids)) if config.METRICS_SESSION_LABEL else ""
+
+
+def command_label(value):
+    if isinstance(value, int):
+        return get_command_name(value) or "unknown"
+    return value or "unknown"
+
+
+def status_label(value):
+    if value is None:
+        return "unknown"
+    return STATUS_NAMES.get(value, f"{value:#010x}")
+
+
+# 记录时只保存原始值,输出时再转换成名称
+LABEL_FORMATTERS = {"command": command_label, "status": status_label}
+
+
+def escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, description, labels=()):
+        """
+        :param labels: 标签名,记录时按相同顺序传入标签值
+        """
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.formatters = [LABEL_FORMATTERS.get(label, str) for label in labels]
+
+    def group(self, values):
+        """
+        按输出时的标签文本合并,如不同的未知command_id都合并成command="unknown"
+        """
+        grouped = {}
+        for labels, value in values.items():
+            key = tuple(formatter(v) if v != "" else "" for formatter, v in zip(self.formatters, labels))
+            if key in grouped:
+                grouped[key] = merge_value(grouped[key], value)
+            else:
+                grouped[key] = value
+        return grouped
+
+    def reset(self):
+        """
+        清除其他线程的计数时没有加锁,同时发生的记录可能丢失
+        """
+        self.registry.reset(self)
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.group(values).items()):
+            lines.extend(self.render_sample(self.format_labels(labels), value))
+        return lines
+
+    def format_labels(self, labels):
+        pairs = [f'{label}="{escape(value)}"' for label, value in zip(self.labels, labels) if value != ""]
+        return ",".join(pairs)
+
+    def render_sample(self, labels, value):
+        return [f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}"]
+
+
+class Counter(Metric):
+    """
+    只增不减的计数,每个线程累加自己的字典,不加锁
+    """
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        values = self.registry.shard()
+        key = (self, labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    当前值,后设置的覆盖先设置的;也可以跟踪对象,输出时再取值,同一组标签跟踪多个对象时取值相加,
+    对象被回收后自动不再跟踪
+    """
+    kind = "gauge"
+
+    def __init__(self, registry, name, description, labels=()):
+        super().__init__(registry, name, description, labels)
+        self.values = {}
+        # {标签值: [(对象的弱引用, 取值函数)]}
+        self.tracked = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def track(self, obj, fn, *labels):
+        """
+        同一个对象在同一组标签下只跟踪一次,如多个会话共用的SubmitIndex
+        :param fn: 输出时以obj为参数调用,返回当前值,如len
+        """
+        with self.lock:
+            entries = self.tracked.setdefault(labels, [])
+            if not any(ref() is obj for ref, _ in entries):
+                entries.append((weakref.ref(obj), fn))
+
+    def remove(self, *labels):
+        self.values.pop(labels, None)
+        with self.lock:
+            self.tracked.pop(labels, None)
+
+    def collect(self):
+        values = dict(self.values)
+        with self.lock:
+            for labels, entries in list(self.tracked.items()):
+                alive = [(ref, fn, ref()) for ref, fn in entries]
+                alive = [(ref, fn, obj) for ref, fn, obj in alive if obj is not None]
+                if not alive:
+                    del self.tracked[labels]
+                    continue
+                self.tracked[labels] = [(ref, fn) for ref, fn, _ in alive]
+                values[labels] = values.get(labels, 0) + sum(fn(obj) for _, fn, obj in alive)
+        return values
+
+
+class Summary(Metric):
+    """
+    每个线程记录到自己的Histogram,输出时合并,按Prometheus summary输出分位数、总和和次数
+    """
+    kind = "summary"
+
+    def __init__(self, registry, name, description, labels=(), scale=1):
+        """
+        :param scale: 输出时乘上的系数,如记录纳秒输出秒时为1e-9
+        """
+        super().__init__(registry, name, description, labels)
+        self.scale = scale
+
+    def observe(self, value, *labels):
+        values = self.registry.shard()
+        key = (self, labels)
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = Histogram()
+        histogram.record(value)
+
+    def render_sample(self, labels, histogram):
+        lines = []
+        for q in QUANTILES:
+            quantile = f'quantile="{q}"'
+            lines.append(f"{self.name}{{{labels + ',' + quantile if labels else quantile}}} "
+                         f"{histogram.percentile(q * 100) * self.scale:.9g}")
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {histogram.sum * self.scale:.9g}")
+        lines.append(f"{self.name}_count{suffix} {histogram.total}")
+        return lines
+
+
+def merge_value(current, value):
+    if isinstance(value, Histogram):
+        return Histogram().merge(current).merge(value)
+    return current + value
+
+
+class MetricsRegistry:
+    """
+    进程内的指标.计数和直方图记录在各线程自己的字典中,记录路径上没有锁;
+    输出时合并全部线程的字典,已退出线程的数据并入retired后丢弃其字典
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.local = threading.local()
+        # [(线程, 该线程的{(指标, 标签值): 值})]
+        self.shards = []
+        self.retired = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.reporter = None
+        self.logger = logging.getLogger(__name__)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.add(Counter(self, name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self.add(Gauge(self, name, description, labels))
+
+    def summary(self, name, description, labels=(), scale=1):
+        return self.add(Summary(self, name, description, labels, scale))
+
+    def shard(self):
+        """
+        :return: 当前线程的计数字典,第一次调用时创建并登记
+        """
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            with self.lock:
+                self.shards.append((threading.current_thread(), values))
+            return values
+
+    def collect(self):
+        """
+        :return: {指标: {标签值: 值}}
+        """
+        merged = {}
+        with self.lock:
+            alive = []
+            for thread, values in self.shards:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    fold(self.retired, values)
+            self.shards = alive
+            fold(merged, self.retired)
+            for _, values in alive:
+                # dict.copy在持有GIL时完成,不会和所属线程的写入交错
+                fold(merged, values.copy())
+        result = {}
+        for (metric, labels), value in merged.items():
+            result.setdefault(metric, {})[labels] = value
+        for metric in self.metrics:
+            if isinstance(metric, Gauge):
+                result[metric] = metric.collect()
+        return result
+
+    def reset(self, metric=None):
+        """
+        :param metric: 为None时清除全部计数
+        """
+        with self.lock:
+            for values in [self.retired] + [values for _, values in self.shards]:
+                for key in list(values):
+                    if metric is None or key[0] is metric:
+                        values.pop(key, None)
+
+    def render(self):
+        """
+        :return: Prometheus文本格式
+        """
+        collected = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(collected.get(metric, {})))
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path):
+        """
+        先写临时文件再替换,读取方不会读到写了一半的文件
+        """
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def start(self, host=config.METRICS_HOST, port=config.METRICS_PORT, path=config.METRICS_SNAPSHOT_FILE,
+              interval=config.METRICS_SNAPSHOT_INTERVAL):
+        """
+        监听http://host:port/metrics,每interval秒以及进程退出时写一次快照文件,重复调用只启动一次
+        :param port: 0表示不监听
+        :param path: 快照文件,为None时不写
+        """
+        if self.reporter is not None:
+            return
+        self.reporter = threading.Thread(target=self.report, args=(path, interval), daemon=True)
+        if port:
+            try:
+                self.server = MetricsServer((host, port), self)
+            except OSError as e:
+                self.logger.warning(f"指标端口{host}:{port}监听失败,{e}")
+            else:
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if path:
+            atexit.register(self.write_snapshot, path)
+            if interval:
+                self.reporter.start()
+
+    def report(self, path, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.write_snapshot(path)
+            except OSError as e:
+                self.logger.error(f"写指标快照{path}失败,{e}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def fold(target, values):
+    for key, value in values.items():
+        if isinstance(value, Histogram):
+            histogram = target.get(key)
+            if histogram is None:
+                histogram = target[key] = Histogram()
+            histogram.merge(value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, registry):
+        self.registry = registry
+        super().__init__(address, MetricsHandler)
+
+
+def count_sent(buffers, session):
+    """
+    按PDU头中的command_id统计发出的PDU,在写线程或事件循环中调用
+    """
+    for data in buffers:
+        command_id = LONG.unpack_from(data, 4)[0] if len(data) >= 8 else None
+        PDUS_SENT.inc(command_id if command_id in commands else None, session)
+
+
+def count_receipt(receipt, submission):
+    RECEIPTS.inc(receipt.stat or "unknown", "false" if submission is None else "true")
+
+
+# 进程内的全部会话共用
+metrics = MetricsRegistry()
+PDUS_SENT = metrics.counter("smpp_pdus_sent_total", "发送的PDU数", ("command", "session"))
+PDUS_RECEIVED = metrics.counter("smpp_pdus_received_total", "收到的PDU数", ("command", "status", "session"))
+REQUEST_TIMEOUTS = metrics.counter("smpp_request_timeouts_total", "等待响应超时的请求数", ("command", "session"))
+RECONNECTS = metrics.counter("smpp_reconnects_total", "重连成功的次数", ("session",))
+RECEIPTS = metrics.counter("smpp_receipts_total", "收到的状态报告数", ("stat", "matched"))
+INFLIGHT = metrics.gauge("smpp_inflight_requests", "已发送未收到响应的请求数", ("session",))
+RECEIPTS_PENDING = metrics.gauge("smpp_receipts_pending", "等待状态报告的消息数")
+LATENCY = metrics.summary("smpp_latency_seconds", "请求到响应、submit_sm到状态报告的延迟", ("name",), scale=1e-9)
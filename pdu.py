@@ -1,9 +1,64 @@
 import struct
-import gsm0338
+from functools import lru_cache
 
 import config
 import consts
+from charset import encode_message
 from command import get_command_name
+from tlv import encode_tlvs
+
+
+@lru_cache(maxsize=config.STRUCT_CACHE_SIZE)
+def get_struct(grammar):
+    """
+    按格式串缓存编译好的Struct,相同形状的PDU共享同一个布局
+    """
+    return struct.Struct(grammar)
+
+
+def struct_cache_info():
+    """
+    :return: 布局缓存的命中/未命中统计
+    """
+    info = get_struct.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+
+PACK_PLAIN = 0
+PACK_STR = 1
+
+_pack_plans = {}
+_tlv_params = {}
+
+
+def get_tlv_params(cls):
+    """
+    :return: body中声明的可选参数名
+    """
+    params = _tlv_params.get(cls)
+    if params is None:
+        params = _tlv_params[cls] = [k for k, v in (getattr(cls, 'body', None) or {}).items() if type(v.type) == TLV]
+    return params
+
+
+def get_pack_plan(cls):
+    """
+    把header和body编译成编码计划,每个类只编译一次,可选参数整体编码为末尾的tlv_data
+    :return: [(字段名, 类型, 参数)]
+    """
+    plan = _pack_plans.get(cls)
+    if plan is not None:
+        return plan
+    plan = [(k, PACK_PLAIN, None) for k in cls.header]
+    for k, v in (getattr(cls, 'body', None) or {}).items():
+        if v.type == str:
+            plan.append((k, PACK_STR, b'\x00' if k in config.ADD_NULL_PARAMS else b''))
+        elif type(v.type) != TLV:
+            plan.append((k, PACK_PLAIN, None))
+    if get_tlv_params(cls):
+        plan.append(('tlv_data', PACK_PLAIN, None))
+    _pack_plans[cls] = plan
+    return plan
 
 
 class Param:
@@ -40,6 +95,18 @@ class TLV:
         return consts.OPTIONAL_PARAMS.get(self.tag)
 
 
+class UnsuccessSME:
+    """
+    递送失败的目的地址(submit_multi_resp)
+    """
+    body = {
+        'dest_addr_ton': Param(type=int, size=1),
+        'dest_addr_npi': Param(type=int, size=1),
+        'destination_addr': Param(type=str, max=21),
+        'error_status_code': Param(type=int, size=4),
+    }
+
+
 class PDU:
     header = {
         "command_length": Param(type=int, size=4),
@@ -52,76 +119,71 @@ class PDU:
         self.grammar = grammar
         self._add_grammer()
         # print(self.grammar)
-        self.struct = struct.Struct(self.grammar)
+        self.struct = get_struct(self.grammar)
         self.command_length = self.struct.size
-        self.pack_param = []
 
     def _set_vals(self, d):
         for k, v in d.items():
             setattr(self, k, v)
 
+    @classmethod
+    def from_fields(cls, fields):
+        """
+        不经过__init__,直接用解码出的字段构造PDU
+        """
+        pdu = cls.__new__(cls)
+        pdu._set_vals(dict.fromkeys(getattr(cls, 'body', None) or (), None))
+        pdu._set_vals(fields)
+        return pdu
+
     def _add_grammer(self):
-        if not getattr(self, 'body', None):
+        """
+        设置了值的可选参数按consts.OPTIONAL_PARAM_TYPES编码成tlv_data,追加在报文体末尾
+        """
+        params = get_tlv_params(type(self))
+        if not params:
             return
-        for k, v in self.body.items():
-            tlv = v.type
-            if type(tlv) == TLV:
-                s = '2H'
-                if tlv.type == int:
-                    s += consts.INT_PACK_FORMATS[tlv.length]
-                elif tlv.type == str:
-                    tlv_len = tlv.length if tlv.length else None
-                    if k == 'message_payload':
-                        tlv_len = len(self.message_bytes)
-                    elif tlv.max:
-                        tlv_len = len(getattr(self, k))
-                    if tlv_len is not None:
-                        s += f'{tlv_len}s'
-                self.grammar += s
+        items = []
+        for k in params:
+            value = getattr(self, k, None)
+            if k == 'message_payload':
+                value = self.message_bytes if value else None
+            items.append((k, value))
+        self.tlv_data = encode_tlvs(items)
+        if self.tlv_data:
+            self.grammar += f"{len(self.tlv_data)}s"
 
     def gen_pack_param(self):
-        for k, v in self.header.items():
+        pack_param = []
+        for k, kind, arg in get_pack_plan(type(self)):
             param = getattr(self, k)
-            self.pack_param.append(param)
-        if not getattr(self, 'body', None):
-            return
-        for k, v in self.body.items():
-            param = getattr(self, k)
-            tlv = v.type
-            if v.type == str and type(param) == str:
-                param = param.encode()
-                if k in config.ADD_NULL_PARAMS:
-                    param += b'\x00'
-                if k == "short_message":
-                    param = self.message_bytes
-            elif type(tlv) == TLV:
-                self.pack_param.append(TLV(k).get_tag())
-                if k == 'message_payload':
-                    param = self.message_bytes
-                elif tlv.type == str and type(param) == str:
-                    param = param.encode()
-                tlv_len = tlv.length if tlv.length else len(param)
-                self.pack_param.append(tlv_len)
+            if kind == PACK_STR:
+                if type(param) == str:
+                    param = self.message_bytes if k == "short_message" else param.encode() + arg
             if param != b'':
-                self.pack_param.append(param)
+                pack_param.append(param)
+        return pack_param
 
     def pack(self):
-        self.gen_pack_param()
         # print(self.grammar)
-        # print(self.pack_param)
-        data = self.struct.pack(*self.pack_param)
+        data = self.struct.pack(*self.gen_pack_param())
         return data
 
+    def pack_into(self, buf, offset=0):
+        """
+        直接编码到调用方提供的缓冲区
+        :return: 写入的字节数
+        """
+        self.struct.pack_into(buf, offset, *self.gen_pack_param())
+        return self.command_length
+
     def unpack(self, resp):
         # print(len(resp), resp)
         return self.struct.unpack(resp)
 
     def gen_message_bytes(self):
         msg = self.short_message if not getattr(self, 'message_payload', None) else self.message_payload
-        if self.data_coding == consts.ENCODING_ISO10646:
-            return msg.encode("utf-16be")
-        elif self.data_coding == consts.ENCODING_DEFAULT:
-            return gsm0338.Codec().encode(msg)[0]
+        return encode_message(msg, self.data_coding)
 
     def __str__(self):
         s = 'PDU('
@@ -135,6 +197,51 @@ class PDU:
                 s += f"{k}:{getattr(self, k)},"
         return s[:-1] + ')'
 
+    def to_record(self):
+        """
+        转成只保存header和body字段的紧凑记录
+        """
+        record_type = get_record_type(type(self))
+        return record_type(*[getattr(self, k, None) for k in record_type.__slots__])
+
+
+class PDURecord:
+    """
+    由header+body生成__slots__的紧凑PDU记录,没有__dict__,用于大量在途PDU和抓包缓存
+    """
+    __slots__ = ()
+    pdu = PDU
+
+    def __init__(self, *args):
+        for k, v in zip(self.__slots__, args):
+            setattr(self, k, v)
+
+    @classmethod
+    def from_fields(cls, fields):
+        return cls(*[fields.get(k) for k in cls.__slots__])
+
+    def to_pdu(self):
+        return self.pdu.from_fields({k: getattr(self, k) for k in self.__slots__})
+
+    def __str__(self):
+        return str(self.to_pdu())
+
+
+_record_types = {}
+
+
+def get_record_type(cls):
+    """
+    每个PDU类生成一次对应的记录类型,如SubmitSMPDU -> SubmitSMRecord
+    """
+    record_type = _record_types.get(cls)
+    if record_type is None:
+        fields = tuple(cls.header) + tuple(getattr(cls, 'body', None) or ())
+        name = cls.__name__[:-3] + 'Record' if cls.__name__.endswith('PDU') else cls.__name__ + 'Record'
+        record_type = type(name, (PDURecord,), {'__slots__': fields, 'pdu': cls})
+        _record_types[cls] = record_type
+    return record_type
+
 
 class HeaderPDU(PDU):
     def __init__(self, **kwargs):
@@ -224,33 +331,33 @@ class SubmitSMPDU(PDU):
 
         # Optional params
         'user_message_reference': Param(type=TLV(length=2)),
-        # 'source_port': Param(type=TLV(length=2)),
-        # 'source_addr_subunit': Param(type=TLV()),
-        # 'destination_port': Param(type=TLV(length=2)),
-        # 'dest_addr_subunit': Param(type=TLV()),
-        # 'sar_msg_ref_num': Param(type=TLV()),
-        # 'sar_total_segments': Param(type=TLV()),
-        # 'sar_segment_seqnum': Param(type=TLV()),
-        # 'more_messages_to_send': Param(type=TLV(type=str)),
-        # 'payload_type': Param(type=TLV()),
-        'message_payload': Param(type=TLV(type=str, max=64 * 1024)),
-        # 'privacy_indicator': Param(type=TLV()),
-        # 'callback_num': Param(type=TLV(type=str)),
-        # 'callback_num_pres_ind': Param(type=TLV(type=str)),
-        # 'callback_num_atag': Param(type=TLV(type=str)),
-        # 'source_subaddress': Param(type=TLV(type=str, max=23)),
-        # 'dest_subaddress': Param(type=TLV(type=str, max=23)),
-        # 'user_response_code': Param(type=TLV()),
-        # 'display_time': Param(type=TLV()),
-        # 'sms_signal': Param(type=TLV(type=str, length=2)),
-        # 'ms_validity': Param(type=TLV()),
-        # 'ms_msg_wait_facilities': Param(type=TLV(type=str)),
-        # 'number_of_messages': Param(type=TLV(type=str)),
-        # 'alert_on_message_delivery': Param(type=TLV(type=str, length=0)),
-        # 'language_indicator': Param(type=TLV()),
-        # 'its_reply_type': Param(type=TLV(type=str)),
-        # 'its_session_info': Param(type=TLV(type=str, length=2)),
-        # 'ussd_service_op': Param(type=TLV(type=str)),
+        'source_port': Param(type=TLV(length=2)),
+        'source_addr_subunit': Param(type=TLV()),
+        'destination_port': Param(type=TLV(length=2)),
+        'dest_addr_subunit': Param(type=TLV()),
+        'sar_msg_ref_num': Param(type=TLV(length=2)),
+        'sar_total_segments': Param(type=TLV()),
+        'sar_segment_seqnum': Param(type=TLV()),
+        'more_messages_to_send': Param(type=TLV()),
+        'payload_type': Param(type=TLV()),
+        'message_payload': Param(type=TLV(type=bytes, max=64 * 1024)),
+        'privacy_indicator': Param(type=TLV()),
+        'callback_num': Param(type=TLV(type=bytes, length=None)),
+        'callback_num_pres_ind': Param(type=TLV()),
+        'callback_num_atag': Param(type=TLV(type=bytes, length=None)),
+        'source_subaddress': Param(type=TLV(type=bytes, max=23)),
+        'dest_subaddress': Param(type=TLV(type=bytes, max=23)),
+        'user_response_code': Param(type=TLV()),
+        'display_time': Param(type=TLV()),
+        'sms_signal': Param(type=TLV(length=2)),
+        'ms_validity': Param(type=TLV()),
+        'ms_msg_wait_facilities': Param(type=TLV()),
+        'number_of_messages': Param(type=TLV()),
+        'alert_on_message_delivery': Param(type=TLV(type=bool, length=0)),
+        'language_indicator': Param(type=TLV()),
+        'its_reply_type': Param(type=TLV()),
+        'its_session_info': Param(type=TLV(type=bytes, length=2)),
+        'ussd_service_op': Param(type=TLV(type=bytes)),
     }
 
     def __init__(self, **kwargs):
@@ -297,26 +404,26 @@ class SubmitMultiPDU(PDU):
 
         # # Optional params
         'user_message_reference': Param(type=TLV(length=2)),
-        'source_port': Param(type=TLV()),
+        'source_port': Param(type=TLV(length=2)),
         'source_addr_subunit': Param(type=TLV()),
-        'destination_port': Param(type=TLV()),
+        'destination_port': Param(type=TLV(length=2)),
         'dest_addr_subunit': Param(type=TLV()),
-        'sar_msg_ref_num': Param(type=TLV()),
+        'sar_msg_ref_num': Param(type=TLV(length=2)),
         'sar_total_segments': Param(type=TLV()),
         'sar_segment_seqnum': Param(type=TLV()),
         'payload_type': Param(type=TLV()),
-        'message_payload': Param(type=TLV(type=str)),
+        'message_payload': Param(type=TLV(type=bytes, length=None)),
         'privacy_indicator': Param(type=TLV()),
-        'callback_num': Param(type=TLV(type=str)),
-        'callback_num_pres_ind': Param(type=TLV(type=str)),
-        'callback_num_atag': Param(type=TLV(type=str)),
-        'source_subaddress': Param(type=TLV(type=str, max=23)),
-        'dest_subaddress': Param(type=TLV(type=str, max=23)),
+        'callback_num': Param(type=TLV(type=bytes, length=None)),
+        'callback_num_pres_ind': Param(type=TLV()),
+        'callback_num_atag': Param(type=TLV(type=bytes, length=None)),
+        'source_subaddress': Param(type=TLV(type=bytes, max=23)),
+        'dest_subaddress': Param(type=TLV(type=bytes, max=23)),
         'display_time': Param(type=TLV()),
-        'sms_signal': Param(type=TLV(type=str)),
+        'sms_signal': Param(type=TLV(length=2)),
         'ms_validity': Param(type=TLV()),
-        'ms_msg_wait_facilities': Param(type=TLV(type=bytes)),
-        'alert_on_message_delivery': Param(type=TLV(type=str, length=0)),
+        'ms_msg_wait_facilities': Param(type=TLV()),
+        'alert_on_message_delivery': Param(type=TLV(type=bool, length=0)),
         'language_indicator': Param(type=TLV()),
         # # 目的地址定义
         # 'dest_flag': Param(type=int,size=1),
@@ -341,14 +448,8 @@ class SubmitMultiRespPDU(PDU):
     body = {
         "message_id": Param(type=str, max=65),
         "no_unsuccess": Param(type=int, size=1),
-        "unsuccess_smes": Param(type=str),
-        # Optional params
         # 递送失败
-        # 'dest_addr_ton': Param(type=int, size=1),
-        # 'dest_addr_npi': Param(type=int, size=1),
-        # 'destination_addr': Param(type=str, max=21),
-        # 'error_status_code': Param(type=int, size=1),
-
+        "unsuccess_smes": Param(type=UnsuccessSME, len_field='no_unsuccess'),
     }
 
     def __init__(self, **kwargs):
@@ -379,24 +480,24 @@ class DeliverSMPDU(PDU):
         'short_message': Param(type=str, max=254, len_field='sm_length'),
 
         # Optional params
-        # 'user_message_reference': Param(type=TLV(length=2)),
-        # 'source_port': Param(type=TLV()),
-        # 'destination_port': Param(type=TLV()),
-        # 'sar_msg_ref_num': Param(type=TLV()),
-        # 'sar_total_segments': Param(type=TLV()),
-        # 'sar_segment_seqnum': Param(type=TLV()),
-        # 'user_response_code': Param(type=TLV()),
-        # 'privacy_indicator': Param(type=TLV()),
-        # 'payload_type': Param(type=TLV()),
-        # 'message_payload': Param(type=TLV(type=str)),
-        # 'callback_num': Param(type=TLV(type=str)),
-        # 'source_subaddress': Param(type=TLV(type=str,max=23)),
-        # 'dest_subaddress': Param(type=TLV(type=str,max=23)),
-        # 'language_indicator': Param(type=TLV()),
-        # 'its_session_info': Param(type=TLV(type=str)),
-        # 'network_error_code': Param(type=TLV(type=str,length=3)),
-        # 'message_state': Param(type=TLV(type=str)),
-        # 'receipted_message_id': Param(type=TLV(type=str,max=65)),
+        'user_message_reference': Param(type=TLV(length=2)),
+        'source_port': Param(type=TLV(length=2)),
+        'destination_port': Param(type=TLV(length=2)),
+        'sar_msg_ref_num': Param(type=TLV(length=2)),
+        'sar_total_segments': Param(type=TLV()),
+        'sar_segment_seqnum': Param(type=TLV()),
+        'user_response_code': Param(type=TLV()),
+        'privacy_indicator': Param(type=TLV()),
+        'payload_type': Param(type=TLV()),
+        'message_payload': Param(type=TLV(type=bytes, length=None)),
+        'callback_num': Param(type=TLV(type=bytes, length=None)),
+        'source_subaddress': Param(type=TLV(type=bytes, max=23)),
+        'dest_subaddress': Param(type=TLV(type=bytes, max=23)),
+        'language_indicator': Param(type=TLV()),
+        'its_session_info': Param(type=TLV(type=bytes, length=2)),
+        'network_error_code': Param(type=TLV(type=bytes, length=3)),
+        'message_state': Param(type=TLV()),
+        'receipted_message_id': Param(type=TLV(type=str,max=65)),
     }
 
     def __init__(self, **kwargs):
@@ -436,65 +537,63 @@ class DeliverSMRespPDU(PDU):
 
 class DataSMPDU(PDU):
     body = {
-        "service_type": Param(type=str, size=1),
+        "service_type": Param(type=str, max=6),
         "source_addr_ton": Param(type=int, size=1),
         "source_addr_npi": Param(type=int, size=1),
         "source_addr": Param(type=str, max=21),
         "dest_addr_ton": Param(type=int, size=1),
         "dest_addr_npi": Param(type=int, size=1),
         "destination_addr": Param(type=str, max=21),
-        "esm_class": Param(type=str, size=1),
+        "esm_class": Param(type=int, size=1),
         "registered_delivery": Param(type=int, size=1),
         "data_coding": Param(type=int, size=1),
 
         # # Optional params
-        'source_port': Param(type=TLV()),
+        'source_port': Param(type=TLV(length=2)),
         'source_addr_subunit': Param(type=TLV()),
         'source_network_type': Param(type=TLV()),
         'source_bearer_type': Param(type=TLV()),
         'source_telematics_id': Param(type=TLV()),
-        'destination_port': Param(type=TLV()),
+        'destination_port': Param(type=TLV(length=2)),
         'dest_addr_subunit': Param(type=TLV()),
         'dest_network_type': Param(type=TLV()),
         'dest_bearer_type': Param(type=TLV()),
         'dest_telematics_id': Param(type=TLV(length=2)),
-        'sar_msg_ref_num': Param(type=TLV()),
+        'sar_msg_ref_num': Param(type=TLV(length=2)),
         'sar_total_segments': Param(type=TLV()),
         'sar_segment_seqnum': Param(type=TLV()),
-        'more_messages_to_send': Param(type=TLV(type=str)),
+        'more_messages_to_send': Param(type=TLV()),
         'qos_time_to_live': Param(type=TLV(length=4)),
         'payload_type': Param(type=TLV()),
-        'message_payload': Param(type=TLV(type=str)),
+        'message_payload': Param(type=TLV(type=bytes, length=None)),
         'set_dpf': Param(type=TLV()),
         'receipted_message_id': Param(type=TLV(type=str, max=65)),
-        'message_state': Param(type=TLV(type=str)),
-        'network_error_code': Param(type=TLV(type=str, length=3)),
+        'message_state': Param(type=TLV()),
+        'network_error_code': Param(type=TLV(type=bytes, length=3)),
         'user_message_reference': Param(type=TLV(length=2)),
         'privacy_indicator': Param(type=TLV()),
-        'callback_num': Param(type=TLV(type=str)),
-        'callback_num_pres_ind': Param(type=TLV(type=str)),
-        'callback_num_pres_atag': Param(type=TLV(type=str)),
-        'source_subaddress': Param(type=TLV(type=str, max=23)),
-        'dest_subaddress': Param(type=TLV(type=str, max=23)),
+        'callback_num': Param(type=TLV(type=bytes, length=None)),
+        'callback_num_pres_ind': Param(type=TLV()),
+        'callback_num_atag': Param(type=TLV(type=bytes, length=None)),
+        'source_subaddress': Param(type=TLV(type=bytes, max=23)),
+        'dest_subaddress': Param(type=TLV(type=bytes, max=23)),
         'user_response_code': Param(type=TLV()),
         'display_time': Param(type=TLV()),
-        'sms_signal': Param(type=TLV(type=str)),
+        'sms_signal': Param(type=TLV(length=2)),
         'ms_validity': Param(type=TLV()),
-        'ms_msg_wait_facilities': Param(type=TLV(type=bytes)),
-        'number_of_messages': Param(type=TLV(type=str)),
-        'alert_on_message_delivery': Param(type=TLV(type=str, length=0)),
+        'ms_msg_wait_facilities': Param(type=TLV()),
+        'number_of_messages': Param(type=TLV()),
+        'alert_on_message_delivery': Param(type=TLV(type=bool, length=0)),
         'language_indicator': Param(type=TLV()),
-        'its_reply_type': Param(type=TLV(type=str)),
-        'its_session_info': Param(type=TLV(type=str)),
+        'its_reply_type': Param(type=TLV()),
+        'its_session_info': Param(type=TLV(type=bytes, length=2)),
     }
 
     def __init__(self, **kwargs):
         self._set_vals(kwargs)
-        message_bytes = self.gen_message_bytes()
-        self.message_payload_tag = TLV("message_payload").get_tag()
-        self.message_payload = message_bytes + b'\x1b\x3c\x54\x52\x49\x41\x4c\x1b\x3e'
-        self.payload_length = len(self.message_payload)
-        grammar = f">4Lc2B{len(self.source_addr) + 1}s2B{len(self.destination_addr) + 1}sc2B2H{self.payload_length}s"
+        self.message_bytes = self.gen_message_bytes() + b'\x1b\x3c\x54\x52\x49\x41\x4c\x1b\x3e'
+        self.message_payload = self.message_bytes
+        grammar = f">4L{len(self.service_type)}s2B{len(self.source_addr) + 1}s2B{len(self.destination_addr) + 1}s3B"
         super().__init__(grammar)
 
 
@@ -503,8 +602,8 @@ class DataSMRespPDU(PDU):
         "message_id": Param(type=str),
 
         # Optional params
-        'delivery_failure_reason': Param(type=TLV(type=str)),
-        'networf_error_code': Param(type=TLV()),
+        'delivery_failure_reason': Param(type=TLV()),
+        'network_error_code': Param(type=TLV(type=bytes, length=3)),
         'additional_status_info_text': Param(type=TLV(type=str, max=256)),
         'dpf_result': Param(type=TLV()),
     }
@@ -530,10 +629,10 @@ class QuerySMPDU(PDU):
 
 
 class QuerySMRespPDU(PDU):
-    params = {
+    body = {
         'message_id': Param(type=str, max=65),
         'final_date': Param(type=str, max=17),
-        'message_state': Param(type=TLV(type=str)),
+        'message_state': Param(type=int, size=1),
         'error_code': Param(type=int, size=1),
     }
 
@@ -544,7 +643,7 @@ class QuerySMRespPDU(PDU):
 
 
 class CancelSMPDU(PDU):
-    params = {
+    body = {
         'service_type': Param(type=str, max=6),
         'message_id': Param(type=str, max=65),
         'source_addr_ton': Param(type=int, size=1),
@@ -571,8 +670,8 @@ class ReplaceSMPDU(PDU):
         'source_addr_ton': Param(type=int, size=1),
         'source_addr_npi': Param(type=int, size=1),
         'source_addr': Param(type=str, max=21),
-        'schedule_delivery_time': Param(type=int, size=8, max=17),
-        'validity_period': Param(type=int, size=8, max=17),
+        'schedule_delivery_time': Param(type=str, max=17),
+        'validity_period': Param(type=str, max=17),
         'registered_delivery': Param(type=int, size=1),
         'sm_default_msg_id': Param(type=int, size=1),
         'sm_length': Param(type=int, size=1),
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+
+import config
+from aioclient import AsyncSMPPClient
+from backoff import backoff_delays
+from metrics import RECONNECTS
+from ratelimit import TokenBucket
+from receipt import SubmitIndex
+
+POLICY_LEAST_OUTSTANDING = "least_outstanding"
+POLICY_ROUND_ROBIN = "round_robin"
+
+
+class SessionPool:
+    """
+    同时维持多个绑定,按策略把submit分配到健康的绑定上,某个绑定断开后其请求转到其余绑定重发
+    """
+
+    def __init__(self, size=config.BIND_COUNT, bind_mode=config.BIND_MODE, policy=config.POOL_POLICY, host=None,
+                 window=config.WINDOW_SIZE, timeout=config.RESPONSE_TIMEOUT, rate=config.RATE_LIMIT_TPS,
+                 session_rate=0):
+        """
+        :param size: 绑定数
+        :param bind_mode: bind_transmitter,bind_receiver或bind_transceiver
+        :param policy: least_outstanding选在途请求最少的绑定,round_robin依次轮流
+        :param window: 每个绑定的在途请求数上限
+        :param rate: 全部绑定合计的速率上限(条/秒),0表示不限速
+        :param session_rate: 每个绑定的速率上限(条/秒),0表示不限速
+        """
+        if policy not in (POLICY_LEAST_OUTSTANDING, POLICY_ROUND_ROBIN):
+            raise ValueError(f"不支持的分配策略:{policy}")
+        self.bind_mode = bind_mode
+        self.policy = policy
+        self.window = window
+        self.limiter = TokenBucket(rate)
+        # 状态报告可能从任意一个绑定回来,全部绑定共用一个索引
+        self.submitted = SubmitIndex()
+        self.sessions = [AsyncSMPPClient(host, window, timeout, TokenBucket(session_rate, parent=self.limiter),
+                                         self.submitted) for _ in range(size)]
+        self.next_index = 0
+        # 每个绑定一个重连任务,断开后按退避时间重连并重新绑定
+        self.supervisors = []
+        self.recovered = asyncio.Event()
+        self.closing = False
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self, host=config.SMPP_SERVER_HOST, port=config.SMPP_SERVER_PORT):
+        """
+        并发建立全部绑定
+        :return: 绑定成功的数量
+        """
+        results = await asyncio.gather(*(self.open(session, host, port) for session in self.sessions),
+                                       return_exceptions=True)
+        for session, result in zip(self.sessions, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"建立绑定失败,{result!r}")
+        bound = sum(1 for session in self.sessions if session.client_state > 1)
+        self.logger.info(f"会话池已建立{bound}/{len(self.sessions)}个绑定")
+        if bound and config.AUTO_RECONNECT:
+            self.supervisors = [asyncio.ensure_future(self.supervise(index, session, host, port))
+                                for index, session in enumerate(self.sessions)]
+        return bound
+
+    async def supervise(self, index, session, host, port):
+        """
+        绑定断开后按指数退避加随机抖动重连,重新绑定成功后重新开始计算退避时间
+        """
+        delays = backoff_delays()
+        attempts = 0
+        while not self.closing:
+            if session.can_submit:
+                await session.closed
+                delays = backoff_delays()
+                attempts = 0
+                continue
+            if session.connected:
+                # 连接还在但没有绑定成功
+                session.transport.close()
+                await session.closed
+            attempts += 1
+            if config.RECONNECT_ATTEMPTS and attempts > config.RECONNECT_ATTEMPTS:
+                self.logger.error(f"第{index}个绑定重连{config.RECONNECT_ATTEMPTS}次都失败,放弃重连")
+                return
+            await asyncio.sleep(next(delays))
+            if self.closing:
+                return
+            try:
+                await self.open(session, host, port)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"第{index}个绑定第{attempts}次重连失败,{e!r}")
+                continue
+            if session.can_submit:
+                self.logger.info(f"第{index}个绑定第{attempts}次重连成功")
+                RECONNECTS.inc(session.session_id)
+                self.recovered.set()
+
+    async def wait_available(self, timeout=config.RESPONSE_TIMEOUT):
+        """
+        没有可用的绑定时等待重连中的绑定恢复,超时后由pick报错
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.available and not self.closing and any(not task.done() for task in self.supervisors):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            self.recovered.clear()
+            try:
+                await asyncio.wait_for(self.recovered.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def open(self, session, host, port):
+        await session.connect(host, port)
+        await session.bind(self.bind_mode)
+
+    @property
+    def available(self):
+        return [session for session in self.sessions if session.can_submit]
+
+    @property
+    def capacity(self):
+        """
+        全部可用绑定的窗口总和
+        """
+        return len(self.available) * self.window
+
+    def pick(self):
+        """
+        :return: 按策略选出的可用绑定
+        """
+        sessions = self.available
+        if not sessions:
+            raise ConnectionError("没有可用的绑定")
+        if self.policy == POLICY_LEAST_OUTSTANDING:
+            return min(sessions, key=lambda session: session.outstanding)
+        self.next_index = (self.next_index + 1) % len(sessions)
+        return sessions[self.next_index]
+
+    async def submit_sm(self, message, destination_addr=config.DESTINATION_ADDR, timeout=None, data_coding=None):
+        """
+        发送一条submit_sm,所在绑定断开时换一个绑定重发,直到全部绑定都不可用
+        :return: 响应的PDUView
+        """
+        while True:
+            if not self.available:
+                await self.wait_available()
+            session = self.pick()
+            try:
+                return await session.submit_sm(message, destination_addr, timeout, data_coding)
+            except ConnectionError as e:
+                if session.can_submit:
+                    raise
+                self.logger.warning(f"第{self.sessions.index(session)}个绑定断开({e}),转到其他绑定重发")
+
+    async def submit_each(self, items, on_result, timeout=None):
+        """
+        流水线发送,同时在途的消息数不超过可用绑定的窗口总和,结果不在内存中累积
+        :param items: 前三项为(目的地址, 短消息, data_coding)的元组,其余项原样带给on_result;
+                      可以是生成器,按需读取;短消息为str时data_coding可以为None
+        :param on_result: 每条消息完成时调用on_result(序号, item, 响应PDUView或异常)
+        :return: 发送的消息数
+        """
+        pending = set()
+
+        async def submit(index, item):
+            destination_addr, message, data_coding = item[:3]
+            try:
+                result = await self.submit_sm(message, destination_addr, timeout, data_coding)
+            except Exception as e:
+                result = e
+            try:
+                on_result(index, item, result)
+            except Exception:
+                self.logger.exception(f"处理第{index}条消息的结果时出错")
+
+        count = 0
+        for count, item in enumerate(items, 1):
+            while len(pending) >= max(self.capacity, 1):
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.ensure_future(submit(count - 1, item)))
+        if pending:
+            await asyncio.wait(pending)
+        return count
+
+    async def submit_sm_many(self, messages, destination_addr=config.DESTINATION_ADDR, timeout=None):
+        """
+        :param messages: 可以是生成器,按需读取
+        :return: 与messages一一对应的响应PDUView或异常
+        """
+        results = []
+
+        def on_result(index, item, result):
+            results[index] = result
+
+        def items():
+            for message in messages:
+                results.append(None)
+                yield destination_addr, message, None
+
+        await self.submit_each(items(), on_result, timeout)
+        return results
+
+    def status(self):
+        """
+        :return: 每个绑定的状态,在途请求数和窗口大小
+        """
+        return [{"state": session.client_state, "connected": session.connected, "outstanding": session.outstanding,
+                 "window": self.window} for session in self.sessions]
+
+    async def close(self):
+        self.closing = True
+        for task in self.supervisors:
+            task.cancel()
+        await asyncio.gather(*(session.close() for session in self.sessions), return_exceptions=True)
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+import config
+import consts
+
+# 表示SMSC要求降速的command_status
+THROTTLE_STATUSES = (consts.ESME_RTHROTTLED, consts.ESME_RMSGQFUL)
+
+
+class TokenBucket:
+    """
+    令牌桶限速,按AIMD调整速率: 收到节流状态时乘性降速,成功响应时加性回升到目标速率.
+    不限速的桶统计发送速率,收到节流状态后从测得的速率开始限速.
+    parent为多个会话共用的全局桶,取令牌时两个桶都要满足
+    """
+
+    def __init__(self, rate=config.RATE_LIMIT_TPS, burst=config.RATE_LIMIT_BURST, parent=None, adaptive=True):
+        """
+        :param rate: 目标速率(条/秒),0表示不限速
+        :param burst: 允许的突发条数
+        :param adaptive: 是否根据响应状态自动调整速率
+        """
+        self.target = rate
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.parent = parent
+        self.adaptive = adaptive
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        # 上次降速的时间,同一批在途请求的节流响应只降一次
+        self.backoff_at = 0
+        # 不限速时统计发送速率: 当前窗口的开始时间和条数,上一个完整窗口测得的速率
+        self.window_start = self.updated
+        self.window_count = 0
+        self.measured = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, n=1):
+        """
+        预约n个令牌,令牌不足时记为欠账
+        :return: 需要等待的秒数
+        """
+        wait = 0
+        if self.rate:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= n
+                if self.tokens < 0:
+                    wait = -self.tokens / self.rate
+        elif self.adaptive:
+            with self.lock:
+                self.measure(n, time.monotonic())
+        if self.parent is not None:
+            wait = max(wait, self.parent.reserve(n))
+        return wait
+
+    def measure(self, n, now):
+        """
+        不限速时统计发送速率,调用时持有self.lock
+        """
+        elapsed = now - self.window_start
+        if elapsed >= config.RATE_MEASURE_WINDOW:
+            self.measured = self.window_count / elapsed
+            self.window_start = now
+            self.window_count = 0
+        self.window_count += n
+
+    def measured_rate(self, now):
+        """
+        :return: 不限速时测得的发送速率,还没有完整窗口时用当前窗口估算,都没有时用RATE_CEILING_TPS
+        """
+        rate = self.measured
+        if not rate and self.window_count:
+            rate = self.window_count / max(now - self.window_start, 1e-3)
+        if config.RATE_CEILING_TPS:
+            rate = min(rate, config.RATE_CEILING_TPS) if rate else config.RATE_CEILING_TPS
+        return max(rate, config.RATE_MIN_TPS)
+
+    def acquire(self, n=1):
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, n=1):
+        wait = self.reserve(n)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def feedback(self, command_status):
+        """
+        根据响应状态调整速率
+        """
+        if command_status in THROTTLE_STATUSES:
+            self.on_throttled()
+        elif command_status == consts.ESME_ROK:
+            self.on_success()
+        if self.parent is not None:
+            self.parent.feedback(command_status)
+
+    def on_throttled(self):
+        if not self.adaptive:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if now - self.backoff_at < config.RATE_BACKOFF_HOLD:
+                return
+            self.backoff_at = now
+            if not self.rate:
+                # 不限速时从测得的速率开始限速,令牌从0开始,不再允许一次突发
+                self.rate = self.measured_rate(now)
+                self.tokens = 0
+                self.updated = now
+            self.rate = max(self.rate * config.RATE_DECREASE, config.RATE_MIN_TPS)
+
+    def on_success(self):
+        # 不限速的桶降速后回升到RATE_CEILING_TPS,未配置时不设上限
+        ceiling = self.target or config.RATE_CEILING_TPS
+        if not self.adaptive or not self.rate or ceiling and self.rate >= ceiling:
+            return
+        with self.lock:
+            # 每条成功响应加increase/rate,约等于每秒回升increase条/秒
+            rate = self.rate + config.RATE_INCREASE / self.rate
+            self.rate = min(ceiling, rate) if ceiling else rate
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.target = rate
+            self.rate = rate
@@ -0,0 +1,186 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import config
+import consts
+
+# 状态报告文本: id:xxx sub:001 dlvrd:001 submit date:yymmddhhmm done date:yymmddhhmm stat:DELIVRD err:000 text:...
+RECEIPT_FIELD = re.compile(rb"(id|sub|dlvrd|submit date|done date|stat|err):(\S*)", re.IGNORECASE)
+RECEIPT_TEXT = re.compile(rb"\btext:", re.IGNORECASE)
+RECEIPT_DATE_FORMATS = {10: "%y%m%d%H%M", 12: "%y%m%d%H%M%S"}
+
+
+def parse_receipt_date(value):
+    """
+    :param value: yymmddhhmm或yymmddhhmmss
+    :return: datetime,格式不对时返回None
+    """
+    fmt = RECEIPT_DATE_FORMATS.get(len(value))
+    if fmt is None:
+        return None
+    try:
+        return datetime.strptime(value.decode(), fmt)
+    except ValueError:
+        return None
+
+
+class Receipt:
+    """
+    解析后的状态报告,文本中缺少的字段为None
+    """
+    __slots__ = ("message_id", "stat", "err", "sub", "dlvrd", "submit_date", "done_date", "text", "message_state",
+                 "network_error_code")
+
+    def __init__(self):
+        self.message_id = None
+        self.stat = None
+        self.err = None
+        self.sub = None
+        self.dlvrd = None
+        self.submit_date = None
+        self.done_date = None
+        self.text = None
+        self.message_state = None
+        self.network_error_code = None
+
+    @property
+    def delivered(self):
+        return self.stat == consts.MESSAGE_STATE_NAMES[consts.MESSAGE_STATE_DELIVERED]
+
+    def __repr__(self):
+        return f"Receipt(message_id:{self.message_id},stat:{self.stat},err:{self.err},done_date:{self.done_date})"
+
+
+def parse_receipt_text(data, receipt=None):
+    """
+    解析id:/sub:/dlvrd:/submit date:/done date:/stat:/err:/text:格式的状态报告文本,字段名不区分大小写
+    :param data: short_message或message_payload
+    :return: Receipt
+    """
+    if receipt is None:
+        receipt = Receipt()
+    match = RECEIPT_TEXT.search(data)
+    if match:
+        receipt.text = data[match.end():]
+        data = data[:match.start()]
+    for key, value in RECEIPT_FIELD.findall(data):
+        key = key.lower()
+        if key == b"id":
+            receipt.message_id = value
+        elif key == b"stat":
+            receipt.stat = value.decode(errors="replace").upper()
+        elif key == b"err":
+            receipt.err = value.decode(errors="replace")
+        elif key == b"submit date":
+            receipt.submit_date = parse_receipt_date(value)
+        elif key == b"done date":
+            receipt.done_date = parse_receipt_date(value)
+        elif value.isdigit():
+            setattr(receipt, key.decode(), int(value))
+    return receipt
+
+
+def parse_receipt(pdu):
+    """
+    从deliver_sm/data_sm中解析状态报告,TLV(receipted_message_id,message_state,network_error_code)优先于文本
+    :param pdu: PDU或PDUView,PDU上没有设置的字段按None处理
+    :return: Receipt,不是状态报告时返回None
+    """
+    # 报文体被截断时esm_class为None
+    if (getattr(pdu, "esm_class", None) or 0) & consts.MSGTYPE_BITMASK != consts.MSGTYPE_SMSC_DELIVERY_RECEIPT:
+        return None
+    data = getattr(pdu, "short_message", None) or getattr(pdu, "message_payload", None) or b""
+    receipt = parse_receipt_text(data.encode() if type(data) == str else bytes(data))
+    message_id = getattr(pdu, "receipted_message_id", None)
+    if message_id:
+        receipt.message_id = message_id
+    message_state = getattr(pdu, "message_state", None)
+    if message_state is not None:
+        receipt.message_state = message_state
+        if receipt.stat is None:
+            receipt.stat = consts.MESSAGE_STATE_NAMES.get(message_state)
+    network_error_code = getattr(pdu, "network_error_code", None)
+    if network_error_code:
+        # 1字节网络类型 + 2字节错误码
+        receipt.network_error_code = network_error_code
+        if receipt.err is None:
+            receipt.err = f"{int.from_bytes(network_error_code[1:], 'big'):03d}"
+    return receipt
+
+
+class Submission:
+    """
+    已被SMSC接受的submit_sm,等待状态报告
+    """
+    __slots__ = ("message_id", "sequence_number", "timestamp", "context")
+
+    def __init__(self, message_id, sequence_number, timestamp, context=None):
+        self.message_id = message_id
+        self.sequence_number = sequence_number
+        # 发送时的time.perf_counter_ns()
+        self.timestamp = timestamp
+        self.context = context
+
+
+class SubmitIndex:
+    """
+    message_id -> Submission的有界索引,超过size条或超过ttl秒未收到状态报告的最早的项被淘汰,匹配是O(1)的.
+    多个绑定共用一个索引,状态报告从哪个绑定回来都能匹配到
+    """
+
+    def __init__(self, size=config.RECEIPT_INDEX_SIZE, ttl=config.RECEIPT_INDEX_TTL):
+        """
+        :param size: 最多保留的条数
+        :param ttl: 等待状态报告的最长时间(秒),0表示不按时间淘汰
+        """
+        self.size = size
+        self.ttl = int(ttl * 1e9)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.matched = 0
+        self.unmatched = 0
+        self.evicted = 0
+
+    def add(self, message_id, sequence_number, timestamp, context=None):
+        submission = Submission(message_id, sequence_number, timestamp, context)
+        with self.lock:
+            self.entries[message_id] = submission
+            self.entries.move_to_end(message_id)
+            self.evict()
+        return submission
+
+    def evict(self):
+        entries = self.entries
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+            self.evicted += 1
+        if self.ttl:
+            deadline = time.perf_counter_ns() - self.ttl
+            while entries and next(iter(entries.values())).timestamp < deadline:
+                entries.popitem(last=False)
+                self.evicted += 1
+
+    def match(self, message_id):
+        """
+        :return: 对应的Submission并从索引中移除,没有时返回None
+        """
+        with self.lock:
+            submission = self.entries.pop(message_id, None)
+            if submission is None:
+                self.unmatched += 1
+            else:
+                self.matched += 1
+            return submission
+
+    def stats(self):
+        return {"pending": len(self.entries), "matched": self.matched, "unmatched": self.unmatched,
+                "evicted": self.evicted}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, message_id):
+        return message_id in self.entries
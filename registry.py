@@ -0,0 +1,66 @@
+from command import command_ids
+from pdu import *
+# tag表在tlv模块中构建,pdu编码可选参数时不需要依赖本模块
+from tlv import tlvs, tlvs_by_name
+
+pdu_classes = {
+    'bind_transmitter': BindTransmitterPDU,
+    'bind_transmitter_resp': BindTransmitterRespPDU,
+    'bind_receiver': BindReceiverPDU,
+    'bind_receiver_resp': BindReceiverRespPDU,
+    'bind_transceiver': BindTransceiverPDU,
+    'bind_transceiver_resp': BindTransceiverRespPDU,
+    'data_sm': DataSMPDU,
+    'data_sm_resp': DataSMRespPDU,
+    'generic_nack': GenericNAckPDU,
+    'submit_sm': SubmitSMPDU,
+    'submit_sm_resp': SubmitSMRespPDU,
+    'deliver_sm': DeliverSMPDU,
+    'deliver_sm_resp': DeliverSMRespPDU,
+    'query_sm': QuerySMPDU,
+    'query_sm_resp': QuerySMRespPDU,
+    'cancel_sm': CancelSMPDU,
+    'cancel_sm_resp': CancelSMRespPDU,
+    'replace_sm': ReplaceSMPDU,
+    'replace_sm_resp': ReplaceSMRespPDU,
+    'outbind': OutbindPDU,
+    'unbind': UnbindPDU,
+    'unbind_resp': UnbindRespPDU,
+    'enquire_link': EnquireLinkPDU,
+    'enquire_link_resp': EnquireLinkRespPDU,
+    'alert_notification': AlertNotificationPDU,
+    'submit_multi': SubmitMultiPDU,
+    'submit_multi_resp': SubmitMultiRespPDU
+}
+
+
+class CommandInfo:
+    def __init__(self, command_id, name, pdu, resp_id=None):
+        self.command_id = command_id
+        self.name = name
+        self.pdu = pdu
+        self.record = get_record_type(pdu)
+        # 请求对应的响应command_id,响应/无需响应的PDU为None
+        self.resp_id = resp_id
+        # SMPPClient上处理收到的该PDU的方法名
+        self.handler = f"parse_{name}"
+
+
+def _build_commands():
+    result = {}
+    for name, command_id in command_ids.items():
+        resp_id = command_ids.get(f"{name}_resp")
+        result[command_id] = CommandInfo(command_id, name, pdu_classes[name], resp_id)
+    return result
+
+
+# 启动时构建一次,解码和分发时按整数command_id直接查表
+commands = _build_commands()
+commands_by_name = {info.name: info for info in commands.values()}
+
+
+def get_command(command_id):
+    try:
+        return commands[command_id]
+    except KeyError:
+        raise Exception('Command id "%#010x" is not supported' % command_id)
@@ -0,0 +1,27 @@
+import itertools
+
+import consts
+
+
+class SequenceAllocator:
+    """
+    一个会话共用的sequence_number分配器.next()在itertools.count上是一次C调用,多线程下不会重复也不需要加锁,
+    结果按SMPP要求落在1~0x7FFFFFFF,超出后从1重新开始
+    """
+
+    def __init__(self, start=1):
+        self.counter = itertools.count(start - 1)
+        # 最近分配的值,只用于展示,多线程下不保证是最新的
+        self.last = start - 1
+
+    def __next__(self):
+        sequence_number = next(self.counter) % consts.SEQUENCE_NUMBER_MAX + 1
+        self.last = sequence_number
+        return sequence_number
+
+    def __iter__(self):
+        return self
+
+    def reset(self, start=1):
+        self.counter = itertools.count(start - 1)
+        self.last = start - 1
@@ -0,0 +1,132 @@
+from functools import lru_cache
+
+import config
+import consts
+from charset import encode_message
+from codec import HEADER, HEADER_SIZE, buffer_pool, send_buffer
+from command import get_command_id
+from tlv import TLV_HEADER, encode_tlv
+
+SUBMIT_SM = get_command_id("submit_sm")
+MESSAGE_PAYLOAD = consts.OPTIONAL_PARAMS["message_payload"]
+# short_message的最大长度(与pdu.py中的声明一致),超过时改放message_payload
+SHORT_MESSAGE_MAX = 254
+
+
+def c_octet(value):
+    """
+    str编码后补NULL结尾,bytes按调用方给出的原样写入(与gen_pack_param一致)
+    """
+    if value is None:
+        return consts.NULL_BYTE
+    if type(value) == str:
+        return value.encode() + consts.NULL_BYTE
+    return value
+
+
+class SubmitSMTemplate:
+    """
+    预编码的submit_sm,静态字段只编码一次,每条消息只修补序列号,目的地址,短消息和command_length
+    """
+
+    def __init__(self, source_addr, destination_addr=None, data_coding=consts.ENCODING_DEFAULT,
+                 registered_delivery=consts.SMSC_DELIVERY_RECEIPT_BOTH, esm_class=0, use_payload=False,
+                 service_type=consts.NULL_BYTE, source_addr_ton=consts.TON_INTL, source_addr_npi=consts.NPI_ISDN,
+                 dest_addr_ton=consts.TON_INTL, dest_addr_npi=consts.NPI_ISDN, protocol_id=consts.PID_DEFAULT,
+                 priority_flag=0, tlvs=()):
+        """
+        :param destination_addr: 为None时每条消息单独指定目的地址
+        :param use_payload: 短消息放在message_payload TLV中,sm_length为0;为False时超过SHORT_MESSAGE_MAX的消息也这样发送
+        :param tlvs: 固定的可选参数((名称, 值), ...)
+        """
+        self.data_coding = data_coding
+        self.use_payload = use_payload
+        self.prefix = c_octet(service_type) + bytes((source_addr_ton, source_addr_npi)) + c_octet(source_addr) + \
+            bytes((dest_addr_ton, dest_addr_npi))
+        # esm_class,protocol_id,priority_flag,schedule_delivery_time,validity_period,registered_delivery,
+        # replace_if_present_flag,data_coding,sm_default_msg_id
+        self.middle = bytes((esm_class, protocol_id, priority_flag, 0, 0, registered_delivery, 0, data_coding, 0))
+        self.suffix = b''.join(encode_tlv(k, v) for k, v in tlvs)
+        self.destination = None if destination_addr is None else c_octet(destination_addr)
+        self.static = None if self.destination is None else self.prefix + self.destination + self.middle
+
+    def encode(self, message):
+        return message if type(message) != str else encode_message(message, self.data_coding)
+
+    def in_payload(self, sm):
+        return self.use_payload or len(sm) > SHORT_MESSAGE_MAX
+
+    def get_destination(self, destination_addr):
+        """
+        :return: 沿用模板中的目的地址时返回None
+        """
+        if destination_addr is None and self.static is not None:
+            return None
+        return c_octet(destination_addr)
+
+    def size(self, sm, destination=None):
+        n = HEADER_SIZE + 1 + len(sm) + len(self.suffix)
+        if destination is None:
+            n += len(self.static)
+        else:
+            n += len(self.prefix) + len(destination) + len(self.middle)
+        if self.in_payload(sm):
+            n += TLV_HEADER.size
+        return n
+
+    def write(self, buf, sequence_number, sm, destination=None):
+        """
+        把一条消息写进buf,静态部分整段拷贝,可变部分原地修补
+        :return: 写入的字节数
+        """
+        pos = HEADER_SIZE
+        segments = (self.static,) if destination is None else (self.prefix, destination, self.middle)
+        for seg in segments:
+            end = pos + len(seg)
+            buf[pos:end] = seg
+            pos = end
+        if self.in_payload(sm):
+            buf[pos] = 0
+            pos += 1
+            end = pos + len(self.suffix)
+            buf[pos:end] = self.suffix
+            TLV_HEADER.pack_into(buf, end, MESSAGE_PAYLOAD, len(sm))
+            pos = end + TLV_HEADER.size
+            end = pos + len(sm)
+            buf[pos:end] = sm
+        else:
+            buf[pos] = len(sm)
+            pos += 1
+            end = pos + len(sm)
+            buf[pos:end] = sm
+            pos = end
+            end = pos + len(self.suffix)
+            buf[pos:end] = self.suffix
+        HEADER.pack_into(buf, 0, end, SUBMIT_SM, 0, sequence_number)
+        return end
+
+    def pack(self, sequence_number, message, destination_addr=None):
+        sm = self.encode(message)
+        destination = self.get_destination(destination_addr)
+        buf = bytearray(self.size(sm, destination))
+        self.write(buf, sequence_number, sm, destination)
+        return buf
+
+    def send(self, sock, sequence_number, message, destination_addr=None, pool=buffer_pool):
+        sm = self.encode(message)
+        destination = self.get_destination(destination_addr)
+        buf = pool.acquire(self.size(sm, destination))
+        try:
+            n = self.write(buf, sequence_number, sm, destination)
+        except BaseException:
+            pool.release(buf)
+            raise
+        send_buffer(sock, buf, n, pool)
+
+
+@lru_cache(maxsize=config.TEMPLATE_CACHE_SIZE)
+def get_template(source_addr, destination_addr=None, **kwargs):
+    """
+    按(源地址, 目的地址, 标志位)缓存模板
+    """
+    return SubmitSMTemplate(source_addr, destination_addr, **kwargs)
@@ -0,0 +1,254 @@
+import struct
+
+import pytest
+
+import consts
+from codec import HEADER_SIZE, PDUView, decode_pdu
+from pdu import TLV, get_record_type, get_tlv_params
+from registry import commands, commands_by_name
+from tlv import encode_tlvs
+
+HEADER = struct.Struct(">IIII")
+# 每种TLV值类型的样例值,用于给带可选参数的PDU追加一项
+TLV_SAMPLES = {int: 7, str: b"tlv", bytes: b"\x01\x02", bool: True}
+
+
+def sample_body(cls, seed=1):
+    """
+    按类上声明的body生成报文体和各必选字段的值,不经过codec的解码计划
+    :return: (bytes, {字段名: 值})
+    """
+    data = b""
+    values = {}
+    for i, (name, param) in enumerate((getattr(cls, "body", None) or {}).items(), seed):
+        if type(param.type) == TLV:
+            continue
+        if getattr(param.type, "body", None):
+            items = []
+            for j in range(values[param.len_field]):
+                item_data, item = sample_body(param.type, seed + i + j)
+                data += item_data
+                items.append(item)
+            values[name] = items
+        elif param.type == int and param.size == 1:
+            # 长度字段在下面按对应的值改写
+            value = 2 if name in ("sm_length", "no_unsuccess", "number_of_dests") else i & 0xFF
+            data += bytes((value,))
+            values[name] = value
+        elif param.type == int:
+            value = i * 0x01010101 & ((1 << param.size * 8) - 1)
+            data += value.to_bytes(param.size, "big")
+            values[name] = value
+        elif param.len_field:
+            value = b"m" * values[param.len_field]
+            data += value
+            values[name] = value
+        else:
+            value = f"{name[:4]}{i}".encode()
+            data += value + b"\x00"
+            values[name] = value
+    return data, values
+
+
+def sample_tlv(cls):
+    """
+    :return: 第一个声明的可选参数及其样例值,没有可选参数时返回None
+    """
+    for name in get_tlv_params(cls):
+        info = consts.OPTIONAL_PARAM_TYPES.get(name)
+        if info and info[0] in TLV_SAMPLES:
+            return name, TLV_SAMPLES[info[0]]
+    return None
+
+
+def build(command_name, sequence_number=5, tlv=True):
+    info = commands_by_name[command_name]
+    body, values = sample_body(info.pdu)
+    item = sample_tlv(info.pdu) if tlv else None
+    if item:
+        body += encode_tlvs([item])
+        values[item[0]] = item[1]
+    data = HEADER.pack(HEADER_SIZE + len(body), info.command_id, 0, sequence_number) + body
+    return data, values
+
+
+def plain(value):
+    """
+    列表字段在PDU中是字典的列表,记录和视图中相同,比较前统一
+    """
+    return [dict(item) for item in value] if isinstance(value, list) else value
+
+
+@pytest.mark.parametrize("command_name", sorted(commands_by_name))
+def test_view_decodes_every_schema(command_name):
+    data, values = build(command_name)
+    view = PDUView(data)
+    assert view.command_id == commands_by_name[command_name].command_id
+    assert view.command_length == len(data)
+    assert view.sequence_number == 5
+    for name, value in values.items():
+        assert plain(getattr(view, name)) == value, name
+
+
+@pytest.mark.parametrize("command_name", sorted(commands_by_name))
+def test_to_pdu_and_to_record_match_decode_pdu(command_name):
+    data, values = build(command_name)
+    view = PDUView(data)
+    pdu = view.to_pdu()
+    record = view.to_record()
+    decoded = decode_pdu(data)
+    assert type(pdu) is commands_by_name[command_name].pdu
+    assert type(record) is get_record_type(type(pdu))
+    for name in record.__slots__:
+        assert plain(getattr(pdu, name)) == plain(getattr(record, name)) == plain(getattr(decoded, name)), name
+    for name, value in values.items():
+        assert plain(getattr(pdu, name)) == value, name
+
+
+def test_lazy_access_decodes_only_up_to_field():
+    data, values = build("submit_sm")
+    view = PDUView(data)
+    assert view.source_addr == values["source_addr"]
+    assert "short_message" not in view._values
+    assert view.short_message == values["short_message"]
+
+
+def test_to_record_leaves_view_cache_alone():
+    data, _ = build("submit_sm_resp")
+    view = PDUView(data)
+    view.to_record()
+    assert "sequence_number" not in view._values
+    assert "command_length" not in view._values
+
+
+def test_view_over_offset_in_shared_buffer():
+    first, _ = build("enquire_link", 1)
+    second, values = build("submit_sm_resp", 2)
+    buf = bytearray(first + second)
+    view = PDUView(buf, len(first))
+    assert view.sequence_number == 2
+    assert view.message_id == values["message_id"]
+    assert view.to_pdu().message_id == values["message_id"]
+
+
+def submit_sm_pdu(**kwargs):
+    body = {
+        "service_type": consts.NULL_BYTE,
+        "source_addr_ton": consts.TON_INTL,
+        "source_addr_npi": consts.NPI_ISDN,
+        "source_addr": "10086",
+        "dest_addr_ton": consts.TON_INTL,
+        "dest_addr_npi": consts.NPI_ISDN,
+        "destination_addr": "13800000000",
+        "esm_class": 0,
+        "protocol_id": consts.PID_DEFAULT,
+        "priority_flag": 0,
+        "schedule_delivery_time": consts.NULL_BYTE,
+        "validity_period": consts.NULL_BYTE,
+        "registered_delivery": consts.SMSC_DELIVERY_RECEIPT_BOTH,
+        "replace_if_present_flag": 0,
+        "data_coding": consts.ENCODING_DEFAULT,
+        "sm_default_msg_id": 0,
+        "short_message": "hello",
+    }
+    body.update(kwargs)
+    cls = commands_by_name["submit_sm"].pdu
+    return cls(command_id=commands_by_name["submit_sm"].command_id, command_status=0, sequence_number=9, **body)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"user_message_reference": 100}, {"message_payload": "payload text"}])
+def test_round_trip_against_pack(kwargs):
+    pdu = submit_sm_pdu(**kwargs)
+    data = pdu.pack()
+    view = PDUView(data)
+    assert view.command_length == pdu.command_length == len(data)
+    assert view.sequence_number == 9
+    assert view.source_addr == b"10086"
+    assert view.destination_addr == b"13800000000"
+    assert view.sm_length == len(view.short_message)
+    for name, value in kwargs.items():
+        if name != "message_payload":
+            assert getattr(view, name) == value
+    if "message_payload" in kwargs:
+        assert view.message_payload == pdu.message_bytes
+        assert view.sm_length == 0
+    else:
+        assert view.short_message == pdu.message_bytes
+    copy = view.to_pdu()
+    record = view.to_record()
+    for name in record.__slots__:
+        assert getattr(copy, name) == getattr(record, name)
+
+
+def test_round_trip_header_only_pdu():
+    cls = commands_by_name["enquire_link"].pdu
+    pdu = cls(command_id=commands_by_name["enquire_link"].command_id, command_status=0, sequence_number=3)
+    buf = bytearray(32)
+    n = pdu.pack_into(buf, 4)
+    view = PDUView(buf, 4)
+    assert n == HEADER_SIZE == view.command_length
+    assert view.command_name == "enquire_link"
+    assert view.to_pdu().sequence_number == 3
+
+
+@pytest.mark.parametrize("cut", [1, 8, 20, 30, 45])
+def test_truncated_body_decodes_prefix(cut):
+    data, values = build("submit_sm", tlv=False)
+    truncated = data[:HEADER_SIZE + cut]
+    view = PDUView(truncated)
+    assert view.command_length == len(data)
+    pdu = view.to_pdu()
+    for name, value in values.items():
+        got = getattr(pdu, name)
+        # 截断位置之后的字段为None,截断处的字符串/短消息只保留已收到的部分
+        assert got is None or got == value or value[:len(got)] == got, name
+
+
+def test_command_length_shorter_than_body():
+    data, values = build("submit_sm_resp")
+    data = HEADER.pack(HEADER_SIZE + 3, *HEADER.unpack_from(data)[1:]) + data[HEADER_SIZE:]
+    view = PDUView(data)
+    assert view.message_id == values["message_id"][:3]
+
+
+def test_unterminated_cstring_stops_at_end():
+    data = HEADER.pack(HEADER_SIZE + 4, commands_by_name["submit_sm_resp"].command_id, 0, 1) + b"abcd"
+    assert PDUView(data).message_id == b"abcd"
+
+
+def test_sm_length_beyond_body():
+    data, values = build("submit_sm", tlv=False)
+    pos = data.index(values["short_message"], HEADER_SIZE)
+    data = data[:pos - 1] + bytes((200,)) + data[pos:]
+    view = PDUView(data)
+    assert view.short_message == values["short_message"]
+    assert view.user_message_reference is None
+
+
+def test_tlv_length_beyond_body():
+    data, _ = build("submit_sm", tlv=False)
+    body = data[HEADER_SIZE:] + struct.pack(">HH", consts.OPTIONAL_PARAMS["user_message_reference"], 10) + b"\x00"
+    data = HEADER.pack(HEADER_SIZE + len(body), commands_by_name["submit_sm"].command_id, 0, 1) + body
+    view = PDUView(data)
+    assert view.user_message_reference == 0
+    assert view.to_pdu().user_message_reference == 0
+
+
+def test_unknown_tlv_is_kept_as_bytes():
+    data, _ = build("submit_sm", tlv=False)
+    body = data[HEADER_SIZE:] + struct.pack(">HH", 0x7FFF, 2) + b"\xab\xcd"
+    data = HEADER.pack(HEADER_SIZE + len(body), commands_by_name["submit_sm"].command_id, 0, 1) + body
+    assert PDUView(data).to_pdu().tlv_0x7fff == b"\xab\xcd"
+
+
+def test_unknown_attribute_raises():
+    data, _ = build("enquire_link")
+    with pytest.raises(AttributeError):
+        PDUView(data).no_such_field
+
+
+def test_unknown_command_id():
+    assert 0x7FFFFFF0 not in commands
+    data = HEADER.pack(HEADER_SIZE, 0x7FFFFFF0, 0, 1)
+    with pytest.raises(Exception, match="not supported"):
+        PDUView(data)
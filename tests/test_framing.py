@@ -0,0 +1,115 @@
+import struct
+
+import pytest
+
+from framing import FrameReader
+
+HEADER = struct.Struct(">IIII")
+
+
+def make_pdu(sequence_number, body=b""):
+    return HEADER.pack(HEADER.size + len(body), 0x15, 0, sequence_number) + body
+
+
+class ChunkSocket:
+    """
+    按给定的分块返回数据,每次recv_into最多返回一块,分块用完后返回0(对端关闭)
+    """
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, view):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        n = min(len(chunk), len(view))
+        view[:n] = chunk[:n]
+        if n < len(chunk):
+            self.chunks.insert(0, chunk[n:])
+        return n
+
+
+def read_all(reader):
+    """
+    :return: 读到对端关闭为止的全部PDU
+    """
+    pdus = []
+    while reader.fill():
+        for offset in reader.frames():
+            length = struct.unpack_from(">I", reader.buf, offset)[0]
+            pdus.append(bytes(reader.buf[offset:offset + length]))
+    return pdus
+
+
+def test_pdu_split_across_reads():
+    pdu = make_pdu(1, b"abcdef")
+    reader = FrameReader(ChunkSocket(pdu[:3], pdu[3:10], pdu[10:]))
+    assert reader.fill() == 3
+    assert list(reader.frames()) == []
+    assert reader.fill() == 7
+    assert list(reader.frames()) == []
+    assert reader.need == len(pdu)
+    assert reader.fill() == len(pdu) - 10
+    assert list(reader.frames()) == [0]
+    assert reader.pending == 0
+
+
+def test_several_pdus_in_one_read():
+    pdus = [make_pdu(i, b"x" * i) for i in range(1, 6)]
+    reader = FrameReader(ChunkSocket(b"".join(pdus)))
+    assert read_all(reader) == pdus
+
+
+def test_partial_pdu_after_complete_ones():
+    first, second = make_pdu(1, b"abc"), make_pdu(2, b"defgh")
+    data = first + second
+    reader = FrameReader(ChunkSocket(data[:len(first) + 5], data[len(first) + 5:]))
+    assert read_all(reader) == [first, second]
+
+
+def test_buffer_grows_for_large_pdu():
+    pdu = make_pdu(1, bytes(range(256)) * 4)
+    reader = FrameReader(ChunkSocket(*[pdu[i:i + 50] for i in range(0, len(pdu), 50)]), size=32)
+    assert read_all(reader) == [pdu]
+    assert len(reader.buf) >= len(pdu)
+
+
+def test_compacts_instead_of_growing():
+    pdus = [make_pdu(i, b"y" * 10) for i in range(10)]
+    data = b"".join(pdus)
+    # 每次读取都跨越PDU边界,缓冲区只够放一个半PDU
+    reader = FrameReader(ChunkSocket(*[data[i:i + 15] for i in range(0, len(data), 15)]), size=40)
+    assert read_all(reader) == pdus
+    assert len(reader.buf) == 40
+
+
+@pytest.mark.parametrize("length", [0, 4, 15])
+def test_command_length_below_header_size(length):
+    reader = FrameReader(ChunkSocket(struct.pack(">IIII", length, 0x15, 0, 1)))
+    reader.fill()
+    with pytest.raises(ValueError):
+        list(reader.frames())
+
+
+def test_command_length_above_max():
+    reader = FrameReader(ChunkSocket(struct.pack(">IIII", 1025, 0x15, 0, 1)), max_length=1024)
+    reader.fill()
+    with pytest.raises(ValueError):
+        list(reader.frames())
+
+
+def test_eof_with_partial_frame():
+    pdu = make_pdu(1, b"abcdef")
+    reader = FrameReader(ChunkSocket(make_pdu(0) + pdu[:-2]))
+    assert read_all(reader) == [make_pdu(0)]
+    assert reader.fill() == 0
+    assert reader.pending == len(pdu) - 2
+
+
+def test_eof_with_partial_length_field():
+    reader = FrameReader(ChunkSocket(b"\x00\x00"))
+    assert reader.fill() == 2
+    assert list(reader.frames()) == []
+    assert reader.fill() == 0
+    assert reader.pending == 2
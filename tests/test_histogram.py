@@ -0,0 +1,23 @@
+from histogram import BUCKET_COUNT, MAX_VALUE, Histogram, bucket_index, bucket_range
+
+
+def test_bucket_count_covers_max_value():
+    assert bucket_index(MAX_VALUE) == BUCKET_COUNT - 1
+    low, high = bucket_range(BUCKET_COUNT - 1)
+    assert low <= MAX_VALUE < high
+
+
+def test_record_extremes():
+    histogram = Histogram()
+    for value in (0, MAX_VALUE, MAX_VALUE + 1):
+        histogram.record(value)
+    assert histogram.total == 3
+    assert histogram.counts[-1] == 2
+    assert histogram.percentile(50) == MAX_VALUE
+    assert histogram.max == MAX_VALUE + 1
+
+
+def test_bucket_range_contains_value():
+    for value in (1, 31, 32, 33, 1000, 123456789, 1 << 40):
+        low, high = bucket_range(bucket_index(value))
+        assert low <= value < high
@@ -0,0 +1,133 @@
+import time
+
+import consts
+from inflight import InFlightTable, TimerWheel
+
+TICK = 0.01
+SLOTS = 8
+
+
+def make_wheel():
+    return TimerWheel(tick=TICK, slots=SLOTS)
+
+
+def later(seconds):
+    return time.monotonic() + seconds
+
+
+def test_schedule_fires_once_after_deadline():
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(0.03, fired.append, "a")
+    assert wheel.advance(later(0)) == 0
+    assert fired == []
+    assert wheel.advance(later(0.05)) == 1
+    assert fired == ["a"]
+    assert wheel.advance(later(0.1)) == 0
+    assert len(wheel) == 0
+
+
+def test_cancel():
+    wheel = make_wheel()
+    fired = []
+    timer = wheel.schedule(0.02, fired.append, "a")
+    wheel.schedule(0.02, fired.append, "b")
+    wheel.cancel(timer)
+    wheel.cancel(timer)
+    wheel.advance(later(0.05))
+    assert fired == ["b"]
+
+
+def test_timer_beyond_one_round_waits_for_next_lap():
+    wheel = make_wheel()
+    fired = []
+    # 超过一圈(SLOTS * TICK)的定时器落在已经经过的槽里,第一次经过时还没到期
+    wheel.schedule(SLOTS * TICK * 1.5, fired.append, "late")
+    wheel.schedule(TICK * 2, fired.append, "early")
+    for step in range(1, SLOTS + 1):
+        wheel.advance(wheel.origin + step * TICK + TICK / 2)
+    assert fired == ["early"]
+    assert len(wheel) == 1
+    for step in range(SLOTS + 1, SLOTS * 2 + 2):
+        wheel.advance(wheel.origin + step * TICK + TICK / 2)
+    assert fired == ["early", "late"]
+
+
+def test_advance_far_behind_checks_every_slot_once():
+    wheel = make_wheel()
+    fired = []
+    for i in range(SLOTS * 3):
+        wheel.schedule(i * TICK / 2, fired.append, i)
+    assert wheel.advance(later(SLOTS * TICK * 10)) == SLOTS * 3
+    assert sorted(fired) == list(range(SLOTS * 3))
+
+
+def test_callback_error_does_not_stop_others():
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(0.01, lambda: 1 / 0)
+    wheel.schedule(0.01, fired.append, "ok")
+    assert wheel.advance(later(0.05)) == 2
+    assert fired == ["ok"]
+
+
+def make_table(expired):
+    return InFlightTable(timeout=0.02, wheel=make_wheel(), on_timeout=expired.append)
+
+
+def test_pop_returns_request_and_cancels_timer():
+    expired = []
+    table = make_table(expired)
+    table.add(1, "submit_sm", context="ctx")
+    entry = table.pop(1, consts.ESME_ROK)
+    assert (entry.command_name, entry.context, entry.command_status) == ("submit_sm", "ctx", consts.ESME_ROK)
+    assert 1 not in table
+    assert table.pop(1) is None
+    table.wheel.advance(later(0.1))
+    assert expired == []
+
+
+def test_expiry_sets_timeout_status():
+    expired = []
+    table = make_table(expired)
+    table.add(1, "submit_sm")
+    table.add(2, "query_sm", timeout=1)
+    table.wheel.advance(later(0.05))
+    assert [(e.sequence_number, e.command_status) for e in expired] == [(1, consts.STATUS_TIMEOUT)]
+    assert 1 not in table and 2 in table
+
+
+def test_generic_nack_finds_original_request():
+    table = make_table([])
+    table.add(7, "submit_sm")
+    table.add(8, "enquire_link")
+    # generic_nack只带sequence_number,按它找回被拒绝的请求
+    entry = table.pop(8, consts.ESME_RINVCMDID)
+    assert (entry.command_name, entry.command_status) == ("enquire_link", consts.ESME_RINVCMDID)
+    assert len(table) == 1
+
+
+def test_re_add_cancels_old_timer():
+    expired = []
+    table = make_table(expired)
+    table.add(1, "submit_sm")
+    table.add(1, "submit_sm", timeout=1)
+    table.wheel.advance(later(0.05))
+    assert expired == []
+    assert len(table.wheel) == 1
+
+
+def test_clear_returns_entries_and_cancels_timers():
+    expired = []
+    table = make_table(expired)
+    table.add(1, "submit_sm")
+    table.add(2, "submit_sm")
+    assert sorted(e.sequence_number for e in table.clear()) == [1, 2]
+    assert len(table) == 0 and len(table.wheel) == 0
+    table.wheel.advance(later(0.1))
+    assert expired == []
+
+
+def test_uses_shared_wheel_even_when_empty():
+    wheel = make_wheel()
+    assert InFlightTable(wheel=wheel).wheel is wheel
@@ -0,0 +1,134 @@
+import threading
+
+import pytest
+
+import consts
+from command import get_command_id
+from metrics import MetricsRegistry
+
+SUBMIT_SM = get_command_id("submit_sm")
+
+
+class Queue:
+    def __init__(self, n):
+        self.items = [None] * n
+
+    def __len__(self):
+        return len(self.items)
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def samples(text):
+    """
+    :return: {指标行左侧: 值},不含HELP/TYPE
+    """
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if line and not line.startswith("#"))
+
+
+def test_counter_from_several_threads():
+    registry = MetricsRegistry()
+    sent = registry.counter("sent_total", "sent", ("command", "session"))
+
+    def work():
+        for _ in range(1000):
+            sent.inc(SUBMIT_SM, "1")
+
+    run_threads(4, work)
+    sent.inc(SUBMIT_SM, "2", amount=5)
+    text = registry.render()
+    assert "# TYPE sent_total counter" in text
+    assert samples(text) == {'sent_total{command="submit_sm",session="1"}': "4000",
+                             'sent_total{command="submit_sm",session="2"}': "5"}
+
+
+def test_exited_thread_shards_are_folded():
+    registry = MetricsRegistry()
+    counter = registry.counter("c_total", "c")
+    run_threads(3, lambda: counter.inc(amount=2))
+    assert samples(registry.render()) == {"c_total": "6"}
+    # 已退出线程的字典并入retired后丢弃,再次输出时不重复计数
+    assert registry.shards == []
+    assert registry.retired
+    counter.inc()
+    assert samples(registry.render()) == {"c_total": "7"}
+
+
+def test_labels_are_formatted_and_grouped():
+    registry = MetricsRegistry()
+    received = registry.counter("r_total", "r", ("command", "status"))
+    received.inc(SUBMIT_SM, consts.ESME_RTHROTTLED)
+    received.inc(0x7FFFFFF0, 0x1234)
+    received.inc(0x7FFFFFF1, None)
+    assert samples(registry.render()) == {
+        'r_total{command="submit_sm",status="ESME_RTHROTTLED"}': "1",
+        'r_total{command="unknown",status="0x00001234"}': "1",
+        'r_total{command="unknown",status="unknown"}': "1",
+    }
+
+
+def test_empty_label_is_omitted():
+    registry = MetricsRegistry()
+    counter = registry.counter("e_total", "e", ("command", "session"))
+    counter.inc("bind", "")
+    assert samples(registry.render()) == {'e_total{command="bind"}': "1"}
+
+
+def test_label_escaping():
+    registry = MetricsRegistry()
+    counter = registry.counter("x_total", "x", ("name",))
+    counter.inc('a"b\\c\nd')
+    assert samples(registry.render()) == {'x_total{name="a\\"b\\\\c\\nd"}': "1"}
+
+
+def test_gauge_tracks_and_sums_objects():
+    registry = MetricsRegistry()
+    gauge = registry.gauge("pending", "pending", ("session",))
+    a, b, c = Queue(2), Queue(3), Queue(4)
+    gauge.track(a, len, "1")
+    gauge.track(b, len, "1")
+    gauge.track(b, len, "1")
+    gauge.track(c, len, "2")
+    gauge.set(10, "3")
+    assert samples(registry.render()) == {'pending{session="1"}': "5", 'pending{session="2"}': "4",
+                                          'pending{session="3"}': "10"}
+    b.items.append(None)
+    del c
+    assert samples(registry.render()) == {'pending{session="1"}': "6", 'pending{session="3"}': "10"}
+    gauge.remove("3")
+    assert samples(registry.render()) == {'pending{session="1"}': "6"}
+
+
+def test_summary_output():
+    registry = MetricsRegistry()
+    latency = registry.summary("latency_seconds", "latency", ("name",), scale=1e-9)
+
+    def work():
+        for value in range(1, 101):
+            latency.observe(value * 1000000, "submit_sm")
+
+    run_threads(2, work)
+    text = registry.render()
+    assert "# TYPE latency_seconds summary" in text
+    values = samples(text)
+    assert values['latency_seconds_count{name="submit_sm"}'] == "200"
+    assert float(values['latency_seconds_sum{name="submit_sm"}']) == pytest.approx(2 * 5050 * 1e-3)
+    median = float(values['latency_seconds{name="submit_sm",quantile="0.5"}'])
+    assert 0.048 <= median <= 0.053
+    assert float(values['latency_seconds{name="submit_sm",quantile="0.999"}']) <= 0.1
+
+
+def test_reset_one_metric():
+    registry = MetricsRegistry()
+    a = registry.counter("a_total", "a")
+    b = registry.counter("b_total", "b")
+    a.inc()
+    b.inc()
+    a.reset()
+    assert samples(registry.render()) == {"b_total": "1"}
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import config
+import consts
+from ratelimit import TokenBucket
+
+
+def test_reserve_within_burst_does_not_wait():
+    bucket = TokenBucket(rate=10, burst=5)
+    assert [bucket.reserve() for _ in range(5)] == [0] * 5
+
+
+def test_reserve_beyond_burst_waits_for_refill():
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.reserve(5)
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_refill_is_capped_at_burst():
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.updated -= 60
+    assert bucket.reserve(5) == 0
+    assert bucket.reserve() > 0
+
+
+def test_unlimited_never_waits():
+    bucket = TokenBucket(rate=0)
+    assert bucket.reserve(1000) == 0
+
+
+def test_parent_limits_child():
+    parent = TokenBucket(rate=10, burst=1)
+    child = TokenBucket(rate=0, parent=parent)
+    assert child.reserve() == 0
+    assert child.reserve() == pytest.approx(0.1, abs=0.01)
+
+
+def test_throttle_halves_rate_once_per_hold():
+    bucket = TokenBucket(rate=100)
+    bucket.feedback(consts.ESME_RTHROTTLED)
+    assert bucket.rate == 100 * config.RATE_DECREASE
+    bucket.feedback(consts.ESME_RMSGQFUL)
+    assert bucket.rate == 100 * config.RATE_DECREASE
+    bucket.backoff_at -= config.RATE_BACKOFF_HOLD
+    bucket.feedback(consts.ESME_RTHROTTLED)
+    assert bucket.rate == 100 * config.RATE_DECREASE ** 2
+
+
+def test_throttle_does_not_go_below_min(monkeypatch):
+    monkeypatch.setattr(config, "RATE_MIN_TPS", 5)
+    bucket = TokenBucket(rate=6)
+    bucket.on_throttled()
+    assert bucket.rate == 5
+
+
+def test_success_increases_up_to_target():
+    bucket = TokenBucket(rate=100)
+    bucket.on_throttled()
+    rate = bucket.rate
+    bucket.feedback(consts.ESME_ROK)
+    assert bucket.rate == rate + config.RATE_INCREASE / rate
+    bucket.rate = 99.99
+    bucket.on_success()
+    assert bucket.rate == 100
+
+
+def test_other_status_does_not_change_rate():
+    bucket = TokenBucket(rate=100)
+    bucket.feedback(consts.ESME_RINVDSTADR)
+    assert bucket.rate == 100
+
+
+def test_not_adaptive_ignores_throttle():
+    bucket = TokenBucket(rate=100, adaptive=False)
+    bucket.on_throttled()
+    assert bucket.rate == 100
+
+
+def test_unlimited_throttle_starts_from_measured_rate(monkeypatch):
+    monkeypatch.setattr(config, "RATE_CEILING_TPS", 0)
+    bucket = TokenBucket(rate=0)
+    bucket.window_start = time.monotonic() - config.RATE_MEASURE_WINDOW
+    bucket.window_count = int(200 * config.RATE_MEASURE_WINDOW)
+    bucket.reserve()
+    assert bucket.measured == pytest.approx(200, rel=0.01)
+    bucket.on_throttled()
+    assert bucket.rate == pytest.approx(200 * config.RATE_DECREASE, rel=0.01)
+    assert bucket.target == 0
+    assert bucket.reserve() > 0
+
+
+def test_unlimited_throttle_without_measurement_uses_ceiling(monkeypatch):
+    monkeypatch.setattr(config, "RATE_CEILING_TPS", 300)
+    bucket = TokenBucket(rate=0)
+    bucket.on_throttled()
+    assert bucket.rate == 300 * config.RATE_DECREASE
+    bucket.rate = 299.99
+    bucket.on_success()
+    assert bucket.rate == 300
+
+
+def test_unlimited_success_before_throttle_stays_unlimited():
+    bucket = TokenBucket(rate=0)
+    bucket.on_success()
+    assert bucket.rate == 0
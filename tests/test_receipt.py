@@ -0,0 +1,88 @@
+import struct
+import time
+from datetime import datetime
+
+import consts
+from codec import PDUView
+from command import get_command_id
+from receipt import SubmitIndex, parse_receipt, parse_receipt_text
+from tlv import encode_tlvs
+
+HEADER = struct.Struct(">IIII")
+DELIVER_SM = get_command_id("deliver_sm")
+TEXT = b"id:abc123 sub:001 dlvrd:001 submit date:2401021530 done date:240102153045 stat:delivrd err:000 text:hello"
+
+
+def deliver_sm(short_message=b"", esm_class=consts.MSGTYPE_SMSC_DELIVERY_RECEIPT, tlvs=()):
+    body = b"\x00" + bytes((1, 1)) + b"src\x00" + bytes((1, 1)) + b"dst\x00" + bytes((esm_class, 0, 0)) + \
+        b"\x00\x00" + bytes((0, 0, 0, 0, len(short_message))) + short_message + encode_tlvs(tlvs)
+    return PDUView(HEADER.pack(HEADER.size + len(body), DELIVER_SM, 0, 1) + body)
+
+
+def test_text_receipt():
+    receipt = parse_receipt(deliver_sm(TEXT))
+    assert receipt.message_id == b"abc123"
+    assert receipt.stat == "DELIVRD"
+    assert receipt.err == "000"
+    assert (receipt.sub, receipt.dlvrd) == (1, 1)
+    assert receipt.submit_date == datetime(2024, 1, 2, 15, 30)
+    assert receipt.done_date == datetime(2024, 1, 2, 15, 30, 45)
+    assert receipt.text == b"hello"
+
+
+def test_tlv_only_receipt():
+    view = deliver_sm(tlvs=(("receipted_message_id", "xyz"), ("message_state", consts.MESSAGE_STATE_UNDELIVERABLE),
+                            ("network_error_code", b"\x03\x00\x0b")))
+    receipt = parse_receipt(view)
+    assert receipt.message_id == b"xyz"
+    assert receipt.message_state == consts.MESSAGE_STATE_UNDELIVERABLE
+    assert receipt.stat == "UNDELIV"
+    assert receipt.err == "011"
+
+
+def test_tlv_takes_precedence_over_text():
+    receipt = parse_receipt(deliver_sm(TEXT, tlvs=(("receipted_message_id", "fromtlv"),)))
+    assert receipt.message_id == b"fromtlv"
+    assert receipt.stat == "DELIVRD"
+
+
+def test_not_a_receipt():
+    assert parse_receipt(deliver_sm(TEXT, esm_class=0)) is None
+
+
+def test_truncated_body_is_not_a_receipt():
+    data = HEADER.pack(HEADER.size + 3, DELIVER_SM, 0, 1) + b"\x00\x01\x01"
+    assert parse_receipt(PDUView(data)) is None
+
+
+def test_text_fields_are_case_insensitive():
+    receipt = parse_receipt_text(b"ID:1 STAT:EXPIRED Err:042 Submit Date:bad")
+    assert (receipt.message_id, receipt.stat, receipt.err, receipt.submit_date) == (b"1", "EXPIRED", "042", None)
+
+
+def test_index_match_removes_entry():
+    index = SubmitIndex(size=10, ttl=0)
+    index.add(b"a", 1, time.perf_counter_ns())
+    submission = index.match(b"a")
+    assert submission.sequence_number == 1
+    assert index.match(b"a") is None
+    assert index.stats() == {"pending": 0, "matched": 1, "unmatched": 1, "evicted": 0}
+
+
+def test_index_evicts_oldest_over_size():
+    index = SubmitIndex(size=2, ttl=0)
+    now = time.perf_counter_ns()
+    for i, message_id in enumerate((b"a", b"b", b"c")):
+        index.add(message_id, i, now)
+    assert b"a" not in index and b"c" in index
+    assert index.evicted == 1
+
+
+def test_index_evicts_expired():
+    index = SubmitIndex(size=10, ttl=1)
+    now = time.perf_counter_ns()
+    index.add(b"old", 1, now - 2 * 10 ** 9)
+    index.add(b"new", 2, now)
+    assert b"old" not in index
+    assert index.match(b"new") is not None
+    assert index.evicted == 1
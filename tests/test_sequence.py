@@ -0,0 +1,53 @@
+import threading
+
+import consts
+from sequence import SequenceAllocator
+
+MAX = consts.SEQUENCE_NUMBER_MAX
+
+
+def test_starts_at_one():
+    sequence = SequenceAllocator()
+    assert [next(sequence) for _ in range(3)] == [1, 2, 3]
+    assert sequence.last == 3
+
+
+def test_wraps_after_max_to_one():
+    sequence = SequenceAllocator(MAX - 1)
+    assert [next(sequence) for _ in range(4)] == [MAX - 1, MAX, 1, 2]
+
+
+def test_reset():
+    sequence = SequenceAllocator()
+    next(sequence)
+    sequence.reset(MAX)
+    assert [next(sequence), next(sequence)] == [MAX, 1]
+
+
+def test_concurrent_next_is_unique_across_wrap():
+    threads, per_thread = 8, 5000
+    start = MAX - threads * per_thread // 2
+    sequence = SequenceAllocator(start)
+    results = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads)
+
+    def worker(out):
+        barrier.wait()
+        for _ in range(per_thread):
+            out.append(next(sequence))
+
+    workers = [threading.Thread(target=worker, args=(out,)) for out in results]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    values = [value for out in results for value in out]
+    assert len(set(values)) == len(values) == threads * per_thread
+    expected = set(range(start, MAX + 1)) | set(range(1, threads * per_thread - (MAX - start)))
+    assert set(values) == expected
+    # 每个线程取到的值在本线程内按分配顺序递增(跨过上限后从1重新开始)
+    for out in results:
+        before = [value for value in out if value >= start]
+        wrapped = [value for value in out if value < start]
+        assert out == before + wrapped
+        assert before == sorted(before) and wrapped == sorted(wrapped)
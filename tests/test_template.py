@@ -0,0 +1,28 @@
+import consts
+from codec import PDUView
+from template import SHORT_MESSAGE_MAX, SubmitSMTemplate
+
+
+def test_short_message_up_to_max():
+    view = PDUView(bytes(SubmitSMTemplate("src", "dst").pack(1, b"a" * SHORT_MESSAGE_MAX)))
+    assert view.get("sm_length") == SHORT_MESSAGE_MAX
+    assert view.get("short_message") == b"a" * SHORT_MESSAGE_MAX
+    assert view.get("message_payload") is None
+
+
+def test_long_message_falls_back_to_payload():
+    template = SubmitSMTemplate("src", "dst", tlvs=(("user_message_reference", 5),))
+    message = b"b" * (SHORT_MESSAGE_MAX + 1)
+    data = bytes(template.pack(1, message))
+    view = PDUView(data)
+    assert view.command_length == len(data)
+    assert view.get("sm_length") == 0
+    assert view.get("message_payload") == message
+    assert view.get("user_message_reference") == 5
+
+
+def test_payload_template_matches_pdu_size():
+    template = SubmitSMTemplate("src", use_payload=True, data_coding=consts.ENCODING_DEFAULT)
+    message = b"c" * 10
+    destination = template.get_destination("dst")
+    assert len(template.pack(1, message, "dst")) == template.size(message, destination)
@@ -0,0 +1,100 @@
+import struct
+
+import pytest
+
+import consts
+from tlv import decode_tlvs, encode_tlv, encode_tlvs, find_tlv, get_tlv_name, iter_tlvs, tlvs_by_name
+
+TAG = consts.OPTIONAL_PARAMS
+
+
+def tlv(tag, value):
+    return struct.pack(">HH", tag, len(value)) + value
+
+
+def test_encode_int_uses_declared_length():
+    assert encode_tlv("user_message_reference", 0x102) == tlv(TAG["user_message_reference"], b"\x01\x02")
+    assert encode_tlv("more_messages_to_send", 1) == tlv(TAG["more_messages_to_send"], b"\x01")
+
+
+def test_encode_str_adds_null():
+    assert encode_tlv("receipted_message_id", "abc") == tlv(TAG["receipted_message_id"], b"abc\x00")
+
+
+def test_encode_bytes_as_is():
+    assert encode_tlv("network_error_code", b"\x03\x00\x01") == tlv(TAG["network_error_code"], b"\x03\x00\x01")
+    # str参数给bytes时不补NULL
+    assert encode_tlv("receipted_message_id", b"abc") == tlv(TAG["receipted_message_id"], b"abc")
+    assert encode_tlv("message_payload", bytearray(b"hi")) == tlv(TAG["message_payload"], b"hi")
+
+
+def test_encode_bool_has_no_value():
+    assert encode_tlv("alert_on_message_delivery", True) == tlv(TAG["alert_on_message_delivery"], b"")
+
+
+def test_encode_unknown_name():
+    with pytest.raises(KeyError):
+        encode_tlv("no_such_param", 1)
+
+
+def test_encode_tlvs_skips_none():
+    data = encode_tlvs([("user_message_reference", 7), ("source_port", None), ("receipted_message_id", "x")])
+    assert data == tlv(TAG["user_message_reference"], b"\x00\x07") + tlv(TAG["receipted_message_id"], b"x\x00")
+
+
+def test_decode_round_trip():
+    items = [("user_message_reference", 7), ("receipted_message_id", "abc"), ("network_error_code", b"\x03\x00\x01"),
+             ("alert_on_message_delivery", True), ("message_payload", b"payload")]
+    values = decode_tlvs(encode_tlvs(items))
+    assert values == {"user_message_reference": 7, "receipted_message_id": b"abc",
+                      "network_error_code": b"\x03\x00\x01", "alert_on_message_delivery": True,
+                      "message_payload": b"payload"}
+
+
+def test_decode_unknown_tag_as_bytes():
+    data = tlv(0x7FFF, b"\xab\xcd") + tlv(TAG["source_port"], b"\x1f\x90")
+    assert decode_tlvs(data) == {"tlv_0x7fff": b"\xab\xcd", "source_port": 8080}
+    assert get_tlv_name(0x7FFF) == "tlv_0x7fff"
+
+
+def test_decode_range_and_existing_dict():
+    data = b"head" + encode_tlvs([("source_port", 1)]) + b"tail"
+    values = {"message_id": b"m"}
+    assert decode_tlvs(data, 4, len(data) - 4, values) is values
+    assert values == {"message_id": b"m", "source_port": 1}
+
+
+def test_decode_ignores_incomplete_header():
+    data = encode_tlvs([("source_port", 1)]) + b"\x02\x04\x00"
+    assert decode_tlvs(data) == {"source_port": 1}
+
+
+def test_decode_value_cut_by_end():
+    data = struct.pack(">HH", TAG["message_payload"], 10) + b"abc"
+    assert decode_tlvs(data) == {"message_payload": b"abc"}
+
+
+def test_iter_tlvs_yields_tag_name_value():
+    data = encode_tlvs([("source_port", 1), ("receipted_message_id", "id")])
+    assert list(iter_tlvs(data)) == [(TAG["source_port"], "source_port", 1),
+                                     (TAG["receipted_message_id"], "receipted_message_id", b"id")]
+
+
+def test_find_tlv():
+    data = b"xx" + encode_tlvs([("message_payload", b"p" * 100), ("source_port", 2), ("source_port", 3)])
+    assert find_tlv(data, 2, len(data), TAG["source_port"]) == 2
+    assert find_tlv(data, 2, len(data), TAG["message_payload"]) == b"p" * 100
+    assert find_tlv(data, 2, len(data), TAG["receipted_message_id"]) is None
+    assert find_tlv(data, 2, 6, TAG["source_port"]) is None
+
+
+def test_find_unknown_tag():
+    data = tlv(0x7FFE, b"\x01")
+    assert find_tlv(data, 0, len(data), 0x7FFE) == b"\x01"
+
+
+def test_table_matches_consts():
+    for name, tag in consts.OPTIONAL_PARAMS.items():
+        info = tlvs_by_name[name]
+        assert info.tag == tag
+        assert (info.type, info.length) == consts.OPTIONAL_PARAM_TYPES.get(name, (bytes, None))
@@ -0,0 +1,127 @@
+import socket
+import struct
+
+from codec import BufferPool, send_pdu
+from command import get_command_id
+from registry import pdu_classes
+from writer import PRIORITY_HIGH, SocketWriter
+
+HEADER = struct.Struct(">IIII")
+DELIVER_SM_RESP = get_command_id("deliver_sm_resp")
+SUBMIT_SM = get_command_id("submit_sm")
+ENQUIRE_LINK = get_command_id("enquire_link")
+
+
+def make_pdu(command_id, sequence_number, body=b"\x00"):
+    return HEADER.pack(HEADER.size + len(body), command_id, 0, sequence_number) + body
+
+
+def read_pdus(sock, count):
+    """
+    :return: 按收到顺序的[(command_id, sequence_number)]
+    """
+    pdus = []
+    buf = b""
+    sock.settimeout(5)
+    while len(pdus) < count:
+        buf += sock.recv(65536)
+        while len(buf) >= HEADER.size:
+            command_length, command_id, _, sequence_number = HEADER.unpack_from(buf)
+            if len(buf) < command_length:
+                break
+            pdus.append((command_id, sequence_number))
+            buf = buf[command_length:]
+    return pdus
+
+
+def test_high_priority_burst_is_split_into_batches():
+    a, b = socket.socketpair()
+    errors = []
+    writer = SocketWriter(a, batch=64, on_error=errors.append)
+    count = 2000
+    for i in range(count):
+        writer.sendall(make_pdu(DELIVER_SM_RESP, i), PRIORITY_HIGH)
+    writer.start()
+    try:
+        pdus = read_pdus(b, count)
+        assert writer.flush(5)
+        assert not errors
+        assert pdus == [(DELIVER_SM_RESP, i) for i in range(count)]
+        assert writer.writes >= count // 64
+    finally:
+        writer.close()
+        a.close()
+        b.close()
+
+
+def test_responses_are_sent_before_queued_requests():
+    a, b = socket.socketpair()
+    writer = SocketWriter(a, batch=4)
+    for i in range(3):
+        writer.sendall(make_pdu(SUBMIT_SM, i))
+    for i in range(3):
+        writer.sendall(make_pdu(DELIVER_SM_RESP, 100 + i))
+    writer.start()
+    try:
+        pdus = read_pdus(b, 6)
+        assert [command_id for command_id, _ in pdus[:3]] == [DELIVER_SM_RESP] * 3
+        assert [sequence_number for _, sequence_number in pdus[3:]] == [0, 1, 2]
+    finally:
+        writer.close()
+        a.close()
+        b.close()
+
+
+def test_flush_raises_after_peer_closed():
+    a, b = socket.socketpair()
+    errors = []
+    writer = SocketWriter(a, on_error=errors.append).start()
+    b.close()
+    try:
+        for i in range(100):
+            try:
+                writer.sendall(make_pdu(SUBMIT_SM, i, b"\x00" * 1024))
+            except OSError:
+                break
+        try:
+            writer.flush(5)
+        except OSError:
+            pass
+        else:
+            raise AssertionError("flush没有抛出发送失败的异常")
+        assert errors
+    finally:
+        writer.close()
+        a.close()
+
+
+def test_send_pdu_hands_pooled_buffer_to_writer():
+    pool = BufferPool(size=64, count=4)
+    a, b = socket.socketpair()
+    writer = SocketWriter(a, pool=pool).start()
+    try:
+        pdu = pdu_classes["enquire_link"](command_id=ENQUIRE_LINK, command_status=0, sequence_number=9)
+        send_pdu(writer, pdu, pool)
+        # 缓冲区交给写线程,发出后才归还
+        writer.flush(5)
+        assert read_pdus(b, 1) == [(ENQUIRE_LINK, 9)]
+        assert len(pool._free) == 1
+    finally:
+        writer.close()
+        a.close()
+        b.close()
+
+
+def test_send_pdu_to_other_pool_copies():
+    pool = BufferPool(size=64, count=4)
+    a, b = socket.socketpair()
+    writer = SocketWriter(a).start()
+    try:
+        pdu = pdu_classes["enquire_link"](command_id=ENQUIRE_LINK, command_status=0, sequence_number=3)
+        send_pdu(writer, pdu, pool)
+        assert len(pool._free) == 1
+        assert read_pdus(b, 1) == [(ENQUIRE_LINK, 3)]
+    finally:
+        writer.close()
+        a.close()
+        b.close()
@@ -0,0 +1,124 @@
+import struct
+
+import consts
+
+# 本模块只依赖consts,pdu和registry都可以在模块顶部导入
+TLV_HEADER = struct.Struct(">2H")
+# consts.OPTIONAL_PARAM_TYPES中没有的tag按bytes处理
+UNKNOWN_TLV_TYPE = bytes
+
+
+class TLVInfo:
+    def __init__(self, tag, name, type=bytes, length=None):
+        self.tag = tag
+        self.name = name
+        self.type = type
+        self.length = length
+
+
+def _build_tlvs():
+    """
+    tag与名称来自consts.OPTIONAL_PARAMS,值类型和长度来自consts.OPTIONAL_PARAM_TYPES
+    """
+    result = {}
+    for name, tag in consts.OPTIONAL_PARAMS.items():
+        result[tag] = TLVInfo(tag, name, *consts.OPTIONAL_PARAM_TYPES.get(name, (UNKNOWN_TLV_TYPE, None)))
+    return result
+
+
+# 启动时构建一次,编解码时按整数tag直接查表
+tlvs = _build_tlvs()
+tlvs_by_name = {info.name: info for info in tlvs.values()}
+
+
+def get_tlv_name(tag):
+    """
+    未知的tag以tlv_0x????命名
+    """
+    info = tlvs.get(tag)
+    return info.name if info else f"tlv_{tag:#06x}"
+
+
+def encode_value(tag, value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    info = tlvs.get(tag)
+    value_type = info.type if info else UNKNOWN_TLV_TYPE
+    if value_type == int:
+        return value.to_bytes(info.length, "big")
+    if value_type == bool:
+        return b''
+    if type(value) == str:
+        value = value.encode()
+        if value_type == str:
+            value += consts.NULL_BYTE
+    return value
+
+
+def encode_tlv(name, value):
+    """
+    按consts.OPTIONAL_PARAM_TYPES编码一个可选参数,值为bytes时按原样写入
+    """
+    tag = tlvs_by_name[name].tag
+    value = encode_value(tag, value)
+    return TLV_HEADER.pack(tag, len(value)) + value
+
+
+def encode_tlvs(items):
+    """
+    :param items: [(名称, 值)],值为None的参数不编码
+    """
+    return b''.join(encode_tlv(name, value) for name, value in items if value is not None)
+
+
+def decode_value(tag, value):
+    info = tlvs.get(tag)
+    value_type = info.type if info else UNKNOWN_TLV_TYPE
+    if value_type == int:
+        return int.from_bytes(value, "big")
+    if value_type == bool:
+        return True
+    if value_type == str and value[-1:] == consts.NULL_BYTE:
+        return value[:-1]
+    return value
+
+
+def iter_tlvs(data, pos=0, end=None):
+    """
+    惰性遍历TLV链,只在取到某一项时才解码它的值
+    :return: (tag, 名称, 值)
+    """
+    if end is None:
+        end = len(data)
+    while pos + 4 <= end:
+        tag, length = TLV_HEADER.unpack_from(data, pos)
+        pos += 4
+        value = bytes(data[pos:pos + length])
+        pos += length
+        yield tag, get_tlv_name(tag), decode_value(tag, value)
+
+
+def find_tlv(data, pos, end, tag):
+    """
+    只读各项的tag/length跳过不需要的参数,返回第一个匹配tag的值,没有时返回None
+    """
+    while pos + 4 <= end:
+        t, length = TLV_HEADER.unpack_from(data, pos)
+        pos += 4
+        if t == tag:
+            return decode_value(tag, bytes(data[pos:pos + length]))
+        pos += length
+    return None
+
+
+def decode_tlvs(data, pos=0, end=None, values=None):
+    """
+    解码全部TLV,PDU和PDUView都通过这里解码报文体尾部的可选参数
+    :param values: 写入的字典,为None时新建
+    :return: {名称: 值}
+    """
+    if values is None:
+        values = {}
+    for _, name, value in iter_tlvs(data, pos, end):
+        values[name] = value
+    return values
@@ -0,0 +1,191 @@
+import logging
+import socket
+import threading
+from collections import deque
+
+import config
+import consts
+from codec import LONG, buffer_pool
+from command import get_command_id
+from metrics import count_sent
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+# 除响应外优先发送的请求,链路检测和解绑不能排在大量submit后面
+URGENT_REQUESTS = {get_command_id("enquire_link"), get_command_id("unbind")}
+
+
+def get_priority(data):
+    """
+    按PDU头中的command_id判断优先级,响应和enquire_link/unbind优先,不完整的数据按普通处理
+    """
+    if len(data) < 8:
+        return PRIORITY_NORMAL
+    command_id = LONG.unpack_from(data, 4)[0]
+    if command_id & consts.COMMAND_RESP_BIT or command_id in URGENT_REQUESTS:
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+def consume(buffers, n):
+    """
+    从待发送的memoryview列表头部去掉已发出的n字节
+    """
+    while buffers and n >= len(buffers[0]):
+        n -= len(buffers.pop(0))
+    if n:
+        buffers[0] = buffers[0][n:]
+
+
+def set_nodelay(sock, enabled=config.TCP_NODELAY):
+    """
+    写线程自己合并小包,关闭Nagle算法避免合并后的数据再被内核延迟
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if enabled else 0)
+
+
+class SocketWriter:
+    """
+    每个连接一个写线程,从两条优先级队列取出待发送的PDU,每次唤醒用一次sendmsg发出一批.
+    提供和socket相同的sendall,可以直接传给send_pdu和Template.send,二者编码用的池缓冲区交给写线程,发出后再归还
+    """
+
+    def __init__(self, sock, batch=config.WRITER_BATCH, max_pending=config.WRITER_QUEUE_SIZE, on_error=None,
+                 session="", pool=buffer_pool):
+        """
+        :param batch: 一次sendmsg最多合并的PDU数
+        :param max_pending: 普通队列的长度上限,队列满时sendall阻塞;优先队列不限长度,读线程发响应时不会被阻塞
+        :param on_error: 发送失败时在写线程中调用,参数为异常
+        :param session: 发送计数的session标签,计数在写线程中进行
+        :param pool: send_pdu/Template.send用同一个池时不拷贝缓冲区
+        """
+        self.sock = sock
+        self.session = session
+        self.pool = pool
+        self.lanes = (deque(), deque())
+        self.batch = batch
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self.cond = threading.Condition()
+        self.running = True
+        # 写线程正在发送的一批,flush要等它发完
+        self.busy = False
+        self.error = None
+        # 调用sendmsg的次数和发出的PDU数
+        self.writes = 0
+        self.sent = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def sendall(self, data, priority=None, owned=False):
+        """
+        拷贝data后放入队列,由写线程发送
+        :param priority: 为None时按PDU头判断
+        :param owned: data是self.pool中缓冲区的memoryview,不拷贝,发出后由写线程归还
+        """
+        if priority is None:
+            priority = get_priority(data)
+        if not owned:
+            data = bytes(data)
+        with self.cond:
+            if priority != PRIORITY_HIGH:
+                while self.running and len(self.lanes[PRIORITY_NORMAL]) >= self.max_pending:
+                    self.cond.wait()
+            if not self.running:
+                raise self.error or ConnectionError("写线程已停止")
+            self.lanes[priority].append(data)
+            self.cond.notify_all()
+
+    def take(self):
+        """
+        取出一批待发送的数据,最多batch个,先取优先队列,剩余名额给普通队列
+        :return: 已停止且没有数据时返回None
+        """
+        high, normal = self.lanes
+        with self.cond:
+            while self.running and not high and not normal:
+                self.cond.wait()
+            if not self.running:
+                return None
+            batch = []
+            while high and len(batch) < self.batch:
+                batch.append(high.popleft())
+            while normal and len(batch) < self.batch:
+                batch.append(normal.popleft())
+            self.busy = True
+            self.cond.notify_all()
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.take()
+            if batch is None:
+                break
+            try:
+                self.write(batch)
+            except OSError as e:
+                with self.cond:
+                    self.error = e
+                    self.running = False
+                    self.busy = False
+                    for lane in self.lanes:
+                        lane.clear()
+                    self.cond.notify_all()
+                if self.on_error:
+                    self.on_error(e)
+                break
+            # 先计数再归还缓冲区,归还后缓冲区可能被其他线程重新写入;都在清除busy之前,flush返回时已归还
+            count_sent(batch, self.session)
+            self.release(batch)
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+    def release(self, batch):
+        """
+        归还sendall(owned=True)放入的池缓冲区,只有这种数据以memoryview保存
+        """
+        for data in batch:
+            if isinstance(data, memoryview):
+                self.pool.release(data.obj)
+
+    def write(self, batch):
+        self.sent += len(batch)
+        if not hasattr(self.sock, "sendmsg"):
+            self.writes += 1
+            self.sock.sendall(b"".join(batch))
+            return
+        buffers = [memoryview(data) for data in batch]
+        while buffers:
+            n = self.sock.sendmsg(buffers)
+            self.writes += 1
+            # 部分发送时跳过已发出的部分继续
+            consume(buffers, n)
+
+    def flush(self, timeout=None):
+        """
+        等待队列中的数据全部发出
+        :raise OSError: 写线程发送失败
+        """
+        with self.cond:
+            done = self.cond.wait_for(lambda: not self.running or not (self.busy or any(self.lanes)), timeout)
+            if self.error:
+                raise self.error
+            return done
+
+    def close(self):
+        """
+        停止写线程,丢弃未发送的数据
+        """
+        with self.cond:
+            self.running = False
+            for lane in self.lanes:
+                lane.clear()
+            self.cond.notify_all()
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)